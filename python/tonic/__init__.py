@@ -2,7 +2,258 @@
 Core Module for Tonic Data Generation
 """
 
-import sys, os, json
+import sys, os, json, string, errno, itertools, hashlib, threading, random, time
+
+from multiprocessing.pool import ThreadPool
+
+from tonic.storage import FileSystemStorage, MemoryStorage, CompressedStorage, DeduplicatedStorage, codecs
+from tonic.profiler import StageProfiler, nullProfiler
+
+# -----------------------------------------------------------------------------
+# Path template helper
+# -----------------------------------------------------------------------------
+
+class PathTemplate(object):
+    """
+    Data pattern compiled once into a '%' template with the ordered list
+    of argument names it references. Patterns using format specs or
+    conversions fall back to str.format.
+    """
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.fields = []
+        self.template = None
+
+        chunks = []
+        for literal, field, spec, conversion in string.Formatter().parse(pattern):
+            chunks.append(literal.replace('%', '%%'))
+            if field is None:
+                continue
+            if spec or conversion:
+                self.fields = None
+                return
+            chunks.append('%s')
+            self.fields.append(field)
+
+        self.template = ''.join(chunks)
+
+    def format(self, values):
+        if self.template is None:
+            return self.pattern.format(**values)
+        return self.template % tuple(values[field] for field in self.fields)
+
+def makeDirectory(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+# -----------------------------------------------------------------------------
+# Work item helpers
+# -----------------------------------------------------------------------------
+
+def partitionWorkItems(workItems, nbParts, partIdx, strategy='block', cost=None):
+    """
+    Return the share of workItems that belongs to partIdx out of nbParts.
+    Strategies:
+     - block: contiguous ranges of (almost) equal size
+     - round-robin: every nbParts-th item starting at partIdx
+     - cost: greedy balancing of cost(workItem), original order preserved
+    """
+    if partIdx < 0 or partIdx >= nbParts:
+        raise ValueError('Invalid partition %d for %d parts' % (partIdx, nbParts))
+
+    if strategy == 'block':
+        size, remainder = divmod(len(workItems), nbParts)
+        start = partIdx * size + min(partIdx, remainder)
+        end = start + size + (1 if partIdx < remainder else 0)
+        return workItems[start:end]
+
+    if strategy == 'round-robin':
+        return workItems[partIdx::nbParts]
+
+    if strategy == 'cost':
+        if not cost:
+            raise ValueError('A cost function is required for cost partitioning')
+        loads = [ 0.0 for i in range(nbParts) ]
+        owners = [ 0 for item in workItems ]
+        costs = [ cost(item) for item in workItems ]
+        for itemIdx in sorted(range(len(workItems)), key=lambda i: -costs[i]):
+            owner = loads.index(min(loads))
+            owners[itemIdx] = owner
+            loads[owner] += costs[itemIdx]
+        return [ workItems[i] for i in range(len(workItems)) if owners[i] == partIdx ]
+
+    raise ValueError('Unknown partition strategy: %s' % strategy)
+
+def _mergeDescriptorValue(dest, src, isRange=False):
+    if isinstance(dest, dict) and isinstance(src, dict):
+        for key, value in src.iteritems():
+            if key in dest:
+                dest[key] = _mergeDescriptorValue(dest[key], value, isRange or key == 'ranges')
+            else:
+                dest[key] = value
+        return dest
+
+    if isinstance(dest, list) and isinstance(src, list):
+        if isRange and len(dest) == 2 and len(src) == 2:
+            return [ min(dest[0], src[0]), max(dest[1], src[1]) ]
+        merged = list(dest)
+        for value in src:
+            if value not in merged:
+                merged.append(value)
+        return merged
+
+    return dest
+
+def _resolveDescriptorReferences(basePath, value):
+    if isinstance(value, dict):
+        if len(value) == 1 and 'href' in value:
+            with open(os.path.join(basePath, value['href']), 'r') as f:
+                return json.load(f)
+        for key in value:
+            value[key] = _resolveDescriptorReferences(basePath, value[key])
+    return value
+
+def loadDataDescriptor(basePath, fileName='index.json'):
+    """
+    Load a dataset descriptor and inline the content of its sidecar files.
+    """
+    with open(os.path.join(basePath, fileName), 'r') as f:
+        descriptor = json.load(f)
+
+    for key, value in descriptor.iteritems():
+        if key != 'data':
+            descriptor[key] = _resolveDescriptorReferences(basePath, value)
+
+    return descriptor
+
+def _mergeOutputStatistics(dest, src):
+    # Each worker only accounts for its own partition
+    for field in ['files', 'bytes', 'rawBytes', 'writeTime']:
+        dest[field] = dest.get(field, 0) + src.get(field, 0)
+    dest['ratio'] = float(dest['rawBytes']) / dest['bytes'] if dest['bytes'] else 1.0
+
+def _mergeMetadata(dest, src):
+    destOutput = dest.pop('output', None)
+    srcOutput = src.pop('output', None)
+    _mergeDescriptorValue(dest, src)
+    if destOutput and srcOutput:
+        _mergeOutputStatistics(destOutput, srcOutput)
+    if destOutput or srcOutput:
+        dest['output'] = destOutput or srcOutput
+
+def _mergePackedStorage(dest, src):
+    # Pack indices are local to each worker, remap them by pack name
+    packIndex = dict((packName, idx) for idx, packName in enumerate(dest['packs']))
+    remap = []
+    for packName in src['packs']:
+        if packName not in packIndex:
+            packIndex[packName] = len(dest['packs'])
+            dest['packs'].append(packName)
+        remap.append(packIndex[packName])
+
+    for relativePath, (packIdx, offset, size) in src['entries'].iteritems():
+        dest['entries'][relativePath] = [ remap[packIdx], offset, size ]
+
+def mergeDataDescriptors(basePath, fileNames, output='index.json'):
+    """
+    Merge the partial descriptors written by independent workers into a
+    single descriptor. Data entries are merged by name, lists are unioned,
+    [min, max] ranges are expanded, output statistics are summed and pack
+    entries point to the merged list of packs.
+    """
+    merged = None
+    for fileName in fileNames:
+        descriptor = loadDataDescriptor(basePath, fileName)
+
+        if merged is None:
+            merged = descriptor
+            continue
+
+        mergedData = dict((item['name'], item) for item in merged['data'])
+        for item in descriptor.pop('data'):
+            if item['name'] not in mergedData:
+                merged['data'].append(item)
+                mergedData[item['name']] = item
+            else:
+                _mergeMetadata(mergedData[item['name']].setdefault('metadata', {}), item.pop('metadata', {}))
+                _mergeDescriptorValue(mergedData[item['name']], item)
+
+        _mergeMetadata(merged.setdefault('metadata', {}), descriptor.pop('metadata', {}))
+
+        if 'PackedStorage' in descriptor:
+            if 'PackedStorage' in merged:
+                _mergePackedStorage(merged['PackedStorage'], descriptor.pop('PackedStorage'))
+            else:
+                merged['PackedStorage'] = descriptor.pop('PackedStorage')
+
+        _mergeDescriptorValue(merged, descriptor)
+
+    with open(os.path.join(basePath, output), 'w') as f:
+        f.write(json.dumps(merged))
+
+    return merged
+
+def getProgressiveLevels(count, stride):
+    """
+    Split range(count) into coarse-to-fine levels: every stride-th index
+    first, then the gaps filled while halving the stride down to 1.
+    """
+    levels = []
+    visited = set()
+    stride = max(1, stride)
+    while True:
+        level = [ i for i in range(0, count, stride) if i not in visited ]
+        if level:
+            levels.append(level)
+            visited.update(level)
+        if stride == 1:
+            return levels
+        stride = max(1, stride // 2)
+
+# -----------------------------------------------------------------------------
+# Data Context
+# -----------------------------------------------------------------------------
+
+class DataContext(object):
+    """
+    Immutable snapshot of the argument indices captured at iteration time.
+    It resolves data paths on any thread, independently of the handler's
+    current state.
+    """
+    __slots__ = ('_handler', '_indices')
+
+    def __init__(self, dataHandler, indices):
+        object.__setattr__(self, '_handler', dataHandler)
+        object.__setattr__(self, '_indices', dict(indices))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('DataContext is immutable')
+
+    def getArguments(self):
+        return dict(self._indices)
+
+    def getValue(self, name):
+        return self._handler.realValues[name][self._indices[name]]
+
+    def getDataAbsoluteFilePath(self, name, createDirectories=True):
+        return self._handler._resolveDataPath(name, self._indices, createDirectories)
+
+    def markDataWritten(self, *names):
+        for name in names:
+            self._handler.markFileWritten(self.getDataAbsoluteFilePath(name, False))
+
+    def isDataWritten(self, *names):
+        for name in names:
+            if not self._handler.isFileWritten(self.getDataAbsoluteFilePath(name, False)):
+                return False
+        return True
+
+# -----------------------------------------------------------------------------
+# Data Handler
+# -----------------------------------------------------------------------------
 
 class DataHandler(object):
     def __init__(self, basePath):
@@ -18,10 +269,35 @@ class DataHandler(object):
         self.argOrder = []
         self.realValues = {}
         self.can_write = True
+        self.progressiveStrides = {}
+        self.availableIndices = {}
+        self.descriptorLayout = { 'compact': False, 'sections': [], 'threshold': None, 'maxInlineValues': None, 'directory': 'descriptor' }
+        self.storage = FileSystemStorage()
+        self.storage.setBasePath(basePath)
+        self.storage.listener = self._countStoredOutput
+        self.profiler = nullProfiler
+        self.__templates = {}
+        self.__createdDirectories = set()
+        self.__savedStatCalls = 0
+        self.__lock = threading.Lock()
+        self.__manifest = None
+        self.__manifestPath = None
+        self.__manifestVerify = False
+        self.__sidecars = {}
+        self.__writtenSections = {}
+        self.__dirtySections = set()
+        self.__pendingManifest = []
+        self.__storedEntries = {}
+        self.__scratchStorage = None
+        self.__outputStats = {}
+        self.__outputKeys = {}
 
     def getBasePath(self):
         return self.__root
 
+    def getSavedStatCalls(self):
+        return self.__savedStatCalls
+
     def updateBasePattern(self):
         self.priority.sort(key=lambda item: item[1])
         self.basePattern = ''
@@ -49,7 +325,12 @@ class DataHandler(object):
         """
         newArgument = {}
         argName = kwargs['name']
-        self.argOrder.append(argName)
+        if argName in self.arguments:
+            # Registering again replaces the previous definition
+            self.priority = [ item for item in self.priority if item[0] != argName ]
+        else:
+            self.argOrder.append(argName)
+        self.__dirtySections.add('arguments_%s' % argName)
         for key, value in kwargs.iteritems():
             if key == 'priority':
                 self.priority.append([argName, value])
@@ -73,8 +354,140 @@ class DataHandler(object):
         for key, value in kwargs.iteritems():
             self.current[key] = value
 
+    def getWorkItems(self, names=None):
+        """
+        Full product of the argument indices as a list of immutable work
+        items, outer-most argument first. Each work item is a tuple of
+        (argumentName, index) pairs and can be applied with
+        setArguments(**dict(workItem)).
+        """
+        names = self._getWorkItemNames(names)
+        ranges = [ range(len(self.arguments[name]['values'])) for name in names ]
+        return [ tuple(zip(names, indices)) for indices in itertools.product(*ranges) ]
+
+    def _getWorkItemNames(self, names=None):
+        if names:
+            return names
+        return [ item[0] for item in sorted(self.priority, key=lambda item: -item[1]) ]
+
+    def getNumberOfWorkItems(self, names=None):
+        count = 1
+        for name in self._getWorkItemNames(names):
+            count *= len(self.arguments[name]['values'])
+        return count
+
+    def getWorkItem(self, index, names=None):
+        """
+        Work item at the given flat index of the argument product without
+        building the full list.
+        """
+        names = self._getWorkItemNames(names)
+        indices = []
+        for name in reversed(names):
+            index, argIdx = divmod(index, len(self.arguments[name]['values']))
+            indices.append(argIdx)
+        return tuple(zip(names, reversed(indices)))
+
+    def getWorkItemPartition(self, nbParts, partIdx, strategy='block', cost=None, names=None):
+        return partitionWorkItems(self.getWorkItems(names), nbParts, partIdx, strategy, cost)
+
+    def getFileCounts(self):
+        """
+        Number of files each registered data entry will produce over the
+        full product of the arguments its pattern depends on.
+        """
+        if self.basePattern == None:
+            self.updateBasePattern()
+
+        counts = {}
+        for name in self.data:
+            template = self._getPathTemplate(name)
+            fields = set(template.fields) if template.fields is not None else set(self.arguments)
+            counts[name] = 1
+            for field in fields:
+                counts[name] *= len(self.arguments[field]['values'])
+        return counts
+
+    def planSweep(self, sampleFunction=None, nbSamples=5, sampleArguments=None, compressionLevel=None, seed=None):
+        """
+        Dry-run estimate of a sweep. Without sampleFunction only the work
+        items and files per data entry are counted. Otherwise
+        sampleFunction(workItem) is called, with the arguments applied and
+        an in-memory storage, for a random sample of work items drawn over
+        sampleArguments (all arguments by default). Bytes, compressed
+        bytes and wall time are then extrapolated to the full product.
+        Samples are compressed like the sweep, with the codec and
+        extensions of setCompression() (compressionLevel overrides its
+        level), and stay raw without compression.
+        """
+        fileCounts = self.getFileCounts()
+        nbWorkItems = self.getNumberOfWorkItems()
+        report = {
+            'workItems': nbWorkItems,
+            'files': fileCounts,
+            'totalFiles': sum(fileCounts.values())
+        }
+
+        if not sampleFunction:
+            return report
+
+        nbSampleItems = self.getNumberOfWorkItems(sampleArguments)
+        sampleIndices = random.Random(seed).sample(xrange(nbSampleItems), min(nbSamples, nbSampleItems))
+
+        savedStorage = self.storage
+        savedCurrent = dict(self.current)
+        savedCanWrite = self.can_write
+        savedStats = self.__outputStats
+        savedKeys = self.__outputKeys
+        memoryStorage = MemoryStorage()
+        memoryStorage.setBasePath(self.__root)
+        compression = self._getCompressedStorage()
+        sampleStorage = memoryStorage
+        if compression:
+            sampleStorage = CompressedStorage(memoryStorage, compression.codec, compressionLevel or compression.level, compression.nbWorkers, compression.extensions)
+        elapsed = 0.0
+        try:
+            # Bypass the deduplication layer, samples rarely repeat
+            self.storage = sampleStorage
+            self.__outputStats = {}
+            self.__outputKeys = {}
+            self.can_write = True
+            self.current = dict((name, 0) for name in self.arguments)
+            self.current.update(savedCurrent)
+            for index in sampleIndices:
+                workItem = self.getWorkItem(index, sampleArguments)
+                self.setArguments(**dict(workItem))
+                startTime = time.time()
+                sampleFunction(workItem)
+                elapsed += time.time() - startTime
+
+            # Compression is part of the sweep time
+            startTime = time.time()
+            sampleStorage.flush()
+            elapsed += time.time() - startTime
+            sampleStats = self.__outputStats
+        finally:
+            self.storage = savedStorage
+            self.current = savedCurrent
+            self.can_write = savedCanWrite
+            self.__outputStats = savedStats
+            self.__outputKeys = savedKeys
+
+        rawSize = sum(stats['rawBytes'] for stats in sampleStats.values())
+        compressedSize = sum(len(content) for content in memoryStorage.entries.values())
+
+        scale = float(nbWorkItems) / max(1, len(sampleIndices))
+        report['samples'] = len(sampleIndices)
+        report['compression'] = compression.codec if compression else None
+        report['bytes'] = int(rawSize * scale)
+        report['compressedBytes'] = int(compressedSize * scale)
+        report['seconds'] = elapsed * scale
+
+        return report
+
     def removeData(self, name):
         del self.data[name]
+        self.__templates.pop(name, None)
 
     def registerData(self, **kwargs):
         """
@@ -92,32 +505,496 @@ class DataHandler(object):
                 newData[key] = value
 
         self.data[argName] = newData
+        self.__templates.pop(argName, None)
 
     def addDataMetaData(self, name, key, value):
         self.data[name]['metadata'][key] = value
 
+    def _getPathTemplate(self, name):
+        template = self.__templates.get(name)
+        if template:
+            return template
+
+        with self.__lock:
+            if name in self.__templates:
+                return self.__templates[name]
+
+            dataPattern = self.data[name]['pattern']
+            if '{pattern}' in dataPattern:
+                if len(self.basePattern) == 0:
+                    dataPattern = dataPattern.replace('{pattern}/', self.basePattern).replace('{pattern}', self.basePattern)
+                    self.data[name]['pattern'] = dataPattern
+                else:
+                    dataPattern = dataPattern.replace('{pattern}', self.basePattern)
+                    self.data[name]['pattern'] = dataPattern
+
+            template = PathTemplate(dataPattern)
+            self.__templates[name] = template
+            return template
+
+    def _makeDirectories(self, directory):
+        if directory in self.__createdDirectories:
+            with self.__lock:
+                self.__savedStatCalls += 1
+            return
+
+        if not os.path.exists(directory):
+            makeDirectory(directory)
+        with self.__lock:
+            self.__createdDirectories.add(directory)
+
+    def getDirectoryPlan(self, names=None):
+        """
+        Compute every directory the full argument product will need for
+        the given data names (all registered data by default).
+        """
+        if self.basePattern == None:
+            self.updateBasePattern()
+
+        directories = set()
+        for name in (names if names else self.data.keys()):
+            dirTemplate = PathTemplate(os.path.dirname(self._getPathTemplate(name).pattern))
+            if dirTemplate.fields is None:
+                raise ValueError('Unsupported pattern for directory planning: %s' % dirTemplate.pattern)
+
+            valueLists = [ self.arguments[field]['values'] for field in dirTemplate.fields ]
+            for values in itertools.product(*valueLists):
+                relativeDir = dirTemplate.format(dict(zip(dirTemplate.fields, values)))
+                directories.add(os.path.dirname(os.path.join(self.__root, relativeDir, 'file')))
+
+        return sorted(directories)
+
+    def createDirectories(self, names=None, nbThreads=8):
+        """
+        Create up-front and in parallel all the directories of the sweep.
+        Return the number of directories that were not already known.
+        Storages without one file per entry need none.
+        """
+        if not self.can_write or not self.storage.needDirectories():
+            return 0
+
+        toCreate = [ d for d in self.getDirectoryPlan(names) if d not in self.__createdDirectories ]
+        if len(toCreate) > 1 and nbThreads > 1:
+            pool = ThreadPool(nbThreads)
+            try:
+                pool.map(makeDirectory, toCreate)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for directory in toCreate:
+                makeDirectory(directory)
+
+        self.__createdDirectories.update(toCreate)
+        return len(toCreate)
+
+    def setStorage(self, storage):
+        # Keep the deduplication and compression layers around a new backend
+        layers = []
+        current = self.storage
+        while isinstance(current, (DeduplicatedStorage, CompressedStorage)):
+            layers.append(current)
+            current = current.storage
+
+        if layers and not isinstance(storage, (DeduplicatedStorage, CompressedStorage)):
+            self.storage.flush()
+            for layer in reversed(layers):
+                storage = layer.wrap(storage)
+
+        self._attachStorage(storage)
+
+    def _attachStorage(self, storage):
+        storage.setBasePath(self.__root)
+        storage.setResumable(self.__manifest is not None)
+        self.storage = storage
+
+        # Count what the backend actually stores
+        self._getBaseStorage().listener = self._countStoredOutput
+
+    def setCompression(self, codec='gzip', level=9, nbWorkers=2, extensions=('.uint8', '.array', '.float32', 'Array')):
+        """
+        Compress raw arrays inline, on a pool of nbWorkers threads, as they
+        are written. Entries get the codec extension appended ('.gz' for
+        gzip, '.bz2' for bz2). A None codec disables compression.
+        """
+        deduplication = self.storage if isinstance(self.storage, DeduplicatedStorage) else None
+        storage = deduplication.storage if deduplication else self.storage
+        if isinstance(storage, CompressedStorage):
+            storage.flush()
+            storage = storage.storage
+
+        if codec:
+            storage = CompressedStorage(storage, codec, level, nbWorkers, extensions)
+            storage.profiler = self.profiler
+
+        if deduplication:
+            deduplication.storage = storage
+            storage = deduplication
+
+        self._attachStorage(storage)
+
+    def setDeduplication(self, enabled=True, hardLinks=False):
+        """
+        Store identical contents once and record the other entries as
+        references in index.json (see DeduplicatedStorage). Duplicates are
+        detected before compression so they are never compressed.
+        """
+        storage = self.storage
+        if isinstance(storage, DeduplicatedStorage):
+            storage.flush()
+            storage = storage.storage
+
+        if enabled:
+            storage = DeduplicatedStorage(storage, hardLinks)
+
+        self._attachStorage(storage)
+
+    def flush(self):
+        """
+        Wait for every pending write of the storage backend and record the
+        completed entries in the manifest.
+        """
+        self.storage.flush()
+        if self.__manifest is not None:
+            self._recordManifestEntries()
+
+    def enableProfiling(self, enabled=True):
+        """
+        Time the builder stages (render, readback, encode, write...) and
+        write their aggregated timings to profile.json next to index.json.
+        """
+        self.profiler = StageProfiler() if enabled else nullProfiler
+
+        storage = self.storage
+        while isinstance(storage, (DeduplicatedStorage, CompressedStorage)):
+            if isinstance(storage, CompressedStorage):
+                storage.profiler = self.profiler
+            storage = storage.storage
+
+    def profile(self, stage):
+        """
+        Context manager timing the given stage, a no-op unless profiling
+        is enabled.
+        """
+        return self.profiler.stage(stage)
+
+    def writeData(self, name, content, context=None):
+        """
+        Write the content of the given data entry through the storage
+        backend, for the current arguments or the given DataContext.
+        Return the absolute path of the entry.
+        """
+        if not self.can_write:
+            return None
+
+        indices = context.getArguments() if context else self.current
+        path = self._resolveDataPath(name, indices, self.storage.needDirectories())
+        self._writeOutput(name, path, content)
+        return path
+
+    def writeDataStream(self, name, produce):
+        """
+        Write the current entry of the given data through the stream handed
+        to produce(stream), for content too large to be held in memory.
+        Only storages writing one file per entry support streams.
+        Return the absolute path of the entry.
+        """
+        if not self.can_write:
+            return None
+
+        if not self.storage.needDirectories():
+            raise ValueError('Streamed data needs a storage writing one file per entry')
+
+        path = self._resolveDataPath(name, self.current, True)
+        with self.__lock:
+            self.__outputKeys[path] = name
+
+        stream = self.storage.openStream(path)
+        try:
+            produce(stream)
+        except:
+            stream.abort()
+            with self.__lock:
+                self.__outputKeys.pop(path, None)
+            raise
+        stream.close()
+
+        with self.__lock:
+            stats = self._getOutputStats(name)
+            stats['rawBytes'] += stream.size
+            stats['writeTime'] += stream.writeTime
+        return path
+
+    def writeFile(self, path, content, compress=True):
+        """
+        Write a file located under the dataset root through the storage
+        backend (used for outputs that are not registered data entries).
+        Deduplicated files still get a hard link under their own name as
+        the viewers fetch them by path. With compress=False the file skips
+        the compression and deduplication layers and is stored under its
+        own name, for files referenced by name from index.json.
+        """
+        if not self.can_write:
+            return None
+
+        storage = self.storage
+        if not compress:
+            storage = self._getBaseStorage()
+        elif isinstance(storage, DeduplicatedStorage):
+            storage.materialize(path)
+
+        if storage.needDirectories():
+            self._makeDirectories(os.path.dirname(path))
+        self._writeOutput('/' + os.path.basename(path), path, content, storage)
+        return path
+
+    def _getCompressedStorage(self):
+        storage = self.storage
+        while isinstance(storage, (DeduplicatedStorage, CompressedStorage)):
+            if isinstance(storage, CompressedStorage):
+                return storage
+            storage = storage.storage
+        return None
+
+    def _getBaseStorage(self):
+        # Storage below the compression and deduplication layers
+        storage = self.storage
+        while isinstance(storage, (DeduplicatedStorage, CompressedStorage)):
+            storage = storage.storage
+        return storage
+
+    # -------------------------------------------------------------------------
+    # Output accounting
+    # -------------------------------------------------------------------------
+
+    def _getOutputStats(self, key):
+        if key not in self.__outputStats:
+            self.__outputStats[key] = { 'files': 0, 'bytes': 0, 'rawBytes': 0, 'writeTime': 0.0 }
+        return self.__outputStats[key]
+
+    def _writeOutput(self, key, path, content, storage=None):
+        # Files written through writeFile are keyed by '/' + their file name
+        storage = storage if storage else self.storage
+        with self.__lock:
+            self.__outputKeys[path] = key
+
+        startTime = time.time()
+        with self.profiler.stage('write'):
+            rawBytes = storage.write(path, content)
+        elapsed = time.time() - startTime
+
+        with self.__lock:
+            stats = self._getOutputStats(key)
+            stats['rawBytes'] += rawBytes
+            stats['writeTime'] += elapsed
+
+        # Duplicates are never stored, compressed entries are stored later
+        if not storage.isPending(path):
+            with self.__lock:
+                self.__outputKeys.pop(path, None)
+
+    def _countStoredOutput(self, storedPath, size, checksum):
+        if self.__manifest is not None:
+            # Keep what the manifest needs instead of reading the file back
+            digest = checksum()
+            with self.__lock:
+                self.__storedEntries[storedPath] = (size, digest)
+
+        with self.__lock:
+            key = self.__outputKeys.pop(storedPath, None)
+            for suffix, compress in codecs.values():
+                if key is None and storedPath.endswith(suffix):
+                    key = self.__outputKeys.pop(storedPath[:-len(suffix)], None)
+            if key is None:
+                return
+
+            stats = self._getOutputStats(key)
+            stats['files'] += 1
+            stats['bytes'] += size
+
+    def getOutputStatistics(self):
+        """
+        Files and bytes stored, raw bytes and write time (in seconds) for
+        each data name since the handler was created. Entries written
+        through writeFile are matched to a data name by file name, the
+        others are gathered under None. Pending writes are flushed first.
+        """
+        self.storage.flush()
+        patternNames = {}
+        for name, item in self.data.iteritems():
+            patternNames.setdefault('/' + item['pattern'].split('/')[-1], name)
+
+        statistics = {}
+        with self.__lock:
+            for key, stats in self.__outputStats.iteritems():
+                name = patternNames.get(key) if key.startswith('/') else key
+                merged = statistics.setdefault(name, { 'files': 0, 'bytes': 0, 'rawBytes': 0, 'writeTime': 0.0 })
+                for field in merged:
+                    merged[field] += stats[field]
+
+        for stats in statistics.values():
+            stats['ratio'] = float(stats['rawBytes']) / stats['bytes'] if stats['bytes'] else 1.0
+
+        return statistics
+
+    def getOutputTotal(self, statistics=None):
+        """
+        Sum of the given (or current) output statistics over all data names.
+        """
+        if statistics is None:
+            statistics = self.getOutputStatistics()
+
+        total = { 'files': 0, 'bytes': 0, 'rawBytes': 0, 'writeTime': 0.0 }
+        for stats in statistics.values():
+            for field in total:
+                total[field] += stats[field]
+        total['ratio'] = float(total['rawBytes']) / total['bytes'] if total['bytes'] else 1.0
+        return total
+
+    def getContext(self, workItem=None):
+        """
+        Capture the current argument indices (or the given work item) into
+        an immutable DataContext usable from worker threads.
+        """
+        if workItem is None:
+            return DataContext(self, self.current)
+        return DataContext(self, dict(workItem))
+
     def getDataAbsoluteFilePath(self, name, createDirectories=True):
-        dataPattern = self.data[name]['pattern']
-        if '{pattern}' in dataPattern:
-            if len(self.basePattern) == 0:
-                dataPattern = dataPattern.replace('{pattern}/', self.basePattern).replace('{pattern}', self.basePattern)
-                self.data[name]['pattern'] = dataPattern
-            else:
-                dataPattern = dataPattern.replace('{pattern}', self.basePattern)
-                self.data[name]['pattern'] = dataPattern
+        return self._resolveDataPath(name, self.current, createDirectories)
+
+    def _resolveDataPath(self, name, indices, createDirectories):
+        template = self._getPathTemplate(name)
 
         keyValuePair = {}
-        for key, value in self.current.iteritems():
-            keyValuePair[key] = self.arguments[key]['values'][value]
+        for key in (template.fields if template.fields is not None else indices):
+            keyValuePair[key] = self.arguments[key]['values'][indices[key]]
 
-        fullpath = os.path.join(self.__root, dataPattern.format(**keyValuePair))
+        fullpath = os.path.join(self.__root, template.format(keyValuePair))
 
         if createDirectories and self.can_write:
-            if not os.path.exists(os.path.dirname(fullpath)):
-                os.makedirs(os.path.dirname(fullpath))
+            self._makeDirectories(os.path.dirname(fullpath))
 
         return fullpath
 
+    def enableManifest(self, fileName='manifest.txt', verify=False):
+        """
+        Keep an append-only record of completed outputs (stored size + md5,
+        taken from the content as it is written) so an interrupted sweep
+        can skip what was already written on restart.
+        When verify is True, the checksum is checked again on restart in
+        addition to the size.
+        """
+        self.__manifest = {}
+        self.__manifestPath = os.path.join(self.__root, fileName)
+        self.__manifestVerify = verify
+
+        # Let packed storages append to the output of a previous run
+        self.storage.setResumable(True)
+
+        if os.path.exists(self.__manifestPath):
+            with open(self.__manifestPath, 'r') as manifestFile:
+                for line in manifestFile:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Truncated line from an interrupted run
+                        continue
+                    self.__manifest[entry['path']] = entry
+
+    def getScratchStorage(self):
+        """
+        File system storage for temporary outputs that must stay raw on
+        disk whatever the storage backend, like layers converted in
+        stop(). Give it to markFileWritten and isFileWritten for them.
+        """
+        if not self.__scratchStorage:
+            self.__scratchStorage = FileSystemStorage()
+            self.__scratchStorage.setBasePath(self.__root)
+            self.__scratchStorage.listener = self._countStoredOutput
+        return self.__scratchStorage
+
+    def markFileWritten(self, path, storage=None):
+        """
+        Record path in the manifest once stored by the given storage (the
+        storage backend by default).
+        """
+        if self.__manifest is None or not self.can_write:
+            return
+
+        with self.__lock:
+            self.__pendingManifest.append((path, storage))
+        self._recordManifestEntries()
+
+    def _recordManifestEntries(self):
+        with self.__lock:
+            candidates = self.__pendingManifest
+            self.__pendingManifest = []
+
+        waiting = []
+        for path, storage in candidates:
+            if storage is None:
+                storage = self.storage
+
+            if storage.isPending(path):
+                # Still being compressed, record it later
+                waiting.append((path, storage))
+                continue
+
+            storedPath = storage.getStoredPath(path)
+            with self.__lock:
+                if isinstance(storage, DeduplicatedStorage):
+                    # References share the entry of their first occurrence
+                    stored = self.__storedEntries.get(storedPath)
+                else:
+                    stored = self.__storedEntries.pop(storedPath, None)
+
+            if stored is None:
+                # Written outside of the storage layer
+                content = storage.read(path)
+                if content is None:
+                    continue
+                stored = (len(content), hashlib.md5(content).hexdigest())
+
+            entry = {
+                'path': os.path.relpath(path, self.__root),
+                'size': stored[0],
+                'md5': stored[1]
+            }
+            with self.__lock:
+                self.__manifest[entry['path']] = entry
+                with open(self.__manifestPath, 'a') as manifestFile:
+                    manifestFile.write(json.dumps(entry) + '\n')
+
+        with self.__lock:
+            self.__pendingManifest.extend(waiting)
+
+    def markDataWritten(self, *names):
+        for name in names:
+            self.markFileWritten(self.getDataAbsoluteFilePath(name, False))
+
+    def isFileWritten(self, path, storage=None):
+        if self.__manifest is None:
+            return False
+
+        storage = storage if storage else self.storage
+        entry = self.__manifest.get(os.path.relpath(path, self.__root))
+        if entry is None or storage.getStoredSize(path) != entry['size']:
+            return False
+
+        if self.__manifestVerify:
+            content = storage.read(path)
+            if content is None or hashlib.md5(content).hexdigest() != entry['md5']:
+                return False
+
+        return True
+
+    def isDataWritten(self, *names):
+        for name in names:
+            if not self.isFileWritten(self.getDataAbsoluteFilePath(name, False)):
+                return False
+        return True
+
     def addTypes(self, *args):
         for arg in args:
             self.types.append(arg)
@@ -127,6 +1004,10 @@ class DataHandler(object):
 
     def addSection(self, key, value):
         self.sections[key] = value
+        self.__dirtySections.add(key)
+
+    def removeSection(self, key):
+        return self.sections.pop(key)
 
     def computeDataPatterns(self):
         if self.basePattern == None:
@@ -138,36 +1019,193 @@ class DataHandler(object):
                 dataPattern = dataPattern.replace('{pattern}', self.basePattern)
                 self.data[name]['pattern'] = dataPattern
 
+    def setProgressiveTraversal(self, stride, *names):
+        """
+        Walk the given arguments (all registered ones by default) coarse to
+        fine: every stride-th value first, then fill the gaps. index.json
+        lists the available values of those arguments and is rewritten
+        when a level brings new values, across nested loops.
+        """
+        for name in (names if names else self.arguments.keys()):
+            self.progressiveStrides[name] = stride
+
+    def getProgressiveLevels(self, name):
+        return getProgressiveLevels(len(self.arguments[name]['values']), self.progressiveStrides.get(name, 1))
+
+    def startProgressiveTraversal(self, name):
+        # Nothing is available until the first level of the sweep completes
+        if name in self.progressiveStrides and name not in self.availableIndices:
+            self.availableIndices[name] = set()
+            self.metadata.setdefault('available', {})[name] = []
+
+    def updateAvailableValues(self, name, indices):
+        if name not in self.progressiveStrides:
+            return
+
+        # Inner loops walk their levels again for each outer value, only
+        # values completed for the first time change the descriptor
+        availableIndices = self.availableIndices.setdefault(name, set())
+        if availableIndices.issuperset(indices):
+            return
+        availableIndices.update(indices)
+
+        available = self.metadata.setdefault('available', {})
+        values = self.arguments[name]['values']
+        if len(availableIndices) == len(values):
+            available.pop(name, None)
+            if not available:
+                del self.metadata['available']
+        else:
+            available[name] = [ values[i] for i in sorted(availableIndices) ]
+
+        self.writeDataDescriptor(incremental=True)
+
     def __getattr__(self, name):
         if self.basePattern == None:
             self.updateBasePattern()
 
-        for i in range(len(self.arguments[name]['values'])):
-            self.current[name] = i
-            yield self.realValues[name][i]
+        self.startProgressiveTraversal(name)
+        visited = []
+        for level in self.getProgressiveLevels(name):
+            for i in level:
+                self.current[name] = i
+                yield self.realValues[name][i]
+            visited.extend(level)
+            self.updateAvailableValues(name, visited)
+
+    def setDescriptorLayout(self, compact=True, sidecarSections=None, sidecarThreshold=None, maxInlineValues=None, sidecarDirectory='descriptor'):
+        """
+        Configure how index.json is written:
+         - compact: no whitespace between separators
+         - sidecarSections: sections always moved into sidecar files
+         - sidecarThreshold: move any section larger than that many bytes
+         - maxInlineValues: move longer argument value lists
+        Moved content is replaced by { "href": "<sidecarDirectory>/<name>.json" }
+        and sidecar files are only rewritten when their content changes.
+        """
+        self.descriptorLayout = {
+            'compact': compact,
+            'sections': sidecarSections if sidecarSections else [],
+            'threshold': sidecarThreshold,
+            'maxInlineValues': maxInlineValues,
+            'directory': sidecarDirectory
+        }
+        self.__writtenSections = {}
+
+    def _serialize(self, value):
+        if self.descriptorLayout['compact']:
+            return json.dumps(value, separators=(',', ':'))
+        return json.dumps(value)
+
+    def _writeAtomically(self, path, content):
+        tmpPath = path + '.tmp'
+        with open(tmpPath, 'w') as f:
+            f.write(content)
+        os.rename(tmpPath, path)
+
+    def _externalize(self, name, value, force=False):
+        content = self._serialize(value)
+        threshold = self.descriptorLayout['threshold']
+        if not force and name not in self.descriptorLayout['sections'] and (threshold is None or len(content) <= threshold):
+            return value
+
+        relativePath = '%s/%s.json' % (self.descriptorLayout['directory'], name)
+        checksum = hashlib.md5(content).hexdigest()
+        if self.__sidecars.get(relativePath) != checksum:
+            fullPath = os.path.join(self.__root, relativePath)
+            self._makeDirectories(os.path.dirname(fullPath))
+            self._writeAtomically(fullPath, content)
+            self.__sidecars[relativePath] = checksum
 
-    def writeDataDescriptor(self):
+        return { 'href': relativePath }
+
+    def _getDescriptorSection(self, name, value, incremental, force=False):
+        # Incremental writes reuse what was written for sections left
+        # untouched since, instead of serializing them again
+        if incremental and name not in self.__dirtySections and name in self.__writtenSections:
+            return self.__writtenSections[name]
+
+        written = self._externalize(name, value, force)
+        self.__writtenSections[name] = written
+        self.__dirtySections.discard(name)
+        return written
+
+    def _removeOrphanSidecars(self, jsonData):
+        referenced = set()
+        for value in jsonData.values() + [ argument['values'] for argument in jsonData['arguments'].values() ]:
+            if isinstance(value, dict) and value.keys() == ['href']:
+                referenced.add(value['href'])
+
+        for relativePath in self.__sidecars.keys():
+            if relativePath not in referenced:
+                fullPath = os.path.join(self.__root, relativePath)
+                if os.path.exists(fullPath):
+                    os.remove(fullPath)
+                del self.__sidecars[relativePath]
+
+    def writeDataDescriptor(self, fileName='index.json', incremental=False):
+        """
+        Write the descriptor and its sidecar files. Incremental writes only
+        serialize again the sections and argument values given through
+        addSection() or registerArgument() since the previous write, so
+        sections modified in place show up on the next full write.
+        """
         if not self.can_write:
             return
 
         self.computeDataPatterns()
+        self._makeDirectories(self.__root)
+
+        arguments = self.arguments
+        maxInlineValues = self.descriptorLayout['maxInlineValues']
+        if maxInlineValues is not None:
+            arguments = {}
+            for name, argument in self.arguments.iteritems():
+                if len(argument['values']) > maxInlineValues:
+                    argument = dict(argument)
+                    argument['values'] = self._getDescriptorSection('arguments_%s' % name, argument['values'], incremental, True)
+                arguments[name] = argument
 
         jsonData = {
             "arguments_order" : self.argOrder,
             "type"            : self.types,
-            "arguments"       : self.arguments,
+            "arguments"       : arguments,
             "metadata"        : self.metadata,
             "data"            : []
         }
 
         # Add sections
         for key, value in self.sections.iteritems():
-            jsonData[key] = value
+            jsonData[key] = self._getDescriptorSection(key, value, incremental)
+
+        # Add storage information
+        self.flush()
+        for key, value in self.storage.getDescriptorSections().iteritems():
+            jsonData[key] = self._externalize(key, value)
+
+        # Add output accounting
+        statistics = self.getOutputStatistics()
+        if statistics:
+            for name, stats in statistics.iteritems():
+                if name in self.data:
+                    self.data[name]['metadata']['output'] = stats
+            self.metadata['output'] = self.getOutputTotal(statistics)
 
         # Add data
         for key, value in self.data.iteritems():
             jsonData['data'].append(value)
 
-        filePathToWrite = os.path.join(self.__root, "index.json")
-        with open(filePathToWrite, "w") as fileToWrite:
-            fileToWrite.write(json.dumps(jsonData))
+        filePathToWrite = os.path.join(self.__root, fileName)
+        self._writeAtomically(filePathToWrite, self._serialize(jsonData))
+        self._removeOrphanSidecars(jsonData)
+
+        # Add timings
+        self.writeProfile()
+
+    def writeProfile(self):
+        """
+        Write the stage timings gathered so far to profile.json. Builders
+        doing work after writeDataDescriptor call it again once done.
+        """
+        if self.profiler.enabled and self.can_write:
+            self._writeAtomically(os.path.join(self.__root, 'profile.json'), json.dumps(self.profiler.getSummary(), indent=2, separators=(',', ': '), sort_keys=True))
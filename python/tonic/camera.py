@@ -1,4 +1,12 @@
 from math import *
+from array import array
+
+import os, heapq
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # -----------------------------------------------------------------------------
 # Set of helper functions
@@ -56,15 +64,193 @@ def rotate(axis, angle, center, point):
     rPoint = tuple((rtPoint[i] + center[i]) for i in range(3))
     return rPoint
 
+# -----------------------------------------------------------------------------
+# Batched camera generation
+# -----------------------------------------------------------------------------
+
+def normalizeArrays(vect, tolerance=0.00001):
+    """
+    normalize() over a tuple of 3 numpy arrays, one per component.
+    """
+    mag2 = vect[0] * vect[0] + vect[1] * vect[1] + vect[2] * vect[2]
+    needNormalize = abs(mag2 - 1.0) > tolerance
+    return tuple(numpy.where(needNormalize, n / numpy.sqrt(mag2), n) for n in vect)
+
+def rotateArrays(axis, angle, center, point):
+    """
+    rotate() over tuples of 3 broadcastable numpy arrays, using the same
+    quaternion arithmetic so the results match the scalar version.
+    """
+    angleInRad = 3.141592654 * angle / 180.0
+    x, y, z = normalizeArrays(axis)
+    halfAngle = angleInRad / 2
+    rotation = (numpy.cos(halfAngle), x * numpy.sin(halfAngle), y * numpy.sin(halfAngle), z * numpy.sin(halfAngle))
+    tPoint = tuple((point[i] - center[i]) for i in range(3))
+    rtPoint = qv_mult(rotation, tPoint)
+    return tuple((rtPoint[i] + center[i]) for i in range(3))
+
+def computeSphericalPositions(focalPoint, position, phiAxis, phiAngles, thetaAngles):
+    """
+    Return the positions and view ups of a spherical camera, indexed by
+    [thetaIdx][phiIdx], as numpy arrays or, without numpy, as nested lists
+    computed with rotate().
+    """
+    if numpy is None:
+        phiFrames = []
+        for phi in phiAngles:
+            phiPos = rotate(phiAxis, -phi, focalPoint, position)
+            phiFrames.append((phiPos, vectProduct(phiAxis, tuple(focalPoint[i]-phiPos[i] for i in range(3)))))
+        positions = [ [ rotate(thetaAxis, theta, focalPoint, phiPos) for phiPos, thetaAxis in phiFrames ] for theta in thetaAngles ]
+        viewUps = [ [ rotate(thetaAxis, theta, (0,0,0), phiAxis) for phiPos, thetaAxis in phiFrames ] for theta in thetaAngles ]
+        return (positions, viewUps)
+
+    # Components as (theta, phi) shaped arrays
+    phis = -numpy.array(phiAngles, dtype=float)[numpy.newaxis, :]
+    thetas = numpy.array(thetaAngles, dtype=float)[:, numpy.newaxis]
+    phiPos = rotateArrays(phiAxis, phis, focalPoint, position)
+    xa, ya, za = phiAxis
+    xb, yb, zb = tuple(focalPoint[i]-phiPos[i] for i in range(3))
+    thetaAxis = normalizeArrays((ya*zb - za*yb, za*xb - xa*zb, xa*yb - ya*xb))
+    positions = rotateArrays(thetaAxis, thetas, focalPoint, phiPos)
+    viewUps = rotateArrays(thetaAxis, thetas, (0,0,0), phiAxis)
+    return (numpy.dstack(positions), numpy.dstack(viewUps))
+
+def computeCylindricalPositions(focalPoint, position, rotationAxis, phiAngles, translationValues):
+    """
+    Return the focal points, indexed by translationIdx, and positions,
+    indexed by [translationIdx][phiIdx], of a cylindrical camera.
+    Same container types as computeSphericalPositions().
+    """
+    if numpy is None:
+        phiPositions = [ rotate(rotationAxis, phi, focalPoint, position) for phi in phiAngles ]
+        focalPoints = [ tuple(focalPoint[i] + (translation*rotationAxis[i]) for i in range(3)) for translation in translationValues ]
+        positions = [ [ tuple(phiPos[i] + (translation*rotationAxis[i]) for i in range(3)) for phiPos in phiPositions ] for translation in translationValues ]
+        return (focalPoints, positions)
+
+    phiPos = rotateArrays(rotationAxis, numpy.array(phiAngles, dtype=float), focalPoint, position)
+    translations = numpy.array(translationValues, dtype=float)
+    focalPoints = tuple(focalPoint[i] + (translations*rotationAxis[i]) for i in range(3))
+    positions = tuple(phiPos[i][numpy.newaxis, :] + (translations*rotationAxis[i])[:, numpy.newaxis] for i in range(3))
+    return (numpy.dstack(focalPoints)[0], numpy.dstack(positions))
+
+def toVector(vector):
+    if numpy is not None and isinstance(vector, numpy.ndarray):
+        return tuple(vector.tolist())
+    return tuple(vector)
+
+# -----------------------------------------------------------------------------
+# Lazy camera sequence
+# -----------------------------------------------------------------------------
+
+class CameraSequence(object):
+    """
+    Read-only sequence of camera settings computed on access through
+    getCamera(flatIdx). Supports len(), negative indices, iteration and
+    slicing, where a slice is itself a lazy sequence, so workers can take
+    disjoint ranges of views without building the full list.
+    """
+    def __init__(self, getCamera, size, start=0, step=1):
+        self.getCamera = getCamera
+        self.size = size
+        self.start = start
+        self.step = step
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            return CameraSequence(self.getCamera, len(xrange(start, stop, step)), self.start + start * self.step, self.step * step)
+
+        if key < 0:
+            key += self.size
+        if key < 0 or key >= self.size:
+            raise IndexError('Camera index out of range')
+        return self.getCamera(self.start + key * self.step)
+
+    def __iter__(self):
+        for idx in xrange(self.size):
+            yield self.getCamera(self.start + idx * self.step)
+
+
+# -----------------------------------------------------------------------------
+# Argument traversal
+# -----------------------------------------------------------------------------
+
+traversalOrders = ('row', 'serpentine', 'hilbert')
+
+def hilbertIndex(size, x, y):
+    """
+    Distance of (x, y) along the Hilbert curve filling a size x size grid,
+    size being a power of 2.
+    """
+    distance = 0
+    s = size / 2
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        distance += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = size - 1 - x
+                y = size - 1 - y
+            x, y = y, x
+        s /= 2
+    return distance
+
+def checkTraversalOrder(order):
+    if order not in traversalOrders:
+        raise ValueError('Unknown traversal order %s, expected one of %s' % (order, ', '.join(traversalOrders)))
+
+def iterateGrid(dataHandler, rowName, colName, order='row'):
+    """
+    Yield (rowIdx, colIdx) over a 2D argument grid, following the
+    progressive levels of both arguments when enabled on the handler.
+    Within a level the grid is walked row-major ('row'), reversing every
+    other row ('serpentine') or along a Hilbert curve ('hilbert'), the
+    last two keeping consecutive views next to each other.
+    """
+    dataHandler.startProgressiveTraversal(rowName)
+    dataHandler.startProgressiveTraversal(colName)
+    rowLevels = dataHandler.getProgressiveLevels(rowName)
+    colLevels = dataHandler.getProgressiveLevels(colName)
+    rows = []
+    cols = []
+    for levelIdx in range(max(len(rowLevels), len(colLevels))):
+        newRows = set(rowLevels[levelIdx]) if levelIdx < len(rowLevels) else set()
+        newCols = set(colLevels[levelIdx]) if levelIdx < len(colLevels) else set()
+        rows = sorted(rows + list(newRows))
+        cols = sorted(cols + list(newCols))
+        cells = ((row, col) for rowPos, row in enumerate(rows) for col in (cols[::-1] if order == 'serpentine' and rowPos % 2 else cols) if row in newRows or col in newCols)
+
+        if order == 'hilbert':
+            size = 1
+            while size < max(len(rows), len(cols)):
+                size *= 2
+            rowRanks = dict((row, rank) for rank, row in enumerate(rows))
+            colRanks = dict((col, rank) for rank, col in enumerate(cols))
+            cells = sorted(cells, key=lambda cell: hilbertIndex(size, colRanks[cell[1]], rowRanks[cell[0]]))
+
+        for cell in cells:
+            yield cell
+
+        dataHandler.updateAvailableValues(rowName, rows)
+        dataHandler.updateAvailableValues(colName, cols)
+
 # -----------------------------------------------------------------------------
 # Spherical Camera
 # -----------------------------------------------------------------------------
 
 class SphericalCamera(object):
 
-    def __init__(self, dataHandler, focalPoint, position, phiAxis, phiAngles, thetaAngles):
+    def __init__(self, dataHandler, focalPoint, position, phiAxis, phiAngles, thetaAngles, order='row'):
+        checkTraversalOrder(order)
         self.dataHandler = dataHandler
-        self.cameraSettings = []
+        self.order = order
+        self.phiAngles = phiAngles
+        self.thetaAngles = thetaAngles
+        self.nbPhi = len(phiAngles)
         self.thetaBind = { "mouse" : { "drag" : { "modifier": 0, "coordinate": 1, "step": 30 , "orientation": 1} } }
         self.phiBind = { "mouse" : { "drag" : { "modifier": 0, "coordinate": 0, "step": 30 , "orientation": 1} } }
 
@@ -86,33 +272,52 @@ class SphericalCamera(object):
         else:
             self.dataHandler.registerArgument(priority=0, name='theta', values=thetaAngles, ui='slider', bind=self.thetaBind)
 
-        # Compute all camera settings
-        for theta in thetaAngles:
-            for phi in phiAngles:
-                phiPos = rotate(phiAxis, -phi, fp, position)
-                thetaAxis = vectProduct(phiAxis, tuple(fp[i]-phiPos[i] for i in range(3)))
-                thetaPhiPos = rotate(thetaAxis, theta, fp, phiPos)
-                viewUp = rotate(thetaAxis, theta, (0,0,0), phiAxis)
-
-                self.cameraSettings.append({
-                    'theta': theta,
-                    'thetaIdx': thetaAngles.index(theta),
-                    'phi': phi,
-                    'phiIdx': phiAngles.index(phi),
-                    'focalPoint': fp,
-                    'position': thetaPhiPos,
-                    'viewUp': viewUp
-                })
+        # Compute all positions, the settings are built on access
+        self.focalPoint = fp
+        self.positions, self.viewUps = computeSphericalPositions(fp, position, phiAxis, phiAngles, thetaAngles)
+        self.cameraSettings = CameraSequence(self.getCameraAt, len(thetaAngles) * self.nbPhi)
 
         self.dataHandler.updateBasePattern()
 
+    def getCameraAt(self, flatIdx):
+        thetaIdx, phiIdx = divmod(flatIdx, self.nbPhi)
+        return {
+            'theta': self.thetaAngles[thetaIdx],
+            'thetaIdx': thetaIdx,
+            'phi': self.phiAngles[phiIdx],
+            'phiIdx': phiIdx,
+            'focalPoint': self.focalPoint,
+            'position': toVector(self.positions[thetaIdx][phiIdx]),
+            'viewUp': toVector(self.viewUps[thetaIdx][phiIdx])
+        }
+
+    def __len__(self):
+        return len(self.cameraSettings)
+
+    def __getitem__(self, key):
+        """
+        camera[flatIdx], camera[start:stop:step] or camera[phiIdx, thetaIdx]
+        """
+        if isinstance(key, tuple):
+            phiIdx, thetaIdx = key
+            return self.cameraSettings[thetaIdx * self.nbPhi + phiIdx]
+        return self.cameraSettings[key]
+
+    def getCameraData(self, workItem):
+        indices = dict(workItem)
+        return self.cameraSettings[indices['theta'] * self.nbPhi + indices['phi']]
+
+    def getArgumentNames(self):
+        return ['theta', 'phi']
+
     def updatePriority(self, priorityList):
         keyList = ['theta', 'phi']
         for idx in range(min(len(priorityList), len(keyList))):
             self.dataHandler.updatePriority(keyList[idx], priorityList[idx])
 
     def __iter__(self):
-        for cameraData in self.cameraSettings:
+        for thetaIdx, phiIdx in iterateGrid(self.dataHandler, 'theta', 'phi', self.order):
+            cameraData = self.cameraSettings[thetaIdx * self.nbPhi + phiIdx]
             self.dataHandler.setArguments(phi=cameraData['phiIdx'], theta=cameraData['thetaIdx'])
             yield cameraData
 
@@ -122,43 +327,197 @@ class SphericalCamera(object):
 
 class CylindricalCamera(object):
 
-    def __init__(self, dataHandler, focalPoint, position, rotationAxis, phiAngles, translationValues):
+    def __init__(self, dataHandler, focalPoint, position, rotationAxis, phiAngles, translationValues, order='row'):
+        checkTraversalOrder(order)
         self.dataHandler = dataHandler
-        self.cameraSettings = []
+        self.order = order
+        self.rotationAxis = rotationAxis
+        self.phiAngles = phiAngles
+        self.translationValues = translationValues
+        self.nbPhi = len(phiAngles)
 
         # Register arguments to the data handler
         self.dataHandler.registerArgument(priority=0, name='phi', values=phiAngles, ui='slider', loop='modulo')
         self.dataHandler.registerArgument(priority=0, name='n_pos', values=translationValues, ui='slider')
 
-        # Compute all camera settings
-        for translation in translationValues:
-            for phi in phiAngles:
-                phiPos = rotate(rotationAxis, phi, focalPoint, position)
-                newfocalPoint = tuple(focalPoint[i] + (translation*rotationAxis[i]) for i in range(3))
-                transPhiPoint = tuple(phiPos[i] + (translation*rotationAxis[i]) for i in range(3))
-
-                self.cameraSettings.append({
-                    'n_pos': translation,
-                    'n_posIdx': translationValues.index(translation),
-                    'phi': phi,
-                    'phiIdx': phiAngles.index(phi),
-                    'focalPoint': newfocalPoint,
-                    'position': transPhiPoint,
-                    'viewUp': rotationAxis
-                })
+        # Compute all positions, the settings are built on access
+        self.focalPoints, self.positions = computeCylindricalPositions(focalPoint, position, rotationAxis, phiAngles, translationValues)
+        self.cameraSettings = CameraSequence(self.getCameraAt, len(translationValues) * self.nbPhi)
 
         self.dataHandler.updateBasePattern()
 
+    def getCameraAt(self, flatIdx):
+        translationIdx, phiIdx = divmod(flatIdx, self.nbPhi)
+        return {
+            'n_pos': self.translationValues[translationIdx],
+            'n_posIdx': translationIdx,
+            'phi': self.phiAngles[phiIdx],
+            'phiIdx': phiIdx,
+            'focalPoint': toVector(self.focalPoints[translationIdx]),
+            'position': toVector(self.positions[translationIdx][phiIdx]),
+            'viewUp': self.rotationAxis
+        }
+
+    def __len__(self):
+        return len(self.cameraSettings)
+
+    def __getitem__(self, key):
+        """
+        camera[flatIdx], camera[start:stop:step] or camera[phiIdx, translationIdx]
+        """
+        if isinstance(key, tuple):
+            phiIdx, translationIdx = key
+            return self.cameraSettings[translationIdx * self.nbPhi + phiIdx]
+        return self.cameraSettings[key]
+
+    def getCameraData(self, workItem):
+        indices = dict(workItem)
+        return self.cameraSettings[indices['n_pos'] * self.nbPhi + indices['phi']]
+
+    def getArgumentNames(self):
+        return ['n_pos', 'phi']
+
     def updatePriority(self, priorityList):
         keyList = ['n_pos', 'phi']
         for idx in range(min(len(priorityList), len(keyList))):
             self.dataHandler.updatePriority(keyList[idx], priorityList[idx])
 
     def __iter__(self):
-        for cameraData in self.cameraSettings:
+        for translationIdx, phiIdx in iterateGrid(self.dataHandler, 'n_pos', 'phi', self.order):
+            cameraData = self.cameraSettings[translationIdx * self.nbPhi + phiIdx]
             self.dataHandler.setArguments(phi=cameraData['phiIdx'], n_pos=cameraData['n_posIdx'])
             yield cameraData
 
+# -----------------------------------------------------------------------------
+# Fibonacci Camera
+# -----------------------------------------------------------------------------
+
+def computeFibonacciSphere(angularSpacing):
+    """
+    Return the (phi, theta) angles in degrees of a Fibonacci lattice whose
+    neighboring points are about angularSpacing degrees apart. Points are
+    ordered from the top pole (theta close to 90) to the bottom one.
+    """
+    spacing = radians(angularSpacing)
+    # Each point covers the area of a hexagonal cell of the requested spacing
+    count = max(2, int(ceil(8.0 * pi / (sqrt(3.0) * spacing * spacing))))
+    goldenAngle = 180.0 * (3.0 - sqrt(5.0))
+    phis = [ (idx * goldenAngle) % 360.0 for idx in range(count) ]
+    thetas = [ degrees(asin(1.0 - (2.0 * idx + 1.0) / count)) for idx in range(count) ]
+    return (phis, thetas)
+
+def computeNeighbors(directions, angularSpacing, nbNeighbors=6):
+    """
+    Index of the nbNeighbors closest directions of each direction. The
+    directions must be unit vectors sorted by decreasing z, so candidates
+    within twice the spacing lie in a window of indices around each one.
+    """
+    count = len(directions)
+    window = int(ceil(count * min(2.0, 2.0 * radians(angularSpacing)) / 2.0)) + nbNeighbors
+    neighbors = []
+    if numpy is not None:
+        vectors = numpy.array(directions)
+        for idx in range(count):
+            start = max(0, idx - window)
+            dots = vectors[start:idx + window + 1].dot(vectors[idx])
+            dots[idx - start] = -2.0
+            closest = numpy.argsort(-dots, kind='mergesort')[:nbNeighbors]
+            neighbors.append([ int(other) + start for other in closest ])
+        return neighbors
+
+    for idx, direction in enumerate(directions):
+        candidates = range(max(0, idx - window), min(count, idx + window + 1))
+        closest = heapq.nsmallest(nbNeighbors, ((-dotProduct(direction, directions[other]), other) for other in candidates if other != idx))
+        neighbors.append([ other for distance, other in closest ])
+    return neighbors
+
+class FibonacciCamera(object):
+    """
+    Views spread uniformly over the sphere around the focal point along a
+    Fibonacci lattice, instead of the phi x theta grid of SphericalCamera
+    which oversamples the poles. For the same angular spacing between
+    neighboring views it needs about 30% fewer views than a grid with that
+    step at the equator.
+
+    Views are indexed by a single 'view' argument. The 'FibonacciCamera'
+    section of index.json gives, for each view, its phi and theta angles
+    (as SphericalCamera would, in degrees) and the indices of its closest
+    views so viewers can navigate between them.
+    """
+    def __init__(self, dataHandler, focalPoint, position, phiAxis, angularSpacing, nbNeighbors=6):
+        self.dataHandler = dataHandler
+        self.focalPoint = tuple(i for i in focalPoint)
+        self.phiAngles, self.thetaAngles = computeFibonacciSphere(angularSpacing)
+
+        # Orthonormal frame: w along phiAxis, u toward the initial position at phi=0
+        offset = tuple(position[i] - self.focalPoint[i] for i in range(3))
+        self.distance = sqrt(dotProduct(offset, offset))
+        self.w = normalize(phiAxis, 0.0)
+        along = dotProduct(offset, self.w)
+        self.u = normalize(tuple(offset[i] - along * self.w[i] for i in range(3)), 0.0)
+        self.v = vectProduct(self.u, self.w)
+
+        directions = [ self.getDirection(idx) for idx in range(len(self.phiAngles)) ]
+        self.neighbors = computeNeighbors(directions, angularSpacing, nbNeighbors)
+        self.cameraSettings = CameraSequence(self.getCameraAt, len(directions))
+
+        self.dataHandler.registerArgument(priority=0, name='view', values=range(len(directions)), ui='slider')
+        self.dataHandler.addSection('FibonacciCamera', {
+            'angularSpacing': angularSpacing,
+            'phi': self.phiAngles,
+            'theta': self.thetaAngles,
+            'neighbors': self.neighbors
+        })
+        self.dataHandler.updateBasePattern()
+
+    def getDirection(self, viewIdx):
+        phi = radians(self.phiAngles[viewIdx])
+        theta = radians(self.thetaAngles[viewIdx])
+        return tuple(cos(theta) * (cos(phi) * self.u[i] + sin(phi) * self.v[i]) + sin(theta) * self.w[i] for i in range(3))
+
+    def getCameraAt(self, viewIdx):
+        phi = radians(self.phiAngles[viewIdx])
+        theta = radians(self.thetaAngles[viewIdx])
+        direction = self.getDirection(viewIdx)
+        # Tangent toward phiAxis, like the view up of SphericalCamera
+        viewUp = tuple(cos(theta) * self.w[i] - sin(theta) * (cos(phi) * self.u[i] + sin(phi) * self.v[i]) for i in range(3))
+        return {
+            'view': viewIdx,
+            'viewIdx': viewIdx,
+            'phi': self.phiAngles[viewIdx],
+            'theta': self.thetaAngles[viewIdx],
+            'focalPoint': self.focalPoint,
+            'position': tuple(self.focalPoint[i] + self.distance * direction[i] for i in range(3)),
+            'viewUp': viewUp
+        }
+
+    def __len__(self):
+        return len(self.cameraSettings)
+
+    def __getitem__(self, key):
+        return self.cameraSettings[key]
+
+    def getCameraData(self, workItem):
+        return self.cameraSettings[dict(workItem)['view']]
+
+    def getArgumentNames(self):
+        return ['view']
+
+    def updatePriority(self, priorityList):
+        keyList = ['view']
+        for idx in range(min(len(priorityList), len(keyList))):
+            self.dataHandler.updatePriority(keyList[idx], priorityList[idx])
+
+    def __iter__(self):
+        self.dataHandler.startProgressiveTraversal('view')
+        visited = []
+        for level in self.dataHandler.getProgressiveLevels('view'):
+            for viewIdx in level:
+                self.dataHandler.setArguments(view=viewIdx)
+                yield self.cameraSettings[viewIdx]
+            visited.extend(level)
+            self.dataHandler.updateAvailableValues('view', visited)
+
 # -----------------------------------------------------------------------------
 # MultiView Camera
 # -----------------------------------------------------------------------------
@@ -171,17 +530,241 @@ class MultiViewCamera(object):
         self.positionNames = []
 
     def registerViewPoint(self, name, focalPoint, position, viewUp):
-        self.cameraSettings.append({'name': name, 'nameIdx': len(self.positionNames), 'focalPoint': focalPoint, 'position': position, 'viewUp': viewUp})
-        self.positionNames.append(name)
+        self.registerViewPoints([ (name, focalPoint, position, viewUp) ])
+
+    def registerViewPoints(self, viewPoints):
+        """
+        Register a list of (name, focalPoint, position, viewUp) at once,
+        updating the multiView argument a single time.
+        """
+        for name, focalPoint, position, viewUp in viewPoints:
+            self.cameraSettings.append({'name': name, 'nameIdx': len(self.positionNames), 'focalPoint': focalPoint, 'position': position, 'viewUp': viewUp})
+            self.positionNames.append(name)
         self.dataHandler.registerArgument(priority=0, name='multiView', values=self.positionNames)
         self.dataHandler.updateBasePattern()
 
+    def __len__(self):
+        return len(self.cameraSettings)
+
+    def __getitem__(self, key):
+        return self.cameraSettings[key]
+
+    def getCameraData(self, workItem):
+        return self.cameraSettings[dict(workItem)['multiView']]
+
+    def getArgumentNames(self):
+        return ['multiView']
+
     def updatePriority(self, priorityList):
         keyList = ['multiView']
         for idx in range(min(len(priorityList), len(keyList))):
             self.dataHandler.updatePriority(keyList[idx], priorityList[idx])
 
     def __iter__(self):
-        for cameraData in self.cameraSettings:
-            self.dataHandler.setArguments(multiView=cameraData['nameIdx'])
-            yield cameraData
+        # multiView is only registered with the first view point
+        if not self.cameraSettings:
+            return
+
+        self.dataHandler.startProgressiveTraversal('multiView')
+        visited = []
+        for level in self.dataHandler.getProgressiveLevels('multiView'):
+            for viewIdx in level:
+                cameraData = self.cameraSettings[viewIdx]
+                self.dataHandler.setArguments(multiView=cameraData['nameIdx'])
+                yield cameraData
+            visited.extend(level)
+            self.dataHandler.updateAvailableValues('multiView', visited)
+
+# -----------------------------------------------------------------------------
+# Path Camera
+# -----------------------------------------------------------------------------
+
+def frameToQuaternion(right, up, back):
+    """
+    Quaternion of the rotation mapping the x, y and z axes to the given
+    orthonormal camera frame.
+    """
+    trace = right[0] + up[1] + back[2]
+    if trace > 0:
+        s = sqrt(trace + 1.0) * 2
+        return (s / 4, (up[2] - back[1]) / s, (back[0] - right[2]) / s, (right[1] - up[0]) / s)
+    if right[0] > up[1] and right[0] > back[2]:
+        s = sqrt(1.0 + right[0] - up[1] - back[2]) * 2
+        return ((up[2] - back[1]) / s, s / 4, (up[0] + right[1]) / s, (back[0] + right[2]) / s)
+    if up[1] > back[2]:
+        s = sqrt(1.0 + up[1] - right[0] - back[2]) * 2
+        return ((back[0] - right[2]) / s, (up[0] + right[1]) / s, s / 4, (back[1] + up[2]) / s)
+    s = sqrt(1.0 + back[2] - right[0] - up[1]) * 2
+    return ((right[1] - up[0]) / s, (back[0] + right[2]) / s, (back[1] + up[2]) / s, s / 4)
+
+def slerp(q1, q2, t):
+    dot = sum(q1[i] * q2[i] for i in range(4))
+    if dot < 0:
+        q2 = tuple(-n for n in q2)
+        dot = -dot
+    if dot > 0.9995:
+        return normalize(tuple(q1[i] + t * (q2[i] - q1[i]) for i in range(4)), 0.0)
+    angle = acos(dot)
+    w1 = sin((1 - t) * angle) / sin(angle)
+    w2 = sin(t * angle) / sin(angle)
+    return tuple(w1 * q1[i] + w2 * q2[i] for i in range(4))
+
+def catmullRom(p0, p1, p2, p3, t):
+    t2 = t * t
+    t3 = t2 * t
+    return tuple(0.5 * (2 * p1[i] + (p2[i] - p0[i]) * t + (2 * p0[i] - 5 * p1[i] + 4 * p2[i] - p3[i]) * t2 + (3 * p1[i] - p0[i] - 3 * p2[i] + p3[i]) * t3) for i in range(3))
+
+def interpolateKeyFrames(keyFrames, nbFrames):
+    """
+    Return nbFrames (focalPoint, position, viewUp) along the key frames.
+    Positions follow a Catmull-Rom spline through the key frame positions,
+    orientations are slerped and the focal distance linearly interpolated.
+    Key frames are dicts with position, focalPoint, viewUp and an optional
+    time (evenly spaced otherwise).
+    """
+    positions = [ tuple(float(n) for n in keyFrame['position']) for keyFrame in keyFrames ]
+    times = [ keyFrame.get('time', idx) for idx, keyFrame in enumerate(keyFrames) ]
+    distances = []
+    orientations = []
+    for keyFrame, position in zip(keyFrames, positions):
+        direction = tuple(keyFrame['focalPoint'][i] - position[i] for i in range(3))
+        distances.append(sqrt(dotProduct(direction, direction)))
+        right = vectProduct(direction, keyFrame['viewUp'])
+        up = vectProduct(right, direction)
+        back = normalize(tuple(-n for n in direction), 0.0)
+        orientation = frameToQuaternion(right, up, back)
+        # Stay on the same hemisphere to slerp along the shortest arc
+        if orientations and sum(orientation[i] * orientations[-1][i] for i in range(4)) < 0:
+            orientation = tuple(-n for n in orientation)
+        orientations.append(orientation)
+
+    frames = []
+    segment = 0
+    lastKey = len(keyFrames) - 1
+    for frameIdx in range(nbFrames):
+        time = times[0] + (times[-1] - times[0]) * frameIdx / float(max(1, nbFrames - 1))
+        while segment < lastKey - 1 and time > times[segment + 1]:
+            segment += 1
+        nextKey = min(segment + 1, lastKey)
+        span = times[nextKey] - times[segment]
+        t = min(1.0, max(0.0, (time - times[segment]) / span)) if span else 0.0
+
+        position = catmullRom(positions[max(0, segment - 1)], positions[segment], positions[nextKey], positions[min(lastKey, nextKey + 1)], t)
+        orientation = slerp(orientations[segment], orientations[nextKey], t)
+        distance = distances[segment] + t * (distances[nextKey] - distances[segment])
+        back = qv_mult(orientation, (0.0, 0.0, 1.0))
+        viewUp = qv_mult(orientation, (0.0, 1.0, 0.0))
+        focalPoint = tuple(position[i] - distance * back[i] for i in range(3))
+        frames.append((focalPoint, position, viewUp))
+
+    return frames
+
+class PathCamera(MultiViewCamera):
+    """
+    Fly-through along a few key frames, interpolated into nbFrames views
+    registered at once as the multiView argument (named by frame index).
+    """
+    def __init__(self, dataHandler, keyFrames, nbFrames):
+        MultiViewCamera.__init__(self, dataHandler)
+        self.keyFrames = keyFrames
+        frames = interpolateKeyFrames(keyFrames, nbFrames)
+        self.registerViewPoints([ (frameIdx, focalPoint, position, viewUp) for frameIdx, (focalPoint, position, viewUp) in enumerate(frames) ])
+
+# -----------------------------------------------------------------------------
+# Camera table
+# -----------------------------------------------------------------------------
+
+def lookAtMatrix(position, focalPoint, viewUp):
+    """
+    Row-major 4x4 view matrix, as vtkCamera.GetViewTransformMatrix().
+    """
+    direction = normalize(tuple(focalPoint[i] - position[i] for i in range(3)), 0.0)
+    right = vectProduct(direction, viewUp)
+    up = vectProduct(right, direction)
+    back = tuple(-n for n in direction)
+    return [
+        right[0], right[1], right[2], -dotProduct(right, position),
+        up[0], up[1], up[2], -dotProduct(up, position),
+        back[0], back[1], back[2], -dotProduct(back, position),
+        0.0, 0.0, 0.0, 1.0
+    ]
+
+def perspectiveMatrix(viewAngle, aspect, clippingRange):
+    """
+    Row-major 4x4 projection matrix mapping the clipping range to [-1, 1],
+    as vtkCamera.GetProjectionTransformMatrix(aspect, -1, 1).
+    """
+    near, far = clippingRange
+    f = 1.0 / tan(radians(viewAngle) / 2.0)
+    return [
+        f / aspect, 0.0, 0.0, 0.0,
+        0.0, f, 0.0, 0.0,
+        0.0, 0.0, -(far + near) / (far - near), -2.0 * far * near / (far - near),
+        0.0, 0.0, -1.0, 0.0
+    ]
+
+class CameraTable(object):
+    """
+    Camera of every view of a camera object stored as a single float32
+    array, one row per view in the row-major order of its arguments
+    (getArgumentNames()), the same as cameraSettings:
+
+        position(3) focalPoint(3) viewUp(3) viewAngle aspect near far
+        viewMatrix(16) projectionMatrix(16)
+
+    The 'CameraTable' section of index.json references the file, stored
+    uncompressed whatever the storage compression, and describes the
+    layout. The projection of each view is the one recorded
+    while rendering it, or the default one given by setProjection(). The
+    default clipping range spans twice the camera distance.
+    """
+    layout = [ ('position', 3), ('focalPoint', 3), ('viewUp', 3), ('viewAngle', 1), ('aspect', 1), ('clippingRange', 2), ('viewMatrix', 16), ('projectionMatrix', 16) ]
+    stride = sum(size for name, size in layout)
+
+    def __init__(self, camera, dataHandler):
+        self.camera = camera
+        self.dataHandler = dataHandler
+        self.projection = (30.0, 1.0, None)
+        self.projections = {}
+
+    def setProjection(self, viewAngle, aspect, clippingRange=None):
+        self.projection = (viewAngle, aspect, tuple(clippingRange) if clippingRange else None)
+
+    def getFlatIndex(self, indices):
+        flatIdx = 0
+        for name in self.camera.getArgumentNames():
+            flatIdx = flatIdx * len(self.dataHandler.arguments[name]['values']) + indices[name]
+        return flatIdx
+
+    def record(self, viewAngle, aspect, clippingRange):
+        """
+        Keep the projection used to render the view of the current arguments.
+        """
+        self.projections[self.getFlatIndex(self.dataHandler.current)] = (viewAngle, aspect, tuple(clippingRange))
+
+    def getRow(self, flatIdx):
+        cameraData = self.camera.cameraSettings[flatIdx]
+        position, focalPoint, viewUp = cameraData['position'], cameraData['focalPoint'], cameraData['viewUp']
+        viewAngle, aspect, clippingRange = self.projections.get(flatIdx, self.projection)
+        if not clippingRange:
+            distance = sqrt(sum((position[i] - focalPoint[i]) ** 2 for i in range(3)))
+            clippingRange = (0.01 * distance, 2.0 * distance)
+
+        return list(position) + list(focalPoint) + list(viewUp) + [ viewAngle, aspect ] + list(clippingRange) \
+            + lookAtMatrix(position, focalPoint, viewUp) + perspectiveMatrix(viewAngle, aspect, clippingRange)
+
+    def write(self, fileName='cameras.float32'):
+        table = array('f')
+        count = len(self.camera.cameraSettings)
+        for flatIdx in range(count):
+            table.extend(self.getRow(flatIdx))
+
+        self.dataHandler.writeFile(os.path.join(self.dataHandler.getBasePath(), fileName), table, compress=False)
+        self.dataHandler.addSection('CameraTable', {
+            'file': fileName,
+            'type': 'float32',
+            'count': count,
+            'stride': self.stride,
+            'arguments': self.camera.getArgumentNames(),
+            'layout': [ { 'name': name, 'size': size } for name, size in self.layout ]
+        })
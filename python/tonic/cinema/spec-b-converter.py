@@ -11,9 +11,11 @@ from PIL import ImImagePlugin
 from PIL import Image
 
 from vtk import *
-from tonic.paraview import data_converter
 
 def extractFloatArrays(directory, ranges):
+    # Needs pvpython, keep the order and intensity helpers usable without it
+    from tonic.paraview import data_converter
+
     for root, dirs, files in os.walk(directory):
         for name in files:
             if '.png' in name:
@@ -135,30 +137,31 @@ def createOrderFile(directory, nbLayers, intensityArray, width, height):
 # =============================================================================
 # Start processing dataset
 # =============================================================================
-convertFileName = os.path.join(sys.argv[-1], 'convert.json')
-tonicFileName = os.path.join(sys.argv[-1], 'index.json')
-with open(convertFileName, "r") as f:
-    convertInfo = json.load(f)
-
-    for directory in convertInfo['directories']:
-        # Convert images to float
-        imageSize = extractFloatArrays(directory, convertInfo['scalars'])
-
-        # Convert luminence to intensity
-        intensityStack = createIntensityArray(directory, convertInfo['layers'])
-
-        # Generate order layer
-        createOrderFile(directory, convertInfo['layers'], intensityStack, imageSize[0], imageSize[1])
-
-    # Update image size inside index.json
-    with open(tonicFileName, "r") as f:
-        tonicMeta = json.load(f)
-        tonicMeta['SortedComposite']['dimensions'] = [ imageSize[0], imageSize[1] ]
-        print "resolution", imageSize[0], 'x', imageSize[1], '=', (imageSize[0]*imageSize[1])
-        with open(tonicFileName + '_', 'w') as fw:
-            fw.write(json.dumps(tonicMeta, indent=4))
-
-    os.remove(tonicFileName)
-    os.rename(tonicFileName + '_', tonicFileName)
-
-os.remove(convertFileName)
\ No newline at end of file
+if __name__ == '__main__':
+    convertFileName = os.path.join(sys.argv[-1], 'convert.json')
+    tonicFileName = os.path.join(sys.argv[-1], 'index.json')
+    with open(convertFileName, "r") as f:
+        convertInfo = json.load(f)
+
+        for directory in convertInfo['directories']:
+            # Convert images to float
+            imageSize = extractFloatArrays(directory, convertInfo['scalars'])
+
+            # Convert luminence to intensity
+            intensityStack = createIntensityArray(directory, convertInfo['layers'])
+
+            # Generate order layer
+            createOrderFile(directory, convertInfo['layers'], intensityStack, imageSize[0], imageSize[1])
+
+        # Update image size inside index.json
+        with open(tonicFileName, "r") as f:
+            tonicMeta = json.load(f)
+            tonicMeta['SortedComposite']['dimensions'] = [ imageSize[0], imageSize[1] ]
+            print "resolution", imageSize[0], 'x', imageSize[1], '=', (imageSize[0]*imageSize[1])
+            with open(tonicFileName + '_', 'w') as fw:
+                fw.write(json.dumps(tonicMeta, indent=4))
+
+        os.remove(tonicFileName)
+        os.rename(tonicFileName + '_', tonicFileName)
+
+    os.remove(convertFileName)
\ No newline at end of file
@@ -0,0 +1,273 @@
+"""
+Parallel compressor for existing Tonic datasets
+
+    python -m tonic.compress /path/to/dataset --codec array=gzip:9 --processes 8
+
+Entries are found through the data patterns of index.json (sidecar files
+included), (re)compressed across processes and the descriptor is updated
+in place.
+"""
+
+import os, sys, json, time, zlib, bz2, hashlib, itertools, argparse
+
+from multiprocessing import Pool, cpu_count
+
+from tonic import PathTemplate, loadDataDescriptor
+from tonic.storage import codecs
+
+# Global helper variables
+defaultCodecs = {
+    'array': ('gzip', 9)
+}
+decompressors = {
+    '.gz': lambda content: zlib.decompress(content, 16 + zlib.MAX_WBITS),
+    '.bz2': bz2.decompress
+}
+
+# -----------------------------------------------------------------------------
+# Worker side
+# -----------------------------------------------------------------------------
+
+def _findStoredFile(fullPath):
+    for suffix in decompressors:
+        if os.path.exists(fullPath + suffix):
+            return (fullPath + suffix, suffix)
+    if os.path.exists(fullPath):
+        return (fullPath, '')
+    return (None, None)
+
+def _processEntry(task):
+    name, relativePath, fullPath, codec, level, force = task
+    storedPath, storedSuffix = _findStoredFile(fullPath)
+    if not storedPath:
+        return None
+
+    start = time.time()
+    suffix = codecs[codec][0] if codec else ''
+    storedSize = os.path.getsize(storedPath)
+    with open(storedPath, 'rb') as f:
+        content = f.read()
+
+    if storedSuffix == suffix and not force:
+        # Already stored with the requested codec and level
+        rawSize = len(decompressors[suffix](content)) if suffix else storedSize
+        return (name, relativePath, rawSize, storedSize, storedSize, hashlib.md5(content).hexdigest(), 0.0, None)
+
+    if storedSuffix:
+        content = decompressors[storedSuffix](content)
+    rawSize = len(content)
+    if codec:
+        content = codecs[codec][1](content, level)
+
+    # Replace atomically, then drop the previous encoding
+    newPath = fullPath + suffix
+    tmpPath = newPath + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        f.write(content)
+    os.rename(tmpPath, newPath)
+    if storedPath != newPath:
+        os.remove(storedPath)
+
+    return (name, relativePath, rawSize, storedSize, len(content), hashlib.md5(content).hexdigest(), time.time() - start, newPath)
+
+# -----------------------------------------------------------------------------
+# Dataset Compressor
+# -----------------------------------------------------------------------------
+
+class DatasetCompressor(object):
+    """
+    Compress or recompress the entries of a dataset with a codec chosen
+    per data name or data type (e.g. { 'array': ('bz2', 9) }). A None
+    codec stores the entries uncompressed. Data types without codec, like
+    images, are left untouched.
+    """
+    def __init__(self, basePath, codecMapping=None, nbProcesses=None):
+        self.basePath = basePath
+        self.codecMapping = dict(defaultCodecs)
+        self.codecMapping.update(codecMapping or {})
+        self.nbProcesses = nbProcesses if nbProcesses else cpu_count()
+
+        # Entries are listed from the resolved descriptor while the changes
+        # go to the root document so its sidecar references are kept
+        with open(os.path.join(basePath, 'index.json'), 'r') as f:
+            self.rootDescriptor = json.load(f)
+        self.descriptor = loadDataDescriptor(basePath)
+
+        if 'PackedStorage' in self.descriptor or 'ArchiveStorage' in self.descriptor:
+            raise ValueError('Only datasets with one file per entry can be compressed')
+
+    def getCodec(self, item):
+        if item['name'] in self.codecMapping:
+            return self.codecMapping[item['name']]
+        return self.codecMapping.get(item.get('type'), False)
+
+    def getRelativePaths(self, item):
+        arguments = self.descriptor['arguments']
+        template = PathTemplate(item['pattern'])
+        fields = [ field for field in (template.fields if template.fields is not None else arguments) if field in arguments ]
+        for values in itertools.product(*[ arguments[field]['values'] for field in fields ]):
+            yield template.format(dict(('%s' % field, '{value}'.format(value=value)) for field, value in zip(fields, values)))
+
+    def getTasks(self, force=False):
+        references = self.descriptor.get('DeduplicatedStorage', {}).get('references', {})
+        for item in self.descriptor['data']:
+            codec = self.getCodec(item)
+            if codec is False:
+                continue
+
+            # The stored suffix tells the codec of each entry, only a level
+            # recorded by a previous run can require recompressing it
+            codecName, level = codec if codec else (None, None)
+            compression = item.get('metadata', {}).get('compression') or {}
+            forceItem = force or (compression.get('codec') == codecName and compression.get('level', level) != level)
+            for relativePath in self.getRelativePaths(item):
+                if relativePath in references:
+                    # Shares the content of an entry processed on its own
+                    continue
+                yield (item['name'], relativePath, os.path.join(self.basePath, relativePath), codecName, level, forceItem)
+
+    def run(self, force=False):
+        """
+        Process every entry and return the report per data name.
+        """
+        tasks = list(self.getTasks(force))
+        if not tasks:
+            raise ValueError('No entry to compress found in %s' % self.basePath)
+
+        deduplication = self.descriptor.get('DeduplicatedStorage', {})
+        referencesOf = {}
+        for reference, original in deduplication.get('references', {}).iteritems():
+            referencesOf.setdefault(original, []).append(reference)
+
+        report = {}
+        processed = {}
+        start = time.time()
+        pool = Pool(self.nbProcesses)
+        try:
+            for result in pool.imap_unordered(_processEntry, tasks, 16):
+                if not result:
+                    continue
+                name, relativePath, rawSize, before, after, md5, duration, newPath = result
+                stats = report.setdefault(name, { 'files': 0, 'raw': 0, 'before': 0, 'after': 0, 'time': 0.0 })
+                stats['files'] += 1
+                stats['raw'] += rawSize
+                stats['before'] += before
+                stats['after'] += after
+                stats['time'] += duration
+                processed[relativePath] = (after, md5)
+                for reference in referencesOf.get(relativePath, []):
+                    processed[reference] = (after, md5)
+                    if newPath:
+                        self.relink(newPath, reference)
+        finally:
+            pool.close()
+            pool.join()
+
+        if not processed:
+            raise IOError('None of the %d entries listed by %s were found on disk' % (len(tasks), os.path.join(self.basePath, 'index.json')))
+
+        self.updateDescriptor(report)
+        self.updateManifest(processed)
+        self.elapsed = time.time() - start
+        return report
+
+    def relink(self, storedPath, reference):
+        # Hard links still point at the previous encoding of the original,
+        # references without one on disk are only listed in index.json
+        fullPath = os.path.join(self.basePath, reference)
+        linkPath = _findStoredFile(fullPath)[0]
+        if not linkPath:
+            return
+        while linkPath:
+            os.remove(linkPath)
+            linkPath = _findStoredFile(fullPath)[0]
+        suffix = ''.join(suffix for suffix in decompressors if storedPath.endswith(suffix))
+        os.link(storedPath, fullPath + suffix)
+
+    def _writeAtomically(self, path, content):
+        tmpPath = path + '.tmp'
+        with open(tmpPath, 'w') as f:
+            f.write(content)
+        os.rename(tmpPath, path)
+
+    def updateDescriptor(self, report):
+        delta = 0
+        for item in self.rootDescriptor['data']:
+            if item['name'] not in report:
+                continue
+            codec = self.getCodec(item)
+            stats = report[item['name']]
+            metadata = item.setdefault('metadata', {})
+            metadata['compression'] = {
+                'codec': codec[0] if codec else None,
+                'level': codec[1] if codec else None,
+                'ratio': float(stats['raw']) / stats['after'] if stats['after'] else 1.0
+            }
+
+            # Keep the output accounting in line with the stored sizes
+            delta += stats['after'] - stats['before']
+            if 'output' in metadata:
+                self._updateOutput(metadata['output'], stats['after'] - stats['before'])
+
+        total = self.rootDescriptor.get('metadata', {}).get('output')
+        if total:
+            self._updateOutput(total, delta)
+
+        self._writeAtomically(os.path.join(self.basePath, 'index.json'), json.dumps(self.rootDescriptor))
+
+    def _updateOutput(self, output, delta):
+        output['bytes'] += delta
+        output['ratio'] = float(output['rawBytes']) / output['bytes'] if output['bytes'] else 1.0
+
+    def updateManifest(self, processed):
+        # Keep a resume manifest in sync with the new file sizes
+        manifestPath = os.path.join(self.basePath, 'manifest.txt')
+        if not processed or not os.path.exists(manifestPath):
+            return
+
+        entries = []
+        with open(manifestPath, 'r') as manifestFile:
+            for line in manifestFile:
+                if line.strip():
+                    entry = json.loads(line)
+                    if entry['path'] in processed:
+                        entry['size'], entry['md5'] = processed[entry['path']]
+                    entries.append(json.dumps(entry) + '\n')
+
+        self._writeAtomically(manifestPath, ''.join(entries))
+
+    def printReport(self, report):
+        print '%-20s %8s %12s %12s %12s %8s %10s' % ('Data', 'Files', 'Raw (MB)', 'Before (MB)', 'After (MB)', 'Ratio', 'MB/s')
+        for name in sorted(report):
+            stats = report[name]
+            ratio = float(stats['raw']) / stats['after'] if stats['after'] else 1.0
+            throughput = stats['raw'] / 1048576.0 / stats['time'] if stats['time'] else 0.0
+            print '%-20s %8d %12.2f %12.2f %12.2f %8.2f %10.2f' % (name, stats['files'], stats['raw'] / 1048576.0, stats['before'] / 1048576.0, stats['after'] / 1048576.0, ratio, throughput)
+        print 'Processed in %.2fs with %d processes' % (self.elapsed, self.nbProcesses)
+
+# -----------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+
+def parseCodec(value):
+    """
+    Parse 'key=codec[:level]' where codec can be 'none'.
+    """
+    key, codec = value.split('=')
+    codec, level = (codec.split(':') + ['9'])[:2]
+    if codec == 'none':
+        return (key, None)
+    if codec not in codecs:
+        raise argparse.ArgumentTypeError('Unknown codec %s' % codec)
+    return (key, (codec, int(level)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compress or recompress the entries of a Tonic dataset')
+    parser.add_argument('directory', help='Dataset directory containing index.json')
+    parser.add_argument('--codec', action='append', type=parseCodec, default=[], help='Data name or type to codec mapping, e.g. array=bz2:9 or order=none')
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes (all cores by default)')
+    parser.add_argument('--force', action='store_true', help='Recompress entries already stored with the requested codec')
+    args = parser.parse_args()
+
+    compressor = DatasetCompressor(args.directory, dict(args.codec), args.processes)
+    compressor.printReport(compressor.run(args.force))
@@ -0,0 +1,191 @@
+"""
+Image encoding shared by the vtk and paraview capture code
+"""
+
+import zlib, struct, threading, Queue
+
+from multiprocessing.pool import ThreadPool
+
+from tonic.profiler import nullProfiler
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Global helper variables
+pngColorTypes = { 1: 0, 2: 4, 3: 2, 4: 6 }
+pngSignature = '\x89PNG\r\n\x1a\n'
+
+# -----------------------------------------------------------------------------
+# PNG encoding
+# -----------------------------------------------------------------------------
+
+def pngChunk(chunkType, data):
+    return struct.pack('>I', len(data)) + chunkType + data + struct.pack('>I', zlib.crc32(chunkType + data) & 0xffffffff)
+
+def pngHeader(width, height, components):
+    return pngSignature + pngChunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, pngColorTypes[components], 0, 0, 0))
+
+def filterRows(pixels, width, components, flip=True, previousRow=None):
+    """
+    Prefix each row of 8 bit pixels with its PNG filter byte. With numpy
+    the 'Up' filter is used, relative to previousRow for the first one,
+    otherwise rows are stored unfiltered. VTK images start with the
+    bottom row, hence flip.
+    """
+    stride = width * components
+    height = len(pixels) / stride
+    if numpy is not None:
+        rows = numpy.frombuffer(pixels, numpy.uint8, height * stride).reshape(height, stride)
+        if flip:
+            rows = rows[::-1]
+        filtered = numpy.empty((height, stride + 1), numpy.uint8)
+        filtered[:, 0] = 2
+        if previousRow is None:
+            filtered[0, 1:] = rows[0]
+        else:
+            numpy.subtract(rows[0], numpy.frombuffer(previousRow, numpy.uint8, stride), filtered[0, 1:])
+        numpy.subtract(rows[1:], rows[:-1], filtered[1:, 1:])
+        return filtered.tostring()
+
+    pixels = str(buffer(pixels))
+    rowRange = range(height - 1, -1, -1) if flip else range(height)
+    return ''.join('\x00' + pixels[row * stride:(row + 1) * stride] for row in rowRange)
+
+def encodePNG(pixels, width, height, components, level=6, flip=True):
+    """
+    Encode 8 bit pixels with zlib, which releases the GIL while
+    compressing, unlike the VTK writers.
+    """
+    data = zlib.compress(filterRows(pixels, width, components, flip), level)
+    return pngHeader(width, height, components) + pngChunk('IDAT', data) + pngChunk('IEND', '')
+
+def assembleRows(tiles, tileStride, tileHeight, flip=True):
+    """
+    Concatenate a row of tiles side by side into top-down image rows.
+    """
+    rowRange = range(tileHeight - 1, -1, -1) if flip else range(tileHeight)
+    rows = bytearray()
+    for row in rowRange:
+        for tile in tiles:
+            rows += tile[row * tileStride:(row + 1) * tileStride]
+    return rows
+
+class PNGStreamWriter(object):
+    """
+    Write a PNG file a band of top-down rows at a time, so only the
+    current band has to be kept in memory.
+    """
+    def __init__(self, fileObject, width, height, components, level=6):
+        self.file = fileObject
+        self.width = width
+        self.components = components
+        self.compressor = zlib.compressobj(level)
+        self.previousRow = None
+        self.file.write(pngHeader(width, height, components))
+
+    def writeRows(self, rows):
+        stride = self.width * self.components
+        data = self.compressor.compress(filterRows(rows, self.width, self.components, False, self.previousRow))
+        self.previousRow = str(buffer(rows, len(rows) - stride, stride))
+        if data:
+            self.file.write(pngChunk('IDAT', data))
+
+    def close(self):
+        self.file.write(pngChunk('IDAT', self.compressor.flush()))
+        self.file.write(pngChunk('IEND', ''))
+
+class JPEGEncoder(object):
+    """
+    JPEG encoding through one vtkJPEGWriter per thread.
+    """
+    def __init__(self, quality=95):
+        # Only needed for JPEG, keep the module importable without VTK
+        import vtk
+        self.vtk = vtk
+        self.quality = quality
+        self.writers = threading.local()
+
+    def __call__(self, pixels, width, height, components):
+        if not hasattr(self.writers, 'writer'):
+            self.writers.writer = self.vtk.vtkJPEGWriter()
+            self.writers.writer.SetQuality(self.quality)
+            self.writers.writer.WriteToMemoryOn()
+
+        array = self.vtk.vtkUnsignedCharArray()
+        array.SetNumberOfComponents(components)
+        array.SetVoidArray(pixels, len(pixels), 1)
+        image = self.vtk.vtkImageData()
+        image.SetDimensions(width, height, 1)
+        image.GetPointData().SetScalars(array)
+
+        writer = self.writers.writer
+        writer.SetInputData(image)
+        writer.Write()
+        return buffer(writer.GetResult())[:]
+
+def createImageEncoder(mimeType):
+    if mimeType == 'image/jpg':
+        return JPEGEncoder()
+    return encodePNG
+
+# -----------------------------------------------------------------------------
+# Asynchronous encode and write
+# -----------------------------------------------------------------------------
+
+class AsyncImageWriter(object):
+    """
+    Encode captured pixels and hand the result to a callback on a worker
+    pool, so the caller can render the next frame meanwhile. Pixels are
+    copied into one of nbBuffers reusable buffers (2 per worker by
+    default) and submit() blocks while all of them are in flight.
+    """
+    def __init__(self, encode=encodePNG, nbWorkers=2, nbBuffers=None):
+        self.encode = encode
+        self.pool = ThreadPool(nbWorkers)
+        self.freeBuffers = Queue.Queue()
+        for idx in range(nbBuffers if nbBuffers else 2 * nbWorkers):
+            self.freeBuffers.put(None)
+        self.results = []
+
+    def _encodeAndWrite(self, pixels, width, height, components, callback, profile):
+        try:
+            with profile('encode'):
+                content = self.encode(pixels, width, height, components)
+            callback(content)
+        finally:
+            self.freeBuffers.put(pixels)
+
+    def _collect(self, wait):
+        remaining = []
+        for result in self.results:
+            if wait or result.ready():
+                # Re-raise any error from the workers
+                result.get()
+            else:
+                remaining.append(result)
+        self.results = remaining
+
+    def submit(self, pixels, width, height, components, callback, profile=nullProfiler.stage):
+        """
+        Copy the pixels (any buffer) and encode them in the background,
+        then call callback(content) from the worker thread.
+        """
+        with profile('wait'):
+            pixelsCopy = self.freeBuffers.get()
+        if pixelsCopy is None or len(pixelsCopy) != len(pixels):
+            pixelsCopy = bytearray(len(pixels))
+        with profile('copy'):
+            pixelsCopy[:] = pixels
+
+        self.results.append(self.pool.apply_async(self._encodeAndWrite, (pixelsCopy, width, height, components, callback, profile)))
+        self._collect(False)
+
+    def flush(self):
+        self._collect(True)
+
+    def close(self):
+        self.flush()
+        self.pool.close()
+        self.pool.join()
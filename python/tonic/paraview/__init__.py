@@ -1,14 +1,51 @@
 from paraview import simple
 from tonic    import camera
+from vtk      import vtkPNGWriter, vtkJPEGWriter
+from tonic.profiler import nullProfiler
 
-def update_camera(viewProxy, cameraData):
+def update_camera(viewProxy, cameraData, render=True):
     viewProxy.CameraFocalPoint = cameraData['focalPoint']
     viewProxy.CameraPosition = cameraData['position']
     viewProxy.CameraViewUp = cameraData['viewUp']
-    simple.Render(viewProxy)
+    # CaptureImage renders on its own
+    if render:
+        simple.Render(viewProxy)
 
-def create_spherical_camera(viewProxy, dataHandler, phiValues, thetaValues):
-    return camera.SphericalCamera(dataHandler, viewProxy.CenterOfRotation, viewProxy.CameraPosition, viewProxy.CameraViewUp, phiValues, thetaValues)
+def record_camera(cameraTable, viewProxy):
+    width, height = viewProxy.ViewSize
+    camera = viewProxy.GetActiveCamera()
+    cameraTable.record(camera.GetViewAngle(), float(width) / height, camera.GetClippingRange())
 
-def create_cylindrical_camera(viewProxy, dataHandler, phiValues, translationValues):
-    return camera.CylindricalCamera(dataHandler, viewProxy.CenterOfRotation, viewProxy.CameraPosition, viewProxy.CameraViewUp, phiValues, translationValues)
+def create_spherical_camera(viewProxy, dataHandler, phiValues, thetaValues, order='row'):
+    return camera.SphericalCamera(dataHandler, viewProxy.CenterOfRotation, viewProxy.CameraPosition, viewProxy.CameraViewUp, phiValues, thetaValues, order)
+
+def create_cylindrical_camera(viewProxy, dataHandler, phiValues, translationValues, order='row'):
+    return camera.CylindricalCamera(dataHandler, viewProxy.CenterOfRotation, viewProxy.CameraPosition, viewProxy.CameraViewUp, phiValues, translationValues, order)
+
+def create_fibonacci_camera(viewProxy, dataHandler, angularSpacing):
+    return camera.FibonacciCamera(dataHandler, viewProxy.CenterOfRotation, viewProxy.CameraPosition, viewProxy.CameraViewUp, angularSpacing)
+
+def create_image_writer(mimeType):
+    writer = vtkJPEGWriter() if mimeType == 'image/jpg' else vtkPNGWriter()
+    writer.WriteToMemoryOn()
+    return writer
+
+def capture_image(viewProxy, writer, profile=nullProfiler.stage):
+    with profile('render'):
+        image = viewProxy.CaptureImage(1)
+
+    with profile('encode'):
+        writer.SetInputData(image)
+        writer.Write()
+    return buffer(writer.GetResult())
+
+def capture_image_async(viewProxy, asyncWriter, callback, profile=nullProfiler.stage):
+    """
+    Render the view and hand its pixels to a tonic.image.AsyncImageWriter.
+    """
+    with profile('render'):
+        image = viewProxy.CaptureImage(1)
+
+    scalars = image.GetPointData().GetScalars()
+    width, height = image.GetDimensions()[:2]
+    asyncWriter.submit(buffer(scalars), width, height, scalars.GetNumberOfComponents(), callback, profile)
@@ -1,6 +1,7 @@
 from vtk import *
 
 from tonic.camera import *
+from tonic.storage import FileSystemStorage
 
 import json, os, math, gzip, shutil
 
@@ -109,8 +110,9 @@ class CompositeJSON(object):
 # Composite Sprite to Sorted Composite Dataset Builder
 # -----------------------------------------------------------------------------
 class ConvertCompositeSpriteToSortedStack(object):
-    def __init__(self, directory):
+    def __init__(self, directory, writeFile=None):
         self.basePath = directory
+        self.writeFile = writeFile if writeFile else FileSystemStorage().write
         self.layers = []
         self.data = []
         self.imageReader = vtkPNGReader()
@@ -159,9 +161,8 @@ class ConvertCompositeSpriteToSortedStack(object):
         stackSize = self.composite.getStackSize()
 
         # Write order (sorted order way)
-        with open(os.path.join(directory, 'order.uint8'), 'wb') as f:
-            f.write(buffer(orderArray))
-            self.data.append({'name': 'order', 'type': 'array', 'fileName': '/order.uint8'})
+        self.writeFile(os.path.join(directory, 'order.uint8'), buffer(orderArray))
+        self.data.append({'name': 'order', 'type': 'array', 'fileName': '/order.uint8'})
 
         # Encode Normals (sorted order way)
         if 'normal' in self.layers[0]:
@@ -231,9 +232,8 @@ class ConvertCompositeSpriteToSortedStack(object):
                         sortedNormal.SetTuple3(idx, 128, 128, 255)
 
             # Write the sorted data
-            with open(os.path.join(directory, 'normal.uint8'), 'wb') as f:
-                f.write(buffer(sortedNormal))
-                self.data.append({'name': 'normal', 'type': 'array', 'fileName': '/normal.uint8', 'categories': ['normal']})
+            self.writeFile(os.path.join(directory, 'normal.uint8'), buffer(sortedNormal))
+            self.data.append({'name': 'normal', 'type': 'array', 'fileName': '/normal.uint8', 'categories': ['normal']})
 
         # Encode Intensity (sorted order way)
         if 'intensity' in self.layers[0]:
@@ -253,9 +253,8 @@ class ConvertCompositeSpriteToSortedStack(object):
                     imageIdx = idx % imageSize
                     sortedIntensity.SetValue(idx, rgbArray.GetValue(imageIdx * 3 + offset))
 
-            with open(os.path.join(directory, 'intensity.uint8'), 'wb') as f:
-                f.write(buffer(sortedIntensity))
-                self.data.append({'name': 'intensity', 'type': 'array', 'fileName': '/intensity.uint8', 'categories': ['intensity']})
+            self.writeFile(os.path.join(directory, 'intensity.uint8'), buffer(sortedIntensity))
+            self.data.append({'name': 'intensity', 'type': 'array', 'fileName': '/intensity.uint8', 'categories': ['intensity']})
 
         # Encode Each layer Scalar
         layerIdx = 0
@@ -279,8 +278,76 @@ class ConvertCompositeSpriteToSortedStack(object):
                             scalarArray.SetValue(idx, float('NaN'))
 
 
-                    with open(os.path.join(directory, '%d_%s.float32' % (layerIdx, scalar)), 'wb') as f:
-                        f.write(buffer(scalarArray))
-                        self.data.append({'name': '%d_%s' % (layerIdx, scalar), 'type': 'array', 'fileName': '/%d_%s.float32' % (layerIdx, scalar), 'categories': ['%d_%s' % (layerIdx, scalar)]})
+                    self.writeFile(os.path.join(directory, '%d_%s.float32' % (layerIdx, scalar)), buffer(scalarArray))
+                    self.data.append({'name': '%d_%s' % (layerIdx, scalar), 'type': 'array', 'fileName': '/%d_%s.float32' % (layerIdx, scalar), 'categories': ['%d_%s' % (layerIdx, scalar)]})
 
             layerIdx += 1
+
+# -----------------------------------------------------------------------------
+# Geometry extraction helpers
+# -----------------------------------------------------------------------------
+
+def extractPoints(originalPoints):
+    nbPoints = originalPoints.GetNumberOfPoints()
+    points = vtkFloatArray()
+    points.SetNumberOfComponents(3)
+    points.SetNumberOfTuples(nbPoints)
+    for idx in range(nbPoints):
+        coord = originalPoints.GetPoint(idx)
+        points.SetTuple3(idx, coord[0], coord[1], coord[2])
+
+    return points
+
+def extractTriangles(poly):
+    """
+    Triangle indices of the polys, quads being split in two triangles.
+    """
+    nbCells = poly.GetNumberOfCells()
+    cellLocation = 0
+    idList = vtkIdList()
+    topo = vtkTypeUInt32Array()
+    topo.Allocate(poly.GetData().GetNumberOfTuples())
+
+    for cellIdx in range(nbCells):
+        poly.GetCell(cellLocation, idList)
+        cellSize = idList.GetNumberOfIds()
+        cellLocation += cellSize + 1
+        if cellSize == 3:
+            topo.InsertNextValue(idList.GetId(0))
+            topo.InsertNextValue(idList.GetId(1))
+            topo.InsertNextValue(idList.GetId(2))
+        elif cellSize == 4:
+            topo.InsertNextValue(idList.GetId(0))
+            topo.InsertNextValue(idList.GetId(1))
+            topo.InsertNextValue(idList.GetId(3))
+            topo.InsertNextValue(idList.GetId(1))
+            topo.InsertNextValue(idList.GetId(2))
+            topo.InsertNextValue(idList.GetId(3))
+        else:
+            print "Cell size of", cellSize, "not supported"
+
+    return topo
+
+def extractMagnitude(array):
+    """
+    Float copy of a single component array, or the magnitude of a
+    multi-component one.
+    """
+    tupleSize = array.GetNumberOfComponents()
+    arraySize = array.GetNumberOfTuples()
+    outputField = vtkFloatArray()
+    outputField.SetNumberOfTuples(arraySize)
+    if tupleSize == 1:
+        for i in range(arraySize):
+            outputField.SetValue(i, array.GetValue(i))
+    else:
+        # compute magnitude
+        tupleIdxs = range(tupleSize)
+        for i in range(arraySize):
+            magnitude = 0
+            for j in tupleIdxs:
+                magnitude += math.pow(array.GetValue(i * tupleSize + j), 2)
+
+            outputField.SetValue(i, math.sqrt(magnitude))
+
+    return outputField
@@ -3,6 +3,9 @@ import os, math
 from paraview import simple
 from vtk import *
 
+from tonic.storage import FileSystemStorage
+from tonic.profiler import nullProfiler
+
 VTK_DATA_TYPES = [ 'void',            # 0
                    'bit',             # 1
                    'char',            # 2
@@ -27,7 +30,7 @@ VTK_DATA_TYPES = [ 'void',            # 0
 
 
 class ScalarRenderer(object):
-    def __init__(self, isWriter=True, removePNG=True):
+    def __init__(self, isWriter=True, removePNG=True, writeFile=None, profile=nullProfiler.stage):
         simple.LoadDistributedPlugin('RGBZView')
 
         self.view = simple.CreateView('RGBZView')
@@ -39,6 +42,8 @@ class ScalarRenderer(object):
         self.cleanAfterMe = removePNG
 
         self.canWrite = isWriter
+        self.writeFile = writeFile if writeFile else FileSystemStorage().write
+        self.profile = profile
 
     def getView(self):
         return self.view
@@ -52,12 +57,14 @@ class ScalarRenderer(object):
         # Grab data
         tmpFileName = path + '__.png'
         self.view.ResetClippingBounds()
-        simple.SaveScreenshot(tmpFileName, self.view)
+        with self.profile('render'):
+            simple.SaveScreenshot(tmpFileName, self.view)
 
         if self.canWrite:
             # Convert data
-            self.reader.SetFileName(tmpFileName)
-            self.reader.Update()
+            with self.profile('readback'):
+                self.reader.SetFileName(tmpFileName)
+                self.reader.Update()
 
             rgbArray = self.reader.GetOutput().GetPointData().GetArray(0)
             arraySize = rgbArray.GetNumberOfTuples()
@@ -65,12 +72,12 @@ class ScalarRenderer(object):
             rawArray = vtkUnsignedCharArray()
             rawArray.SetNumberOfTuples(arraySize)
 
-            for idx in range(arraySize):
-                light = rgbArray.GetTuple3(idx)[0]
-                rawArray.SetTuple1(idx, light)
+            with self.profile('convert'):
+                for idx in range(arraySize):
+                    light = rgbArray.GetTuple3(idx)[0]
+                    rawArray.SetTuple1(idx, light)
 
-            with open(path, 'wb') as f:
-                f.write(buffer(rawArray))
+            self.writeFile(path, buffer(rawArray))
 
             # Delete temporary file
             if self.cleanAfterMe:
@@ -88,12 +95,14 @@ class ScalarRenderer(object):
         # Grab data
         tmpFileName = path + '__.png'
         self.view.ResetClippingBounds()
-        simple.SaveScreenshot(tmpFileName, self.view)
+        with self.profile('render'):
+            simple.SaveScreenshot(tmpFileName, self.view)
 
         if self.canWrite:
             # Convert data
-            self.reader.SetFileName(tmpFileName)
-            self.reader.Update()
+            with self.profile('readback'):
+                self.reader.SetFileName(tmpFileName)
+                self.reader.Update()
 
             rgbArray = self.reader.GetOutput().GetPointData().GetArray(0)
             arraySize = rgbArray.GetNumberOfTuples()
@@ -101,12 +110,12 @@ class ScalarRenderer(object):
             rawArray = vtkUnsignedCharArray()
             rawArray.SetNumberOfTuples(arraySize)
 
-            for idx in range(arraySize):
-                light = rgbArray.GetTuple3(idx)[0]
-                rawArray.SetTuple1(idx, light)
+            with self.profile('convert'):
+                for idx in range(arraySize):
+                    light = rgbArray.GetTuple3(idx)[0]
+                    rawArray.SetTuple1(idx, light)
 
-            with open(path, 'wb') as f:
-                f.write(buffer(rawArray))
+            self.writeFile(path, buffer(rawArray))
 
             # Delete temporary file
             if self.cleanAfterMe:
@@ -150,14 +159,16 @@ class ScalarRenderer(object):
         tmpFileName = path + '__.png'
         self.view.SetScalarRange = dataRange
         self.view.ResetClippingBounds()
-        self.view.StartCaptureValues()
-        simple.SaveScreenshot(tmpFileName, self.view)
-        self.view.StopCaptureValues()
+        with self.profile('render'):
+            self.view.StartCaptureValues()
+            simple.SaveScreenshot(tmpFileName, self.view)
+            self.view.StopCaptureValues()
 
         if self.canWrite:
             # Convert data
-            self.reader.SetFileName(tmpFileName)
-            self.reader.Update()
+            with self.profile('readback'):
+                self.reader.SetFileName(tmpFileName)
+                self.reader.Update()
 
             rgbArray = self.reader.GetOutput().GetPointData().GetArray(0)
             arraySize = rgbArray.GetNumberOfTuples()
@@ -168,20 +179,20 @@ class ScalarRenderer(object):
             minValue = 10000.0
             maxValue = -100000.0
             delta = (dataRange[1] - dataRange[0]) / 16777215.0 # 2^24 - 1 => 16,777,215
-            for idx in range(arraySize):
-                rgb = rgbArray.GetTuple3(idx)
-                if rgb[0] != 0 or rgb[1] != 0 or rgb[2] != 0:
-                    value = dataRange[0] + delta * float(rgb[0]*65536 + rgb[1]*256 + rgb[2] - 1)
-                    rawArray.SetTuple1(idx, value)
-                    minValue = min(value, minValue)
-                    maxValue = max(value, maxValue)
-                else:
-                    rawArray.SetTuple1(idx, float('NaN'))
+            with self.profile('convert'):
+                for idx in range(arraySize):
+                    rgb = rgbArray.GetTuple3(idx)
+                    if rgb[0] != 0 or rgb[1] != 0 or rgb[2] != 0:
+                        value = dataRange[0] + delta * float(rgb[0]*65536 + rgb[1]*256 + rgb[2] - 1)
+                        rawArray.SetTuple1(idx, value)
+                        minValue = min(value, minValue)
+                        maxValue = max(value, maxValue)
+                    else:
+                        rawArray.SetTuple1(idx, float('NaN'))
 
             # print 'Array bounds', minValue, maxValue, 'compare to', dataRange
 
-            with open(path, 'wb') as f:
-                f.write(buffer(rawArray))
+            self.writeFile(path, buffer(rawArray))
 
             # Delete temporary file
             if self.cleanAfterMe:
@@ -1,6 +1,7 @@
 from tonic          import *
 from tonic.paraview import *
 from tonic.camera   import *
+from tonic.image    import AsyncImageWriter, createImageEncoder
 
 from tonic.paraview import data_writer
 from tonic.paraview import data_converter
@@ -9,7 +10,7 @@ from paraview import simple
 from paraview import servermanager
 from vtk import *
 
-import json, os, math, gzip, shutil, hashlib
+import json, os, math, shutil, hashlib, tempfile, warnings
 
 # Global helper variables
 encode_codes = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
@@ -32,10 +33,15 @@ jsMapping = {
 # -----------------------------------------------------------------------------
 
 class DataSetBuilder(object):
+    # Extensions of the entries compressed by default (none)
+    compressedExtensions = ()
+
     def __init__(self, location, camera_data, metadata={}, sections={}):
         self.dataHandler = DataHandler(location)
         self.cameraDescription = camera_data
         self.camera = None
+        self.cameraTable = None
+        self.plannedDirectories = set()
 
         for key, value in metadata.iteritems():
             self.dataHandler.addMetaData(key, value)
@@ -43,12 +49,48 @@ class DataSetBuilder(object):
         for key, value in sections.iteritems():
             self.dataHandler.addSection(key, value)
 
+        # Raw arrays are gzipped by a worker pool as they are written
+        if self.compressedExtensions:
+            self.dataHandler.setCompression('gzip', extensions=self.compressedExtensions)
+
         # Update the can_write flag for MPI
         self.dataHandler.can_write = (servermanager.vtkProcessModule.GetProcessModule().GetPartitionId() == 0)
 
     def getDataHandler(self):
         return self.dataHandler
 
+    def createDirectories(self, *names):
+        """
+        Create once, up-front, the directories of the whole sweep for the
+        given data names. Later writes find them in the handler cache.
+        """
+        if names in self.plannedDirectories:
+            return
+        self.plannedDirectories.add(names)
+        try:
+            self.dataHandler.createDirectories(names)
+        except ValueError:
+            # Patterns the plan can not expand get their directories on write
+            pass
+
+    def setCompression(self, codec='gzip', level=9):
+        """
+        Codec applied to raw arrays as they are written, gzip by default.
+        A None codec keeps them uncompressed. Call before writing data.
+        Builders listing compressedExtensions gzip those entries unless
+        told otherwise, like their former stop(compress=True) default.
+        """
+        if self.compressedExtensions:
+            self.dataHandler.setCompression(codec, level, extensions=self.compressedExtensions)
+        else:
+            self.dataHandler.setCompression(codec, level)
+
+    def _setStopCompression(self, compress):
+        # Deprecated stop(compress=...), only applies to what stop() writes
+        if compress is not None:
+            warnings.warn('stop(compress=...) is deprecated, call setCompression() before writing data', DeprecationWarning, stacklevel=3)
+            self.setCompression('gzip' if compress else None)
+
     def getCamera(self):
         return self.camera
 
@@ -63,9 +105,16 @@ class DataSetBuilder(object):
             # Handle camera if any
             if self.cameraDescription:
                 if self.cameraDescription['type'] == 'spherical':
-                    self.camera = SphericalCamera(self.dataHandler, view.CenterOfRotation, view.CameraPosition, view.CameraViewUp, self.cameraDescription['phi'], self.cameraDescription['theta'])
+                    self.camera = SphericalCamera(self.dataHandler, view.CenterOfRotation, view.CameraPosition, view.CameraViewUp, self.cameraDescription['phi'], self.cameraDescription['theta'], self.cameraDescription.get('order', 'row'))
                 elif self.cameraDescription['type'] == 'cylindrical':
-                    self.camera = CylindricalCamera(self.dataHandler, view.CenterOfRotation, view.CameraPosition, view.CameraViewUp, self.cameraDescription['phi'], self.cameraDescription['translation'])
+                    self.camera = CylindricalCamera(self.dataHandler, view.CenterOfRotation, view.CameraPosition, view.CameraViewUp, self.cameraDescription['phi'], self.cameraDescription['translation'], self.cameraDescription.get('order', 'row'))
+                elif self.cameraDescription['type'] == 'fibonacci':
+                    self.camera = FibonacciCamera(self.dataHandler, view.CenterOfRotation, view.CameraPosition, view.CameraViewUp, self.cameraDescription['spacing'])
+                elif self.cameraDescription['type'] == 'path':
+                    self.camera = PathCamera(self.dataHandler, self.cameraDescription['keyFrames'], self.cameraDescription['frames'])
+
+                if self.camera:
+                    self.cameraTable = CameraTable(self.camera, self.dataHandler)
 
             # Update background color
             bgColor = view.Background
@@ -82,6 +131,13 @@ class DataSetBuilder(object):
         self.dataHandler.updateBasePattern()
 
     def stop(self):
+        if self.cameraTable:
+            # Views without recorded projection use the final one
+            width, height = self.view.ViewSize
+            camera = self.view.GetActiveCamera()
+            self.cameraTable.setProjection(camera.GetViewAngle(), float(width) / height, camera.GetClippingRange())
+            self.cameraTable.write()
+
         self.dataHandler.writeDataDescriptor()
 
 # -----------------------------------------------------------------------------
@@ -93,16 +149,59 @@ class ImageDataSetBuilder(DataSetBuilder):
         DataSetBuilder.__init__(self, location, cameraInfo, metadata)
         imageExtenstion = '.' + imageMimeType.split('/')[1]
         self.dataHandler.registerData(name='image', type='blob', mimeType=imageMimeType, fileName=imageExtenstion)
+        self.imageWriter = create_image_writer(imageMimeType)
+        self.imageMimeType = imageMimeType
+        self.asyncWriter = None
+
+    def setAsyncCapture(self, nbWorkers=2, nbBuffers=None):
+        """
+        Encode and write images on worker threads while the next camera
+        renders, with at most nbBuffers frames in flight.
+        """
+        if self.asyncWriter:
+            self.asyncWriter.close()
+        self.asyncWriter = AsyncImageWriter(createImageEncoder(self.imageMimeType), nbWorkers, nbBuffers) if nbWorkers else None
+
+    def _writeImage(self, context, content):
+        self.dataHandler.writeData('image', content, context)
+        context.markDataWritten('image')
+
+    def estimate(self, nbSamples=5, seed=None):
+        """
+        Dry-run: render a random sample of camera positions in memory and
+        extrapolate file count, bytes and wall time to the full sweep.
+        """
+        def renderSample(workItem):
+            update_camera(self.view, self.camera.getCameraData(workItem), False)
+            self.dataHandler.writeData('image', capture_image(self.view, self.imageWriter))
+
+        return self.dataHandler.planSweep(renderSample, nbSamples, self.camera.getArgumentNames(), seed=seed)
 
     def writeImages(self):
+        self.createDirectories('image')
         for cam in self.camera:
-            update_camera(self.view, cam)
-            simple.WriteImage(self.dataHandler.getDataAbsoluteFilePath('image'))
+            if self.dataHandler.isDataWritten('image'):
+                continue
+
+            # Rendered once, by the capture
+            update_camera(self.view, cam, False)
+            if self.asyncWriter:
+                context = self.dataHandler.getContext()
+                capture_image_async(self.view, self.asyncWriter, lambda content, context=context: self._writeImage(context, content), self.dataHandler.profile)
+            else:
+                self.dataHandler.writeData('image', capture_image(self.view, self.imageWriter, self.dataHandler.profile))
+                self.dataHandler.markDataWritten('image')
+            record_camera(self.cameraTable, self.view)
+
+        if self.asyncWriter:
+            self.asyncWriter.flush()
 
 # -----------------------------------------------------------------------------
 # Data Prober Dataset Builder
 # -----------------------------------------------------------------------------
 class DataProberDataSetBuilder(DataSetBuilder):
+    compressedExtensions = ('.array',)
+
     def __init__(self, input, location, sampling_dimesions, fields_to_keep, custom_probing_bounds = None, metadata={}):
         DataSetBuilder.__init__(self, location, None, metadata)
         self.fieldsToWrite = fields_to_keep
@@ -138,8 +237,7 @@ class DataProberDataSetBuilder(DataSetBuilder):
                         if not maskArray.GetValue(idx):
                             array.SetValue(idx, float('NaN'))
 
-                    with open(self.dataHandler.getDataAbsoluteFilePath(field), 'wb') as f:
-                        f.write(buffer(array))
+                    self.dataHandler.writeData(field, buffer(array))
 
                     self.expandRange(array)
                 else:
@@ -156,8 +254,7 @@ class DataProberDataSetBuilder(DataSetBuilder):
                             mag = self.magnitude(entry)
                             magarray.SetValue(idx,mag)
 
-                    with open(self.dataHandler.getDataAbsoluteFilePath(field), 'wb') as f:
-                        f.write(buffer(magarray))
+                    self.dataHandler.writeData(field, buffer(magarray))
 
                     self.expandRange(magarray)
             else:
@@ -185,7 +282,9 @@ class DataProberDataSetBuilder(DataSetBuilder):
         else:
             self.DataProber['ranges'][field] = [array.GetRange()[0], array.GetRange()[1]]
 
-    def stop(self, compress=True):
+    def stop(self, compress=None):
+        self._setStopCompression(compress)
+
         # Rescale spacing to have the smaller value to be 1.0
         smallerValue = min(self.DataProber['spacing'])
         if smallerValue < 1.0:
@@ -197,24 +296,17 @@ class DataProberDataSetBuilder(DataSetBuilder):
         # Write metadata
         DataSetBuilder.stop(self)
 
-        if compress:
-            for root, dirs, files in os.walk(self.dataHandler.getBasePath()):
-                print 'Compress', root
-                for name in files:
-                    if '.array' in name and '.gz' not in name:
-                        with open(os.path.join(root, name), 'rb') as f_in, gzip.open(os.path.join(root, name + '.gz'), 'wb') as f_out:
-                            shutil.copyfileobj(f_in, f_out)
-                        os.remove(os.path.join(root, name))
-
 
 # -----------------------------------------------------------------------------
 # Float Image with Layer Dataset Builder
 # -----------------------------------------------------------------------------
 
 class LayerDataSetBuilder(DataSetBuilder):
+    compressedExtensions = ('.array',)
+
     def __init__(self, input, location, cameraInfo, imageSize=[500,500], metadata={}):
         DataSetBuilder.__init__(self, location, cameraInfo, metadata)
-        self.dataRenderer = data_writer.ScalarRenderer(isWriter=self.dataHandler.can_write)
+        self.dataRenderer = data_writer.ScalarRenderer(isWriter=self.dataHandler.can_write, writeFile=self.dataHandler.writeFile, profile=self.dataHandler.profile)
         self.view = self.dataRenderer.getView()
         self.view.ViewSize = imageSize
         self.floatImage = {'dimensions': imageSize, 'layers': [], 'ranges': {}}
@@ -265,7 +357,8 @@ class LayerDataSetBuilder(DataSetBuilder):
 
     def writeLayerData(self, time=0):
         dataRange = [0, 1]
-        self.activeSource.UpdatePipeline(time)
+        with self.dataHandler.profile('pipeline'):
+            self.activeSource.UpdatePipeline(time)
 
         if self.activeField and self.activeLayer:
 
@@ -307,7 +400,8 @@ class LayerDataSetBuilder(DataSetBuilder):
     def start(self):
         DataSetBuilder.start(self, self.view)
 
-    def stop(self, compress=True):
+    def stop(self, compress=None):
+        self._setStopCompression(compress)
         if not self.dataHandler.can_write:
             return
 
@@ -317,21 +411,14 @@ class LayerDataSetBuilder(DataSetBuilder):
         # Write metadata
         DataSetBuilder.stop(self)
 
-        if compress:
-            for root, dirs, files in os.walk(self.dataHandler.getBasePath()):
-                print 'Compress', root
-                for name in files:
-                    if '.array' in name and '.gz' not in name:
-                        with open(os.path.join(root, name), 'rb') as f_in, gzip.open(os.path.join(root, name + '.gz'), 'wb') as f_out:
-                            shutil.copyfileobj(f_in, f_out)
-                        os.remove(os.path.join(root, name))
-
 
 # -----------------------------------------------------------------------------
 # Composite Dataset Builder
 # -----------------------------------------------------------------------------
 
 class CompositeDataSetBuilder(DataSetBuilder):
+    compressedExtensions = ('.float32', '.uint8')
+
     def __init__(self, location, sceneConfig, cameraInfo, metadata={}, sections={}):
         DataSetBuilder.__init__(self, location, cameraInfo, metadata, sections)
 
@@ -361,7 +448,8 @@ class CompositeDataSetBuilder(DataSetBuilder):
     def start(self):
         DataSetBuilder.start(self, self.view)
 
-    def stop(self, compress=True, clean=True):
+    def stop(self, compress=None, clean=True):
+        self._setStopCompression(compress)
         DataSetBuilder.stop(self)
 
         if not self.dataHandler.can_write:
@@ -378,8 +466,9 @@ class CompositeDataSetBuilder(DataSetBuilder):
         with open(os.path.join(self.dataHandler.getBasePath(), "config.json"), 'w') as f:
             f.write(json.dumps(self.config))
 
-        dataConverter = data_converter.ConvertCompositeSpriteToSortedStack(self.dataHandler.getBasePath())
-        dataConverter.convert()
+        dataConverter = data_converter.ConvertCompositeSpriteToSortedStack(self.dataHandler.getBasePath(), self.dataHandler.writeFile)
+        with self.dataHandler.profile('convert'):
+            dataConverter.convert()
 
         # Remove tmp files
         os.remove(os.path.join(self.dataHandler.getBasePath(), "offset.json"))
@@ -474,22 +563,17 @@ class CompositeDataSetBuilder(DataSetBuilder):
         self.dataHandler.writeDataDescriptor()
 
         if clean:
-            for root, dirs, files in os.walk(self.dataHandler.getBasePath()):
-                print 'Clean', root
-                for name in files:
-                    if name in ['camera.json', 'composite.json', 'query.json', 'rgb.png']:
-                        os.remove(os.path.join(root, name))
-
-        if compress:
-            for root, dirs, files in os.walk(self.dataHandler.getBasePath()):
-                print 'Compress', root
-                for name in files:
-                    if ('.float32' in name or '.uint8' in name) and '.gz' not in name:
-                        with open(os.path.join(root, name), 'rb') as f_in, gzip.open(os.path.join(root, name + '.gz'), 'wb') as f_out:
-                            shutil.copyfileobj(f_in, f_out)
-                        os.remove(os.path.join(root, name))
+            with self.dataHandler.profile('clean'):
+                for root, dirs, files in os.walk(self.dataHandler.getBasePath()):
+                    print 'Clean', root
+                    for name in files:
+                        if name in ['camera.json', 'composite.json', 'query.json', 'rgb.png']:
+                            os.remove(os.path.join(root, name))
 
-    def writeData(self):
+        # Timings include the conversion and cleanup
+        self.dataHandler.writeProfile()
+
+    def _prepareCapture(self):
         # Fix camera bounds
         simple.Render(self.view)
         self.view.ResetClippingBounds()
@@ -514,105 +598,156 @@ class CompositeDataSetBuilder(DataSetBuilder):
         nbImages += len(self.config['scene']) * nbLightImagePerLayer
         nbImages += 1 # Background
 
-        # Generate the heavy data
-        composite_size = len(self.representations)
-        for camPos in self.getCamera():
-            self.view.CameraFocalPoint = camPos['focalPoint']
-            self.view.CameraPosition = camPos['position']
-            self.view.CameraViewUp = camPos['viewUp']
+        return nbImages
+
+    def writeData(self):
+        nbImages = self._prepareCapture()
+        self.createDirectories('directory')
 
+        # Generate the heavy data, written by the view straight to disk
+        scratchStorage = self.dataHandler.getScratchStorage()
+        for camPos in self.getCamera():
             # Update destination directory
             dest_path = os.path.dirname(self.dataHandler.getDataAbsoluteFilePath('directory'))
+            outputFiles = [ os.path.join(dest_path, name) for name in ['camera.json', 'rgb.png', 'composite.json'] ]
+
+            # Skip views completed by a previous run (offsetMap must be filled once)
+            if self.offsetMap and all(self.dataHandler.isFileWritten(path, scratchStorage) for path in outputFiles):
+                continue
+
+            self._writeView(camPos, dest_path, nbImages)
+            for path in outputFiles:
+                self.dataHandler.markFileWritten(path, scratchStorage)
+
+    def estimate(self, nbSamples=5, seed=None):
+        """
+        Dry-run: render a random sample of camera positions into a
+        temporary directory and extrapolate file count, bytes and wall
+        time of the sprite outputs, converted by stop(), to the full sweep.
+        """
+        nbImages = self._prepareCapture()
+        samplePath = tempfile.mkdtemp(prefix='tonic-estimate-')
+
+        def renderSample(workItem):
+            self._writeView(self.camera.getCameraData(workItem), samplePath, nbImages)
+            dest_path = os.path.dirname(self.dataHandler.getDataAbsoluteFilePath('directory', False))
+            for name in os.listdir(samplePath):
+                with open(os.path.join(samplePath, name), 'rb') as f:
+                    self.dataHandler.writeFile(os.path.join(dest_path, name), f.read())
+                os.remove(os.path.join(samplePath, name))
+
+        try:
+            return self.dataHandler.planSweep(renderSample, nbSamples, self.camera.getArgumentNames(), seed=seed)
+        finally:
+            shutil.rmtree(samplePath)
+
+    def _writeView(self, camPos, dest_path, nbImages):
+        self.view.CameraFocalPoint = camPos['focalPoint']
+        self.view.CameraPosition = camPos['position']
+        self.view.CameraViewUp = camPos['viewUp']
+
+        profile = self.dataHandler.profile
+        composite_size = len(self.representations)
 
-            # Write camera informations
-            if self.dataHandler.can_write:
-                with open(os.path.join(dest_path, "camera.json"), 'w') as f:
-                    f.write(json.dumps(camPos))
-
-            # Extract images for each fields
-            self.view.ResetActiveImageStack()
-            self.view.RGBStackSize = nbImages
-            offset_value = 1
-            for compositeIdx in range(composite_size):
-                rep = self.representations[compositeIdx]
-                index = 0
-
-                # Prevent color interference
-                rep.DiffuseColor = [1,1,1]
-
-                # Handle light
-                for lightType in self.config['light']:
-                    if lightType == 'intensity':
-                        index += 1
-                        rep.AmbientColor  = [1,1,1]
-                        rep.SpecularColor = [1,1,1]
+        # Intermediate camera of the view for the normal re-orientation
+        # of the sorted stack conversion, removed with the other sprite
+        # files by stop(clean=True). The CameraTable section is the
+        # camera kept in the dataset.
+        if self.dataHandler.can_write:
+            with open(os.path.join(dest_path, "camera.json"), 'w') as f:
+                f.write(json.dumps(camPos))
+
+        # Extract images for each fields
+        self.view.ResetActiveImageStack()
+        self.view.RGBStackSize = nbImages
+        offset_value = 1
+        for compositeIdx in range(composite_size):
+            rep = self.representations[compositeIdx]
+            index = 0
+
+            # Prevent color interference
+            rep.DiffuseColor = [1,1,1]
+
+            # Handle light
+            for lightType in self.config['light']:
+                if lightType == 'intensity':
+                    index += 1
+                    rep.AmbientColor  = [1,1,1]
+                    rep.SpecularColor = [1,1,1]
 
-                        self.view.CompositeDirectory = dest_path
-                        self.view.ActiveRepresentation = rep
+                    self.view.CompositeDirectory = dest_path
+                    self.view.ActiveRepresentation = rep
+                    with profile('render'):
                         self.view.CaptureActiveRepresentation()
 
-                        self.offsetMap['%d|%s' % (compositeIdx, 'intensity')] = offset_value
-                        offset_value += 1
+                    self.offsetMap['%d|%s' % (compositeIdx, 'intensity')] = offset_value
+                    offset_value += 1
 
-                    if lightType == 'normal':
-                        for comp in range(3):
-                            index += 1
+                if lightType == 'normal':
+                    for comp in range(3):
+                        index += 1
 
-                            self.view.CompositeDirectory = dest_path
-                            self.view.ActiveRepresentation = rep
+                        self.view.CompositeDirectory = dest_path
+                        self.view.ActiveRepresentation = rep
 
-                            # Configure view to handle POINT_DATA / CELL_DATA
-                            self.view.SetDrawCells = 0
-                            self.view.SetArrayNameToDraw = 'Normals'
-                            self.view.SetArrayComponentToDraw = comp
-                            self.view.SetScalarRange = [-1.0, 1.0]
+                        # Configure view to handle POINT_DATA / CELL_DATA
+                        self.view.SetDrawCells = 0
+                        self.view.SetArrayNameToDraw = 'Normals'
+                        self.view.SetArrayComponentToDraw = comp
+                        self.view.SetScalarRange = [-1.0, 1.0]
+                        with profile('render'):
                             self.view.StartCaptureValues()
                             self.view.CaptureActiveRepresentation()
                             self.view.StopCaptureValues()
 
-                            self.offsetMap['%d|%s|%d' % (compositeIdx, 'normal', comp)] = offset_value
-                            offset_value += 1
+                        self.offsetMap['%d|%s|%d' % (compositeIdx, 'normal', comp)] = offset_value
+                        offset_value += 1
 
 
-                # Handle color by
-                for fieldName, fieldConfig in self.config['scene'][compositeIdx]['colors'].iteritems():
-                    index += 1
-                    if 'constant' in fieldConfig:
-                        # Skip nothing to render
-                        index -= 1
-                        continue
+            # Handle color by
+            for fieldName, fieldConfig in self.config['scene'][compositeIdx]['colors'].iteritems():
+                index += 1
+                if 'constant' in fieldConfig:
+                    # Skip nothing to render
+                    index -= 1
+                    continue
 
-                    self.view.CompositeDirectory = dest_path
-                    self.view.ActiveRepresentation = rep
+                self.view.CompositeDirectory = dest_path
+                self.view.ActiveRepresentation = rep
 
-                    # Configure view to handle POINT_DATA / CELL_DATA
-                    if fieldConfig['location'] == 'POINT_DATA':
-                        self.view.SetDrawCells = 0
-                        self.view.SetArrayNameToDraw = fieldName
-                    else:
-                        self.view.SetDrawCells = 1
-                        self.view.SetArrayNameToDraw = fieldName
+                # Configure view to handle POINT_DATA / CELL_DATA
+                if fieldConfig['location'] == 'POINT_DATA':
+                    self.view.SetDrawCells = 0
+                    self.view.SetArrayNameToDraw = fieldName
+                else:
+                    self.view.SetDrawCells = 1
+                    self.view.SetArrayNameToDraw = fieldName
 
-                    self.view.SetArrayComponentToDraw = 0
-                    self.view.SetScalarRange = fieldConfig['range']
+                self.view.SetArrayComponentToDraw = 0
+                self.view.SetScalarRange = fieldConfig['range']
+                with profile('render'):
                     self.view.StartCaptureValues()
                     self.view.CaptureActiveRepresentation()
                     self.view.StopCaptureValues()
 
-                    self.offsetMap['%d|%s' % (compositeIdx, fieldName)] = offset_value
-                    offset_value += 1
+                self.offsetMap['%d|%s' % (compositeIdx, fieldName)] = offset_value
+                offset_value += 1
 
-            # Extract RGB + Z-buffer
+        # Extract RGB + Z-buffer
+        with profile('composite'):
             self.view.WriteImage()
             self.view.ComputeZOrdering()
             self.view.WriteComposite()
 
 
+
 # -----------------------------------------------------------------------------
 # GeometryDataSetBuilder Dataset Builder
 # -----------------------------------------------------------------------------
 
 class GeometryDataSetBuilder(DataSetBuilder):
+    compressedExtensions = ('Array',)
+
     def __init__(self, location, sceneConfig, metadata={}, sections={}):
         DataSetBuilder.__init__(self, location, None, metadata, sections)
 
@@ -727,110 +862,54 @@ class GeometryDataSetBuilder(DataSetBuilder):
 
 
             # Extract surface
-            self.surfaceExtract.UpdatePipeline(time)
+            with self.dataHandler.profile('pipeline'):
+                self.surfaceExtract.UpdatePipeline(time)
             ds = self.surfaceExtract.SMProxy.GetClientSideObject().GetOutputDataObject(0)
             originalDS = data['source'].SMProxy.GetClientSideObject().GetOutputDataObject(0)
 
-            originalPoints = ds.GetPoints()
-
             # Points
-            points = vtkFloatArray()
-            nbPoints = originalPoints.GetNumberOfPoints()
-            points.SetNumberOfComponents(3)
-            points.SetNumberOfTuples(nbPoints)
-            for idx in range(nbPoints):
-                coord = originalPoints.GetPoint(idx)
-                points.SetTuple3(idx, coord[0], coord[1], coord[2])
+            with self.dataHandler.profile('convert'):
+                points = data_converter.extractPoints(ds.GetPoints())
 
             pBuffer = buffer(points)
             pMd5 = hashlib.md5(pBuffer).hexdigest()
             pPath = os.path.join(self.dataHandler.getBasePath(), 'points',"%s.Float32Array" % pMd5)
             currentData['points'] = 'points/%s.Float32Array' % pMd5
-            with open(pPath, 'wb') as f:
-                f.write(pBuffer)
+            self.dataHandler.writeFile(pPath, pBuffer)
 
             # Polys
-            poly = ds.GetPolys()
-            nbCells = poly.GetNumberOfCells()
-            cellLocation = 0
-            idList = vtkIdList()
-            topo = vtkTypeUInt32Array()
-            topo.Allocate(poly.GetData().GetNumberOfTuples())
-
-            for cellIdx in range(nbCells):
-                poly.GetCell(cellLocation, idList)
-                cellSize = idList.GetNumberOfIds()
-                cellLocation += cellSize + 1
-                if cellSize == 3:
-                    topo.InsertNextValue(idList.GetId(0))
-                    topo.InsertNextValue(idList.GetId(1))
-                    topo.InsertNextValue(idList.GetId(2))
-                elif cellSize == 4:
-                    topo.InsertNextValue(idList.GetId(0))
-                    topo.InsertNextValue(idList.GetId(1))
-                    topo.InsertNextValue(idList.GetId(3))
-                    topo.InsertNextValue(idList.GetId(1))
-                    topo.InsertNextValue(idList.GetId(2))
-                    topo.InsertNextValue(idList.GetId(3))
-                else:
-                    print "Cell size of", cellSize, "not supported"
+            with self.dataHandler.profile('convert'):
+                topo = data_converter.extractTriangles(ds.GetPolys())
 
             iBuffer = buffer(topo)
             iMd5 = hashlib.md5(iBuffer).hexdigest()
             iPath = os.path.join(self.dataHandler.getBasePath(), 'index',"%s.Uint32Array" % iMd5)
             currentData['index'] = 'index/%s.Uint32Array' % iMd5
-            with open(iPath, 'wb') as f:
-                f.write(iBuffer)
+            self.dataHandler.writeFile(iPath, iBuffer)
 
             # Grow object side
-            self.objSize[data['name']]['points'] = max(self.objSize[data['name']]['points'], nbPoints)
+            self.objSize[data['name']]['points'] = max(self.objSize[data['name']]['points'], points.GetNumberOfTuples())
             self.objSize[data['name']]['index'] = max(self.objSize[data['name']]['index'], topo.GetNumberOfTuples())
 
             # Colors / FIXME
             for fieldName, fieldInfo in data['colors'].iteritems():
-                array = ds.GetPointData().GetArray(fieldName)
-                tupleSize = array.GetNumberOfComponents()
-                arraySize = array.GetNumberOfTuples()
-                outputField = vtkFloatArray()
-                outputField.SetNumberOfTuples(arraySize)
-                if tupleSize == 1:
-                    for i in range(arraySize):
-                        outputField.SetValue(i, array.GetValue(i))
-                else:
-                    # compute magnitude
-                    tupleIdxs = range(tupleSize)
-                    for i in range(arraySize):
-                        magnitude = 0
-                        for j in tupleIdxs:
-                            magnitude += math.pow(array.GetValue(i * tupleSize + j), 2)
-
-                        outputField.SetValue(i, math.sqrt(magnitude))
+                with self.dataHandler.profile('convert'):
+                    outputField = data_converter.extractMagnitude(ds.GetPointData().GetArray(fieldName))
 
                 fBuffer = buffer(outputField)
                 fMd5 = hashlib.md5(fBuffer).hexdigest()
                 fPath = os.path.join(self.dataHandler.getBasePath(), 'fields',"%s_%s.Float32Array" % (fieldName, fMd5))
-                with open(fPath, 'wb') as f:
-                    f.write(fBuffer)
+                self.dataHandler.writeFile(fPath, fBuffer)
 
                 currentData['fields'][fieldName] = 'fields/%s_%s.Float32Array' % (fieldName, fMd5)
 
         # Write scene
-        with open(self.dataHandler.getDataAbsoluteFilePath('scene'), 'w') as f:
-            f.write(json.dumps(currentScene, indent=4))
+        self.dataHandler.writeData('scene', json.dumps(currentScene, indent=4))
 
 
-    def stop(self, compress=True, clean=True):
+    def stop(self, compress=None, clean=True):
+        self._setStopCompression(compress)
         if not self.dataHandler.can_write:
             return
 
         DataSetBuilder.stop(self)
-
-        if compress:
-            for dirName in ['fields', 'index', 'points']:
-                for root, dirs, files in os.walk(os.path.join(self.dataHandler.getBasePath(), dirName)):
-                    print 'Compress', root
-                    for name in files:
-                        if 'Array' in name and '.gz' not in name:
-                            with open(os.path.join(root, name), 'rb') as f_in, gzip.open(os.path.join(root, name + '.gz'), 'wb') as f_out:
-                                shutil.copyfileobj(f_in, f_out)
-                            os.remove(os.path.join(root, name))
@@ -0,0 +1,98 @@
+"""
+Per-stage timing of the dataset builders
+"""
+
+import time, threading
+
+# -----------------------------------------------------------------------------
+# Disabled profiler
+# -----------------------------------------------------------------------------
+
+class NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+class NullProfiler(object):
+    """
+    Default profiler: every stage is the same no-op context manager.
+    """
+    enabled = False
+    nullStage = NullStage()
+
+    def stage(self, name):
+        return self.nullStage
+
+    def record(self, name, duration):
+        pass
+
+    def getSummary(self):
+        return {}
+
+nullProfiler = NullProfiler()
+
+# -----------------------------------------------------------------------------
+# Stage profiler
+# -----------------------------------------------------------------------------
+
+class Stage(object):
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, time.time() - self.start)
+        return False
+
+class StageProfiler(object):
+    """
+    Collect the duration of each named stage:
+
+        with profiler.stage('render'):
+            renderWindow.Render()
+
+    Stages can be timed from several threads.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def record(self, name, duration):
+        with self.lock:
+            self.timings.setdefault(name, []).append(duration)
+
+    def getSummary(self):
+        """
+        Return count, total, mean, p50, p95 and max (in seconds) per stage.
+        """
+        summary = {}
+        with self.lock:
+            timings = dict((name, sorted(values)) for name, values in self.timings.iteritems())
+
+        for name, values in timings.iteritems():
+            count = len(values)
+            total = sum(values)
+            summary[name] = {
+                'count': count,
+                'total': total,
+                'mean': total / count,
+                'p50': values[int(0.50 * (count - 1))],
+                'p95': values[int(0.95 * (count - 1))],
+                'max': values[-1]
+            }
+
+        return summary
@@ -0,0 +1,198 @@
+"""
+Random-access reader for generated Tonic datasets
+"""
+
+import os, zlib, bz2, zipfile, threading
+
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from tonic import PathTemplate, loadDataDescriptor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Global helper variables
+extensionTypes = {
+    '.uint8': 'uint8',
+    '.float32': 'float32',
+    '.Float32Array': 'float32',
+    '.Uint32Array': 'uint32'
+}
+decompressors = {
+    '': lambda content: content,
+    '.gz': lambda content: zlib.decompress(content, 16 + zlib.MAX_WBITS),
+    '.bz2': bz2.decompress
+}
+jsTypes = {
+    'Int8Array': 'int8',
+    'Uint8Array': 'uint8',
+    'Int16Array': 'int16',
+    'Uint16Array': 'uint16',
+    'Int32Array': 'int32',
+    'Uint32Array': 'uint32',
+    'Float32Array': 'float32',
+    'Float64Array': 'float64'
+}
+
+# -----------------------------------------------------------------------------
+# Data Reader
+# -----------------------------------------------------------------------------
+
+class DataReader(object):
+    """
+    Open a dataset through its index.json and fetch any data entry by
+    argument values. Raw arrays are memory-mapped, compressed ones are
+    decompressed and kept in a bounded LRU cache. Without numpy, the
+    content is returned as a byte string.
+    """
+    def __init__(self, basePath, cacheSize=128):
+        self.basePath = basePath
+        self.descriptor = loadDataDescriptor(basePath)
+        self.arguments = self.descriptor['arguments']
+        self.data = dict((item['name'], item) for item in self.descriptor['data'])
+        self.templates = dict((name, PathTemplate(item['pattern'])) for name, item in self.data.iteritems())
+        self.packs = self.descriptor.get('PackedStorage')
+        self.references = self.descriptor.get('DeduplicatedStorage', {}).get('references', {})
+        self.archive = None
+        self.archiveEntries = set()
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+        if 'ArchiveStorage' in self.descriptor:
+            self.archive = zipfile.ZipFile(os.path.join(basePath, self.descriptor['ArchiveStorage']['file']), 'r')
+            self.archiveEntries = set(self.archive.namelist())
+
+    def getDataNames(self):
+        return self.data.keys()
+
+    def getArgumentValues(self, name):
+        return self.arguments[name]['values']
+
+    def getRelativePath(self, name, **arguments):
+        """
+        Resolve the data pattern for the given argument values. Missing
+        arguments use their default index (or the first value). Duplicated
+        entries resolve to the path of their stored content.
+        """
+        template = self.templates[name]
+        values = {}
+        for field in (template.fields if template.fields is not None else self.arguments):
+            if field in arguments:
+                values[field] = '{value}'.format(value=arguments[field])
+            else:
+                argument = self.arguments[field]
+                values[field] = argument['values'][argument.get('default', 0)]
+        relativePath = template.format(values)
+        return self.references.get(relativePath, relativePath)
+
+    def getDataType(self, name, relativePath):
+        if self.data[name].get('type') != 'array':
+            return None
+
+        extension = os.path.splitext(relativePath)[1]
+        if extension in extensionTypes:
+            return extensionTypes[extension]
+
+        # Data prober arrays describe their type in their section
+        jsType = self.descriptor.get('DataProber', {}).get('types', {}).get(name)
+        return jsTypes.get(jsType, 'float32')
+
+    def _readStored(self, storedPath):
+        if self.packs and storedPath in self.packs['entries']:
+            packIdx, offset, size = self.packs['entries'][storedPath]
+            with open(os.path.join(self.basePath, self.packs['packs'][packIdx]), 'rb') as f:
+                f.seek(offset)
+                return f.read(size)
+
+        if self.archive:
+            with self.lock:
+                if storedPath in self.archiveEntries:
+                    return self.archive.read(storedPath)
+            return None
+
+        fullPath = os.path.join(self.basePath, storedPath)
+        if os.path.exists(fullPath):
+            with open(fullPath, 'rb') as f:
+                return f.read()
+
+        return None
+
+    def _loadContent(self, relativePath):
+        # Entries can be stored raw or with a compression extension
+        for suffix in ('', '.gz', '.bz2'):
+            content = self._readStored(relativePath + suffix)
+            if content is not None:
+                return decompressors[suffix](content)
+
+        raise IOError('No stored content for %s' % relativePath)
+
+    def _memoryMap(self, relativePath, dataType):
+        if self.packs and relativePath in self.packs['entries']:
+            packIdx, offset, size = self.packs['entries'][relativePath]
+            itemSize = numpy.dtype(dataType).itemsize
+            return numpy.memmap(os.path.join(self.basePath, self.packs['packs'][packIdx]), dataType, 'r', offset, (size / itemSize,))
+
+        fullPath = os.path.join(self.basePath, relativePath)
+        if not self.archive and os.path.exists(fullPath):
+            return numpy.memmap(fullPath, dataType, 'r')
+
+        return None
+
+    def getData(self, name, **arguments):
+        relativePath = self.getRelativePath(name, **arguments)
+
+        with self.lock:
+            if relativePath in self.cache:
+                content = self.cache.pop(relativePath)
+                self.cache[relativePath] = content
+                return content
+
+        dataType = self.getDataType(name, relativePath)
+        content = None
+        if dataType and numpy:
+            content = self._memoryMap(relativePath, dataType)
+
+        if content is None:
+            content = self._loadContent(relativePath)
+            if dataType and numpy:
+                content = numpy.frombuffer(content, dataType)
+
+        with self.lock:
+            self.cache[relativePath] = content
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+
+        return content
+
+    def getCameraTable(self):
+        """
+        Camera table exported by the builders, as a (count, stride) float32
+        array or, without numpy, its raw bytes. None when missing.
+        """
+        section = self.descriptor.get('CameraTable')
+        if not section:
+            return None
+
+        content = self._loadContent(section['file'])
+        if numpy:
+            return numpy.frombuffer(content, 'float32').reshape(section['count'], section['stride'])
+        return content
+
+    def getBatch(self, name, argumentsList, nbThreads=4):
+        """
+        Fetch the data entry for each argument dict of the list, reading
+        and decompressing on a thread pool.
+        """
+        if nbThreads < 2 or len(argumentsList) < 2:
+            return [ self.getData(name, **arguments) for arguments in argumentsList ]
+
+        pool = ThreadPool(nbThreads)
+        try:
+            return pool.map(lambda arguments: self.getData(name, **arguments), argumentsList)
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,654 @@
+"""
+Storage backends used by the DataHandler to write data entries
+"""
+
+import os, json, time, shutil, threading, zipfile, zlib, bz2, hashlib
+
+from multiprocessing.pool import ThreadPool
+
+from collections import OrderedDict
+
+from tonic.profiler import nullProfiler
+
+def toBuffer(content):
+    """
+    Byte view of a str, unicode, bytearray, array or VTK array content.
+    """
+    if isinstance(content, unicode):
+        return content.encode('utf-8')
+    if isinstance(content, str):
+        return content
+    return buffer(content)
+
+def getChecksum(content):
+    """
+    Deferred md5 of a stored content, handed to the storage listeners.
+    """
+    return lambda: hashlib.md5(content).hexdigest()
+
+class StorageStream(object):
+    """
+    File object for an entry written piece by piece. The content goes to
+    a temporary file moved to path on close, then listener(path, size,
+    checksum) is called like for any stored entry.
+    """
+    def __init__(self, path, listener):
+        self.path = path
+        self.listener = listener
+        self.size = 0
+        self.writeTime = 0.0
+        self.md5 = hashlib.md5()
+        self.file = open(path + '.tmp', 'wb')
+
+    def write(self, content):
+        content = toBuffer(content)
+        startTime = time.time()
+        self.file.write(content)
+        self.writeTime += time.time() - startTime
+        self.md5.update(content)
+        self.size += len(content)
+
+    def close(self):
+        self.file.close()
+        os.rename(self.path + '.tmp', self.path)
+        if self.listener:
+            self.listener(self.path, self.size, self.md5.hexdigest)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path + '.tmp')
+
+# -----------------------------------------------------------------------------
+# File System Storage (default)
+# -----------------------------------------------------------------------------
+
+class FileSystemStorage(object):
+    """
+    One file per data entry, laid out following the data patterns.
+    The optional listener(path, size, checksum) is called for every
+    stored entry, checksum() returning the md5 of the stored content.
+    """
+    def __init__(self):
+        self.basePath = None
+        self.listener = None
+
+    def setBasePath(self, basePath):
+        self.basePath = basePath
+
+    def needDirectories(self):
+        return True
+
+    def setResumable(self, resumable):
+        pass
+
+    def write(self, path, content):
+        content = toBuffer(content)
+        with open(path, 'wb') as f:
+            f.write(content)
+        if self.listener:
+            self.listener(path, len(content), getChecksum(content))
+        return len(content)
+
+    def openStream(self, path):
+        return StorageStream(path, self.listener)
+
+    def getStoredPath(self, path):
+        return path
+
+    def getStoredSize(self, path):
+        if os.path.exists(path):
+            return os.path.getsize(path)
+        return None
+
+    def read(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def isPending(self, path):
+        return False
+
+    def getDescriptorSections(self):
+        return {}
+
+    def flush(self):
+        pass
+
+# -----------------------------------------------------------------------------
+# Pack Storage
+# -----------------------------------------------------------------------------
+
+class PackStorage(object):
+    """
+    Append the data entries of an argument slice into a single pack file.
+    The slice is given by the first sliceDepth directories of the entry
+    path (sliceDepth=1 creates one pack per value of the outer-most
+    argument, 0 a single pack). The byte offsets are recorded in the
+    'PackedStorage' section of index.json:
+
+        { 'packs': [ 'packs/0.pack', ... ],
+          'entries': { '0/30_60/order.uint8': [ packIdx, offset, size ] } }
+
+    Packs are truncated the first time they are opened in a session. A
+    resumable storage instead journals its entries in entries.txt next to
+    the packs and appends to the packs of the previous run.
+
+    Writers running concurrently on the same dataset (e.g. one per work
+    item partition) must each get their own writerId, which suffixes their
+    pack and journal names (packs/0.<writerId>.pack) so they never write
+    into the same file.
+    """
+    def __init__(self, sliceDepth=1, directory='packs', maxOpenFiles=32, writerId=None):
+        self.basePath = None
+        self.sliceDepth = sliceDepth
+        self.directory = directory
+        self.suffix = '' if writerId is None else '.%s' % writerId
+        self.maxOpenFiles = maxOpenFiles
+        self.packs = []
+        self.packIndex = {}
+        self.entries = {}
+        self.openFiles = OrderedDict()
+        self.resumable = False
+        self.journal = None
+        self.loaded = False
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def setBasePath(self, basePath):
+        self.basePath = basePath
+
+    def needDirectories(self):
+        return False
+
+    def setResumable(self, resumable):
+        self.resumable = resumable
+
+    def _addPack(self, packName):
+        self.packIndex[packName] = len(self.packs)
+        self.packs.append(packName)
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+
+        journalPath = os.path.join(self.basePath, self.directory, 'entries%s.txt' % self.suffix)
+        if not self.resumable:
+            if os.path.exists(journalPath):
+                os.remove(journalPath)
+            return
+
+        # Keep the entries whose bytes made it into their pack
+        packSizes = {}
+        packEnds = {}
+        if os.path.exists(journalPath):
+            with open(journalPath, 'r') as journal:
+                for line in journal:
+                    try:
+                        relativePath, packName, offset, size = json.loads(line)
+                    except ValueError:
+                        # Truncated line from an interrupted run
+                        continue
+                    if packName not in packSizes:
+                        packPath = os.path.join(self.basePath, packName)
+                        packSizes[packName] = os.path.getsize(packPath) if os.path.exists(packPath) else 0
+                    if offset + size > packSizes[packName]:
+                        continue
+                    if packName not in self.packIndex:
+                        self._addPack(packName)
+                    self.entries[relativePath] = [ self.packIndex[packName], offset, size ]
+                    packEnds[packName] = max(packEnds.get(packName, 0), offset + size)
+
+        # Drop the bytes written after the last journaled entry
+        for packName, end in packEnds.iteritems():
+            if packSizes[packName] > end:
+                with open(os.path.join(self.basePath, packName), 'r+b') as packFile:
+                    packFile.truncate(end)
+
+        if not os.path.exists(os.path.dirname(journalPath)):
+            os.makedirs(os.path.dirname(journalPath))
+        self.journal = open(journalPath, 'a+')
+        self.journal.seek(0, os.SEEK_END)
+        if self.journal.tell():
+            # Start after any truncated line
+            self.journal.seek(-1, os.SEEK_END)
+            if self.journal.read(1) != '\n':
+                self.journal.write('\n')
+
+    def _getPackFile(self, relativePath):
+        sliceKey = '_'.join(relativePath.split('/')[:-1][:self.sliceDepth]) or 'data'
+        packName = '%s/%s%s.pack' % (self.directory, sliceKey, self.suffix)
+
+        # Packs not known from a previous run start empty
+        newPack = packName not in self.packIndex
+        if newPack:
+            self._addPack(packName)
+
+        if packName in self.openFiles:
+            packFile = self.openFiles.pop(packName)
+        else:
+            packPath = os.path.join(self.basePath, packName)
+            if not os.path.exists(os.path.dirname(packPath)):
+                os.makedirs(os.path.dirname(packPath))
+            packFile = open(packPath, 'wb' if newPack else 'ab')
+            packFile.seek(0, os.SEEK_END)
+            if len(self.openFiles) >= self.maxOpenFiles:
+                self.openFiles.popitem(last=False)[1].close()
+
+        self.openFiles[packName] = packFile
+        return (self.packIndex[packName], packFile)
+
+    def write(self, path, content):
+        relativePath = os.path.relpath(path, self.basePath).replace(os.sep, '/')
+        content = toBuffer(content)
+        with self.lock:
+            self._load()
+            packIdx, packFile = self._getPackFile(relativePath)
+            offset = packFile.tell()
+            packFile.write(content)
+            self.entries[relativePath] = [ packIdx, offset, len(content) ]
+            if self.journal:
+                self.journal.write(json.dumps([ relativePath, self.packs[packIdx], offset, len(content) ]) + '\n')
+        if self.listener:
+            self.listener(path, len(content), getChecksum(content))
+        return len(content)
+
+    def getStoredPath(self, path):
+        return path
+
+    def getStoredSize(self, path):
+        with self.lock:
+            self._load()
+            entry = self.entries.get(os.path.relpath(path, self.basePath).replace(os.sep, '/'))
+        return entry[2] if entry else None
+
+    def read(self, path):
+        with self.lock:
+            self._load()
+            entry = self.entries.get(os.path.relpath(path, self.basePath).replace(os.sep, '/'))
+            if not entry:
+                return None
+            packIdx, offset, size = entry
+            packName = self.packs[packIdx]
+            if packName in self.openFiles:
+                self.openFiles[packName].flush()
+
+        with open(os.path.join(self.basePath, packName), 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def isPending(self, path):
+        return False
+
+    def getDescriptorSections(self):
+        return { 'PackedStorage': { 'packs': self.packs, 'entries': self.entries } }
+
+    def flush(self):
+        with self.lock:
+            for packFile in self.openFiles.values():
+                packFile.flush()
+            if self.journal:
+                self.journal.flush()
+
+# -----------------------------------------------------------------------------
+# Memory Storage
+# -----------------------------------------------------------------------------
+
+class MemoryStorage(object):
+    """
+    Keep every data entry in memory, keyed by its path relative to the
+    dataset root. Useful for benchmarks and tests.
+    """
+    def __init__(self):
+        self.basePath = None
+        self.entries = {}
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def setBasePath(self, basePath):
+        self.basePath = basePath
+
+    def needDirectories(self):
+        return False
+
+    def setResumable(self, resumable):
+        pass
+
+    def write(self, path, content):
+        relativePath = os.path.relpath(path, self.basePath).replace(os.sep, '/')
+        content = toBuffer(content)[:]
+        with self.lock:
+            self.entries[relativePath] = content
+        if self.listener:
+            self.listener(path, len(content), getChecksum(content))
+        return len(content)
+
+    def getEntry(self, relativePath):
+        return self.entries[relativePath]
+
+    def getStoredPath(self, path):
+        return path
+
+    def getStoredSize(self, path):
+        content = self.read(path)
+        return len(content) if content is not None else None
+
+    def read(self, path):
+        return self.entries.get(os.path.relpath(path, self.basePath).replace(os.sep, '/'))
+
+    def isPending(self, path):
+        return False
+
+    def getDescriptorSections(self):
+        return {}
+
+    def flush(self):
+        pass
+
+# -----------------------------------------------------------------------------
+# Archive Storage
+# -----------------------------------------------------------------------------
+
+class ArchiveStorage(object):
+    """
+    Write every data entry into a single zip archive next to index.json.
+    Entries are named by their path relative to the dataset root. The
+    archive is truncated the first time it is opened in a session, unless
+    the storage is resumable.
+    """
+    def __init__(self, fileName='data.zip', compression=zipfile.ZIP_STORED):
+        self.basePath = None
+        self.fileName = fileName
+        self.compression = compression
+        self.archive = None
+        self.sizes = {}
+        self.opened = False
+        self.resumable = False
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def setBasePath(self, basePath):
+        self.basePath = basePath
+
+    def needDirectories(self):
+        return False
+
+    def setResumable(self, resumable):
+        self.resumable = resumable
+
+    def _openArchive(self):
+        if not self.archive:
+            if not os.path.exists(self.basePath):
+                os.makedirs(self.basePath)
+            mode = 'a' if self.opened or self.resumable else 'w'
+            self.archive = zipfile.ZipFile(os.path.join(self.basePath, self.fileName), mode, self.compression, True)
+            if not self.opened:
+                # Entries of a previous run
+                self.sizes.update((info.filename, info.file_size) for info in self.archive.infolist())
+                self.opened = True
+        return self.archive
+
+    def write(self, path, content):
+        relativePath = os.path.relpath(path, self.basePath).replace(os.sep, '/')
+        content = toBuffer(content)[:]
+        with self.lock:
+            self._openArchive().writestr(relativePath, content)
+            self.sizes[relativePath] = len(content)
+        if self.listener:
+            self.listener(path, len(content), getChecksum(content))
+        return len(content)
+
+    def getStoredPath(self, path):
+        return path
+
+    def getStoredSize(self, path):
+        with self.lock:
+            if self.resumable and not self.opened:
+                self._openArchive()
+            return self.sizes.get(os.path.relpath(path, self.basePath).replace(os.sep, '/'))
+
+    def read(self, path):
+        relativePath = os.path.relpath(path, self.basePath).replace(os.sep, '/')
+        with self.lock:
+            if relativePath not in self.sizes:
+                return None
+            return self._openArchive().read(relativePath)
+
+    def isPending(self, path):
+        return False
+
+    def getDescriptorSections(self):
+        return { 'ArchiveStorage': { 'file': self.fileName } }
+
+    def flush(self):
+        # Closing writes the central directory, the archive is reopened on next write
+        with self.lock:
+            if self.archive:
+                self.archive.close()
+                self.archive = None
+
+# -----------------------------------------------------------------------------
+# Inline compression
+# -----------------------------------------------------------------------------
+
+def gzipCompress(content, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(content) + compressor.flush()
+
+def bz2Compress(content, level):
+    return bz2.compress(content, level)
+
+codecs = {
+    'gzip': ('.gz', gzipCompress),
+    'bz2': ('.bz2', bz2Compress)
+}
+
+class CompressedStorage(object):
+    """
+    Compress the entries matching the given extensions on a worker pool
+    while the caller keeps rendering, then hand them to the wrapped
+    storage with the codec extension appended (e.g. order.uint8.gz).
+    At most maxPending entries wait for compression at any time.
+    """
+    def __init__(self, storage, codec='gzip', level=9, nbWorkers=2, extensions=('.uint8', '.array', '.float32', 'Array'), maxPending=None):
+        self.storage = storage
+        self.codec = codec
+        self.level = level
+        self.nbWorkers = nbWorkers
+        self.extensions = tuple(extensions)
+        self.suffix, self.compress = codecs[codec]
+        self.pool = None
+        self.slots = threading.BoundedSemaphore(maxPending if maxPending else 4 * nbWorkers)
+        self.results = []
+        self.pendingPaths = set()
+        self.profiler = nullProfiler
+        self.lock = threading.Lock()
+
+    def wrap(self, storage):
+        wrapped = CompressedStorage(storage, self.codec, self.level, self.nbWorkers, self.extensions)
+        wrapped.profiler = self.profiler
+        return wrapped
+
+    def setBasePath(self, basePath):
+        self.storage.setBasePath(basePath)
+
+    def needDirectories(self):
+        return self.storage.needDirectories()
+
+    def setResumable(self, resumable):
+        self.storage.setResumable(resumable)
+
+    def needCompression(self, path):
+        return path.endswith(self.extensions)
+
+    def openStream(self, path):
+        if self.needCompression(path):
+            raise ValueError('%s is compressed as a whole and can not be streamed' % path)
+        return self.storage.openStream(path)
+
+    def getStoredPath(self, path):
+        if self.needCompression(path):
+            return path + self.suffix
+        return path
+
+    def getStoredSize(self, path):
+        return self.storage.getStoredSize(self.getStoredPath(path))
+
+    def read(self, path):
+        return self.storage.read(self.getStoredPath(path))
+
+    def isPending(self, path):
+        with self.lock:
+            return path in self.pendingPaths
+
+    def _compressAndWrite(self, path, content):
+        try:
+            with self.profiler.stage('compress'):
+                self.storage.write(path + self.suffix, self.compress(content, self.level))
+        finally:
+            with self.lock:
+                self.pendingPaths.discard(path)
+            self.slots.release()
+
+    def _collect(self, wait):
+        remaining = []
+        for result in self.results:
+            if wait or result.ready():
+                # Re-raise any error from the workers
+                result.get()
+            else:
+                remaining.append(result)
+        self.results = remaining
+
+    def write(self, path, content):
+        if not self.needCompression(path):
+            return self.storage.write(path, content)
+
+        # Copy as the caller is free to reuse its buffer
+        content = toBuffer(content)[:]
+        if not self.pool:
+            self.pool = ThreadPool(self.nbWorkers)
+
+        self.slots.acquire()
+        with self.lock:
+            self.pendingPaths.add(path)
+        self.results.append(self.pool.apply_async(self._compressAndWrite, (path, content)))
+        self._collect(False)
+        return len(content)
+
+    def getDescriptorSections(self):
+        return self.storage.getDescriptorSections()
+
+    def flush(self):
+        self._collect(True)
+        self.storage.flush()
+
+# -----------------------------------------------------------------------------
+# Content-addressed deduplication
+# -----------------------------------------------------------------------------
+
+class DeduplicatedStorage(object):
+    """
+    Write each distinct content once. Later entries with the same content
+    are recorded as references to the first one in the
+    'DeduplicatedStorage' section of index.json:
+
+        { 'references': { '3/30_60/rgb.png': '0/30_60/rgb.png' },
+          'hardLinks': false }
+
+    With hardLinks, each reference also gets a hard link to the stored
+    file so readers unaware of the section keep working. Paths given to
+    materialize() always get one (or a copy), for files fetched by name
+    like the outputs of DataHandler.writeFile(). Entries are expected to
+    be written once: overwriting the first occurrence of a content
+    changes it for every reference.
+    """
+    def __init__(self, storage, hardLinks=False):
+        self.storage = storage
+        self.hardLinks = hardLinks
+        self.basePath = None
+        self.contents = {}
+        self.references = {}
+        self.materializedPaths = set()
+        self.pendingLinks = []
+        self.savedBytes = 0
+        self.lock = threading.Lock()
+
+    def wrap(self, storage):
+        return DeduplicatedStorage(storage, self.hardLinks)
+
+    def setBasePath(self, basePath):
+        self.basePath = basePath
+        self.storage.setBasePath(basePath)
+
+    def needDirectories(self):
+        return self.storage.needDirectories()
+
+    def setResumable(self, resumable):
+        self.storage.setResumable(resumable)
+
+    def getStoredPath(self, path):
+        return self.storage.getStoredPath(self.references.get(path, path))
+
+    def getStoredSize(self, path):
+        return self.storage.getStoredSize(self.references.get(path, path))
+
+    def read(self, path):
+        return self.storage.read(self.references.get(path, path))
+
+    def openStream(self, path):
+        # Streamed entries are never deduplicated
+        return self.storage.openStream(path)
+
+    def isPending(self, path):
+        return self.storage.isPending(self.references.get(path, path))
+
+    def materialize(self, path):
+        with self.lock:
+            self.materializedPaths.add(path)
+
+    def write(self, path, content):
+        content = toBuffer(content)
+        key = (len(content), hashlib.md5(content).digest())
+        with self.lock:
+            original = self.contents.setdefault(key, path)
+            if original == path:
+                self.references.pop(path, None)
+            else:
+                self.references[path] = original
+                self.savedBytes += len(content)
+                if (self.hardLinks or path in self.materializedPaths) and self.storage.needDirectories():
+                    self.pendingLinks.append(path)
+
+        if original == path:
+            return self.storage.write(path, content)
+        return len(content)
+
+    def _createLinks(self):
+        with self.lock:
+            links = self.pendingLinks
+            self.pendingLinks = []
+
+        for path in links:
+            target = self.storage.getStoredPath(path)
+            if os.path.exists(target):
+                os.remove(target)
+            try:
+                os.link(self.getStoredPath(path), target)
+            except OSError:
+                # File systems without hard links get a copy
+                shutil.copyfile(self.getStoredPath(path), target)
+
+    def getDescriptorSections(self):
+        sections = self.storage.getDescriptorSections()
+        with self.lock:
+            references = dict((os.path.relpath(path, self.basePath).replace(os.sep, '/'), os.path.relpath(original, self.basePath).replace(os.sep, '/')) for path, original in self.references.iteritems())
+        if references:
+            sections['DeduplicatedStorage'] = { 'references': references, 'hardLinks': self.hardLinks }
+        return sections
+
+    def flush(self):
+        # Links need the stored file of the first occurrence
+        self.storage.flush()
+        self._createLinks()
@@ -1,5 +1,10 @@
+import os
+
+from math  import atan, tan, degrees, radians
 from vtk   import *
 from tonic import camera as tc
+from tonic.profiler import nullProfiler
+from tonic.image import AsyncImageWriter, PNGStreamWriter, createImageEncoder, assembleRows
 
 def update_camera(renderer, cameraData):
     camera = renderer.GetActiveCamera()
@@ -7,13 +12,21 @@ def update_camera(renderer, cameraData):
     camera.SetFocalPoint(cameraData['focalPoint'])
     camera.SetViewUp(cameraData['viewUp'])
 
-def create_spherical_camera(renderer, dataHandler, phiValues, thetaValues):
+def record_camera(cameraTable, renderer):
+    camera = renderer.GetActiveCamera()
+    cameraTable.record(camera.GetViewAngle(), renderer.GetTiledAspectRatio(), camera.GetClippingRange())
+
+def create_spherical_camera(renderer, dataHandler, phiValues, thetaValues, order='row'):
     camera = renderer.GetActiveCamera()
-    return tc.SphericalCamera(dataHandler, camera.GetFocalPoint(), camera.GetPosition(), camera.GetViewUp(), phiValues, thetaValues)
+    return tc.SphericalCamera(dataHandler, camera.GetFocalPoint(), camera.GetPosition(), camera.GetViewUp(), phiValues, thetaValues, order)
 
-def create_cylindrical_camera(renderer, dataHandler, phiValues, translationValues):
+def create_cylindrical_camera(renderer, dataHandler, phiValues, translationValues, order='row'):
     camera = renderer.GetActiveCamera()
-    return tc.CylindricalCamera(dataHandler, camera.GetFocalPoint(), camera.GetPosition(), camera.GetViewUp(), phiValues, translationValues)
+    return tc.CylindricalCamera(dataHandler, camera.GetFocalPoint(), camera.GetPosition(), camera.GetViewUp(), phiValues, translationValues, order)
+
+def create_fibonacci_camera(renderer, dataHandler, angularSpacing):
+    camera = renderer.GetActiveCamera()
+    return tc.FibonacciCamera(dataHandler, camera.GetFocalPoint(), camera.GetPosition(), camera.GetViewUp(), angularSpacing)
 
 class CaptureRenderWindow(object):
     def __init__(self, magnification=1):
@@ -22,11 +35,16 @@ class CaptureRenderWindow(object):
         self.windowToImage.SetInputBufferTypeToRGB()
         self.windowToImage.ReadFrontBufferOn()
         self.writer = None
+        self.mimeType = None
+        self.asyncWriter = None
+        self.tileRenderer = None
+        self.tileMagnification = 1
 
     def SetRenderWindow(self, renderWindow):
         self.windowToImage.SetInput(renderWindow)
 
     def SetFormat(self, mimeType):
+        self.mimeType = mimeType
         if mimeType == 'image/png':
             self.writer = vtkPNGWriter()
             self.writer.SetInputConnection(self.windowToImage.GetOutputPort())
@@ -34,6 +52,143 @@ class CaptureRenderWindow(object):
             self.writer = vtkJPEGWriter()
             self.writer.SetInputConnection(self.windowToImage.GetOutputPort())
 
+    def captureImage(self, profile=nullProfiler.stage):
+        """
+        Capture and encode the render window in memory.
+        Return the encoded content, valid until the next capture.
+        """
+        if not self.writer:
+            return None
+
+        with profile('readback'):
+            self.windowToImage.Modified()
+            self.windowToImage.Update()
+
+        with profile('encode'):
+            self.writer.WriteToMemoryOn()
+            self.writer.Write()
+            self.writer.WriteToMemoryOff()
+        return buffer(self.writer.GetResult())
+
+    def SetAsync(self, nbWorkers=2, nbBuffers=None):
+        """
+        Encode the captures of captureImageAsync() on nbWorkers threads,
+        with at most nbBuffers frames in flight. 0 workers disables it.
+        """
+        if self.asyncWriter:
+            self.asyncWriter.close()
+        self.asyncWriter = AsyncImageWriter(createImageEncoder(self.mimeType), nbWorkers, nbBuffers) if nbWorkers else None
+
+    def IsAsync(self):
+        return self.asyncWriter is not None
+
+    def captureImageAsync(self, callback, profile=nullProfiler.stage):
+        """
+        Read the render window back and call callback(content) with the
+        encoded image, from a worker thread when async is enabled. Blocks
+        while all the buffers are in flight.
+        """
+        if not self.asyncWriter:
+            callback(self.captureImage(profile))
+            return
+
+        with profile('readback'):
+            self.windowToImage.Modified()
+            self.windowToImage.Update()
+        image = self.windowToImage.GetOutput()
+        scalars = image.GetPointData().GetScalars()
+        width, height = image.GetDimensions()[:2]
+        self.asyncWriter.submit(buffer(scalars), width, height, scalars.GetNumberOfComponents(), callback, profile)
+
+    def Flush(self):
+        if self.asyncWriter:
+            self.asyncWriter.flush()
+
+    def SetTiling(self, renderer, magnification):
+        """
+        Capture images magnification times larger than the window, one
+        window-sized tile at a time, by zooming the renderer camera on
+        each tile.
+        """
+        self.tileRenderer = renderer
+        self.tileMagnification = magnification
+
+    def captureTiles(self, profile=nullProfiler.stage):
+        """
+        Render and yield (tileX, tileY, pixels, width, height, components)
+        for every tile, band after band from the top left one. The pixels
+        are only valid until the next tile.
+        """
+        magnification = self.tileMagnification
+        renderWindow = self.windowToImage.GetInput()
+        camera = self.tileRenderer.GetActiveCamera()
+        viewAngle = camera.GetViewAngle()
+        parallelScale = camera.GetParallelScale()
+        windowCenter = camera.GetWindowCenter()
+
+        # Each tile covers 1/magnification of the original frustum
+        camera.SetViewAngle(degrees(2.0 * atan(tan(radians(viewAngle) / 2.0) / magnification)))
+        camera.SetParallelScale(parallelScale / magnification)
+        try:
+            for tileY in range(magnification):
+                for tileX in range(magnification):
+                    camera.SetWindowCenter(2 * tileX + 1 - magnification, magnification - 1 - 2 * tileY)
+                    with profile('render'):
+                        renderWindow.Render()
+                    with profile('readback'):
+                        self.windowToImage.Modified()
+                        self.windowToImage.Update()
+                    image = self.windowToImage.GetOutput()
+                    scalars = image.GetPointData().GetScalars()
+                    width, height = image.GetDimensions()[:2]
+                    yield (tileX, tileY, buffer(scalars), width, height, scalars.GetNumberOfComponents())
+        finally:
+            camera.SetViewAngle(viewAngle)
+            camera.SetParallelScale(parallelScale)
+            camera.SetWindowCenter(windowCenter[0], windowCenter[1])
+
+    def writeStreamedImage(self, fileObject, profile=nullProfiler.stage):
+        """
+        Write the tiled capture into fileObject as a PNG encoded band by
+        band, so memory is bounded by one row of tiles.
+        """
+        magnification = self.tileMagnification
+        stream = None
+        tiles = []
+        for tileX, tileY, pixels, width, height, components in self.captureTiles(profile):
+            if not stream:
+                stream = PNGStreamWriter(fileObject, width * magnification, height * magnification, components)
+            tiles.append(bytearray(pixels))
+            if tileX == magnification - 1:
+                with profile('encode'):
+                    stream.writeRows(assembleRows(tiles, width * components, height))
+                tiles = []
+        stream.close()
+
+    def GetTilePath(self, path, tileX, tileY):
+        base, extension = os.path.splitext(path)
+        return '%s_tile_%d_%d%s' % (base, tileX, tileY, extension)
+
+    def writeImageTiles(self, path, writeFile, profile=nullProfiler.stage):
+        """
+        Encode each tile on its own through writeFile(path, content), next
+        to path with a '_tile_<x>_<y>' suffix, and return the tile index.
+        """
+        encode = createImageEncoder(self.mimeType)
+        tiles = []
+        for tileX, tileY, pixels, width, height, components in self.captureTiles(profile):
+            with profile('encode'):
+                content = encode(pixels, width, height, components)
+            writeFile(self.GetTilePath(path, tileX, tileY), content)
+            tiles.append({ 'suffix': '_tile_%d_%d' % (tileX, tileY), 'x': tileX, 'y': tileY, 'offset': [ tileX * width, tileY * height ] })
+
+        return {
+            'magnification': self.tileMagnification,
+            'tileSize': [ width, height ],
+            'imageSize': [ width * self.tileMagnification, height * self.tileMagnification ],
+            'tiles': tiles
+        }
+
     def writeImage(self, path):
         if self.writer:
             self.windowToImage.Modified()
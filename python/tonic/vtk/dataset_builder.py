@@ -1,10 +1,11 @@
 from tonic        import *
 from tonic.vtk    import *
 from tonic.camera import *
+from tonic.storage import FileSystemStorage
 
 from vtk import *
 
-import json, os, math, gzip, shutil
+import json, os, math, warnings
 
 # Global helper variables
 encode_codes = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
@@ -27,11 +28,16 @@ jsMapping = {
 # -----------------------------------------------------------------------------
 
 class DataSetBuilder(object):
+    # Extensions of the entries compressed by default (none)
+    compressedExtensions = ()
+
     def __init__(self, location, camera_data, metadata={}, sections={}):
         self.dataHandler = DataHandler(location)
         self.cameraDescription = camera_data
         self.camera = None
+        self.cameraTable = None
         self.imageCapture = CaptureRenderWindow()
+        self.plannedDirectories = set()
 
         for key, value in metadata.iteritems():
             self.dataHandler.addMetaData(key, value)
@@ -39,9 +45,45 @@ class DataSetBuilder(object):
         for key, value in sections.iteritems():
             self.dataHandler.addSection(key, value)
 
+        # Raw arrays are gzipped by a worker pool as they are written
+        if self.compressedExtensions:
+            self.dataHandler.setCompression('gzip', extensions=self.compressedExtensions)
+
     def getDataHandler(self):
         return self.dataHandler
 
+    def createDirectories(self, *names):
+        """
+        Create once, up-front, the directories of the whole sweep for the
+        given data names. Later writes find them in the handler cache.
+        """
+        if names in self.plannedDirectories:
+            return
+        self.plannedDirectories.add(names)
+        try:
+            self.dataHandler.createDirectories(names)
+        except ValueError:
+            # Patterns the plan can not expand get their directories on write
+            pass
+
+    def setCompression(self, codec='gzip', level=9):
+        """
+        Codec applied to raw arrays as they are written, gzip by default.
+        A None codec keeps them uncompressed. Call before writing data.
+        Builders listing compressedExtensions gzip those entries unless
+        told otherwise, like their former stop(compress=True) default.
+        """
+        if self.compressedExtensions:
+            self.dataHandler.setCompression(codec, level, extensions=self.compressedExtensions)
+        else:
+            self.dataHandler.setCompression(codec, level)
+
+    def _setStopCompression(self, compress):
+        # Deprecated stop(compress=...), only applies to what stop() writes
+        if compress is not None:
+            warnings.warn('stop(compress=...) is deprecated, call setCompression() before writing data', DeprecationWarning, stacklevel=3)
+            self.setCompression('gzip' if compress else None)
+
     def getCamera(self):
         return self.camera
 
@@ -61,9 +103,16 @@ class DataSetBuilder(object):
             # Handle camera if any
             if self.cameraDescription:
                 if self.cameraDescription['type'] == 'spherical':
-                    self.camera = create_spherical_camera(renderer, self.dataHandler, self.cameraDescription['phi'], self.cameraDescription['theta'])
+                    self.camera = create_spherical_camera(renderer, self.dataHandler, self.cameraDescription['phi'], self.cameraDescription['theta'], self.cameraDescription.get('order', 'row'))
                 elif self.cameraDescription['type'] == 'cylindrical':
-                    self.camera = create_cylindrical_camera(renderer, self.dataHandler, self.cameraDescription['phi'], self.cameraDescription['translation'])
+                    self.camera = create_cylindrical_camera(renderer, self.dataHandler, self.cameraDescription['phi'], self.cameraDescription['translation'], self.cameraDescription.get('order', 'row'))
+                elif self.cameraDescription['type'] == 'fibonacci':
+                    self.camera = create_fibonacci_camera(renderer, self.dataHandler, self.cameraDescription['spacing'])
+                elif self.cameraDescription['type'] == 'path':
+                    self.camera = PathCamera(self.dataHandler, self.cameraDescription['keyFrames'], self.cameraDescription['frames'])
+
+                if self.camera:
+                    self.cameraTable = CameraTable(self.camera, self.dataHandler)
 
             # Update background color
             bgColor = renderer.GetBackground()
@@ -74,6 +123,12 @@ class DataSetBuilder(object):
         self.dataHandler.updateBasePattern()
 
     def stop(self):
+        if self.cameraTable:
+            # Views without recorded projection use the final one
+            camera = self.renderer.GetActiveCamera()
+            self.cameraTable.setProjection(camera.GetViewAngle(), self.renderer.GetTiledAspectRatio(), camera.GetClippingRange())
+            self.cameraTable.write()
+
         self.dataHandler.writeDataDescriptor()
 
 # -----------------------------------------------------------------------------
@@ -86,20 +141,96 @@ class ImageDataSetBuilder(DataSetBuilder):
         imageExtenstion = '.' + imageMimeType.split('/')[1]
         self.dataHandler.registerData(name='image', type='blob', mimeType=imageMimeType, fileName=imageExtenstion)
         self.imageCapture.SetFormat(imageMimeType)
+        self.tiling = None
 
     def writeImage(self):
-        self.imageCapture.writeImage(self.dataHandler.getDataAbsoluteFilePath('image'))
+        self.dataHandler.writeData('image', self.imageCapture.captureImage())
+
+    def estimate(self, nbSamples=5, seed=None):
+        """
+        Dry-run: render a random sample of camera positions in memory and
+        extrapolate file count, bytes and wall time to the full sweep.
+        """
+        def renderSample(workItem):
+            self.updateCamera(self.camera.getCameraData(workItem))
+            self.dataHandler.writeData('image', self.imageCapture.captureImage())
+
+        return self.dataHandler.planSweep(renderSample, nbSamples, self.camera.getArgumentNames(), seed=seed)
+
+    def setAsyncCapture(self, nbWorkers=2, nbBuffers=None):
+        """
+        Encode and write images on worker threads while the next camera
+        renders, with at most nbBuffers frames in flight.
+        """
+        self.imageCapture.SetAsync(nbWorkers, nbBuffers)
+
+    def setTiledCapture(self, magnification, streamed=True):
+        """
+        Render images magnification times larger than the window, one tile
+        at a time. Streamed images are PNG files encoded band by band
+        through a storage stream (one file per entry storages only).
+        Otherwise each tile is written next to the image entry and indexed
+        in the 'TiledImage' section.
+        """
+        self.tiling = (magnification, streamed)
+
+    def _isTiledImageWritten(self):
+        magnification, streamed = self.tiling
+        path = self.dataHandler.getDataAbsoluteFilePath('image', False)
+        if not streamed:
+            path = self.imageCapture.GetTilePath(path, magnification - 1, magnification - 1)
+        return self.dataHandler.isFileWritten(path)
+
+    def _writeTile(self, path, content):
+        self.dataHandler.writeFile(path, content)
+        self.dataHandler.markFileWritten(path)
+
+    def writeTiledImage(self):
+        magnification, streamed = self.tiling
+        self.imageCapture.SetTiling(self.renderer, magnification)
+        if not self.dataHandler.can_write:
+            return
+
+        if streamed:
+            self.dataHandler.writeDataStream('image', lambda stream: self.imageCapture.writeStreamedImage(stream, self.dataHandler.profile))
+            self.dataHandler.markDataWritten('image')
+        else:
+            path = self.dataHandler.getDataAbsoluteFilePath('image')
+            self.dataHandler.addSection('TiledImage', self.imageCapture.writeImageTiles(path, self._writeTile, self.dataHandler.profile))
+
+    def _writeImage(self, context, content):
+        self.dataHandler.writeData('image', content, context)
+        context.markDataWritten('image')
 
     def writeImages(self):
+        self.createDirectories('image')
         for cam in self.camera:
-            update_camera(self.renderer, cam)
-            self.renderWindow.Render()
-            self.imageCapture.writeImage(self.dataHandler.getDataAbsoluteFilePath('image'))
+            if self._isTiledImageWritten() if self.tiling else self.dataHandler.isDataWritten('image'):
+                continue
+
+            # Tiles render again, but the clipping range is set by this one
+            with self.dataHandler.profile('render'):
+                update_camera(self.renderer, cam)
+                self.renderWindow.Render()
+            record_camera(self.cameraTable, self.renderer)
+
+            if self.tiling:
+                self.writeTiledImage()
+            elif self.imageCapture.IsAsync():
+                context = self.dataHandler.getContext()
+                self.imageCapture.captureImageAsync(lambda content, context=context: self._writeImage(context, content), self.dataHandler.profile)
+            else:
+                self.dataHandler.writeData('image', self.imageCapture.captureImage(self.dataHandler.profile))
+                self.dataHandler.markDataWritten('image')
+
+        self.imageCapture.Flush()
 
 # -----------------------------------------------------------------------------
 # Volume Composite Dataset Builder
 # -----------------------------------------------------------------------------
 class VolumeCompositeDataSetBuilder(DataSetBuilder):
+    compressedExtensions = ('.uint8',)
+
     def __init__(self, location, imageMimeType, cameraInfo, metadata={}, sections={}):
         DataSetBuilder.__init__(self, location, cameraInfo, metadata, sections)
 
@@ -115,6 +246,7 @@ class VolumeCompositeDataSetBuilder(DataSetBuilder):
 
         self.imageDataColor = vtkImageData()
         self.imageWriter.SetInputData(self.imageDataColor)
+        self.imageWriter.WriteToMemoryOn()
 
         self.imageDataDepth = vtkImageData()
         self.depthToWrite = None
@@ -190,42 +322,77 @@ class VolumeCompositeDataSetBuilder(DataSetBuilder):
         if needToRegisterColor:
             self.dataHandler.registerData(name=self.activeRGBKey, type='blob', fileName='/%s%s_rgb%s' % (layerCode, colorCode, self.imageExtenstion), categories=[ '%s%s' % (layerCode, colorCode) ], mimeType=self.imageMimeType)
 
-    def writeData(self, mapper):
+    def _writeLayerData(self, name, content):
+        self.dataHandler.writeData(name, content)
+
+    def _isLayerDataWritten(self, *names):
+        return self.dataHandler.isDataWritten(*names)
+
+    def _markLayerDataWritten(self, *names):
+        self.dataHandler.markDataWritten(*names)
+
+    def _writeView(self, mapper, cam, writeLayerData):
         width = self.renderWindow.GetSize()[0]
         height = self.renderWindow.GetSize()[1]
 
         if not self.depthToWrite:
             self.depthToWrite = bytearray(width * height)
 
-        for cam in self.camera:
+        profile = self.dataHandler.profile
+        with profile('render'):
             self.updateCamera(cam)
-            imagePath = self.dataHandler.getDataAbsoluteFilePath(self.activeRGBKey)
-            depthPath = self.dataHandler.getDataAbsoluteFilePath(self.activeDepthKey)
+        record_camera(self.cameraTable, self.renderer)
 
-            # -----------------------------------------------------------------
-            # Write Image
-            # -----------------------------------------------------------------
+        # ---------------------------------------------------------------------
+        # Write Image
+        # ---------------------------------------------------------------------
+        with profile('readback'):
             mapper.GetColorImage(self.imageDataColor)
-            self.imageWriter.SetFileName(imagePath)
+        with profile('encode'):
             self.imageWriter.Write()
+        writeLayerData(self.activeRGBKey, buffer(self.imageWriter.GetResult()))
 
-            # -----------------------------------------------------------------
-            # Write Depth
-            # -----------------------------------------------------------------
+        # ---------------------------------------------------------------------
+        # Write Depth
+        # ---------------------------------------------------------------------
+        with profile('readback'):
             mapper.GetDepthImage(self.imageDataDepth)
+        with profile('convert'):
             inputArray = self.imageDataDepth.GetPointData().GetArray(0)
             size = inputArray.GetNumberOfTuples()
             for idx in range(size):
                 self.depthToWrite[idx] = int(inputArray.GetValue(idx))
 
-            with open(depthPath, 'wb') as f:
-                f.write(self.depthToWrite)
+        writeLayerData(self.activeDepthKey, self.depthToWrite)
+
+    def writeData(self, mapper):
+        self.createDirectories(self.activeRGBKey, self.activeDepthKey)
+        for cam in self.camera:
+            if self._isLayerDataWritten(self.activeRGBKey, self.activeDepthKey):
+                continue
+
+            self._writeView(mapper, cam, self._writeLayerData)
+            self._markLayerDataWritten(self.activeRGBKey, self.activeDepthKey)
+
+    def estimate(self, mapper, nbSamples=5, seed=None):
+        """
+        Dry-run of writeData(mapper) for the active layer: render a random
+        sample of camera positions in memory and extrapolate file count,
+        bytes and wall time to the full sweep. Sorted builders report the
+        layer stacks they convert in stop().
+        """
+        def renderSample(workItem):
+            self._writeView(mapper, self.camera.getCameraData(workItem), self.dataHandler.writeData)
+
+        return self.dataHandler.planSweep(renderSample, nbSamples, self.camera.getArgumentNames(), seed=seed)
 
     def start(self, renderWindow, renderer):
         DataSetBuilder.start(self, renderWindow, renderer)
         self.camera.updatePriority([2,1])
 
-    def stop(self, compress=True):
+    def stop(self, compress=None):
+        self._setStopCompression(compress)
+
         # Push metadata
         self.compositePipeline['dimensions'] = self.renderWindow.GetSize()
         self.compositePipeline['default_pipeline'] = 'A'.join(self.compositePipeline['layers']) + 'A'
@@ -234,19 +401,12 @@ class VolumeCompositeDataSetBuilder(DataSetBuilder):
         # Write metadata
         DataSetBuilder.stop(self)
 
-        if compress:
-            for root, dirs, files in os.walk(self.dataHandler.getBasePath()):
-                print 'Compress', root
-                for name in files:
-                    if '.uint8' in name and '.gz' not in name:
-                        with open(os.path.join(root, name), 'rb') as f_in, gzip.open(os.path.join(root, name + '.gz'), 'wb') as f_out:
-                            shutil.copyfileobj(f_in, f_out)
-                        os.remove(os.path.join(root, name))
-
 # -----------------------------------------------------------------------------
 # Data Prober Dataset Builder
 # -----------------------------------------------------------------------------
 class DataProberDataSetBuilder(DataSetBuilder):
+    compressedExtensions = ('.array',)
+
     def __init__(self, location, sampling_dimesions, fields_to_keep, custom_probing_bounds = None, metadata={}):
         DataSetBuilder.__init__(self, location, None, metadata)
         self.fieldsToWrite = fields_to_keep
@@ -276,9 +436,7 @@ class DataProberDataSetBuilder(DataSetBuilder):
         for field in self.fieldsToWrite:
             array = arrays.GetArray(field)
             if array:
-                b = buffer(array)
-                with open(self.dataHandler.getDataAbsoluteFilePath(field), 'wb') as f:
-                    f.write(b)
+                self.dataHandler.writeData(field, buffer(array))
 
                 self.DataProber['types'][field] = jsMapping[arrayTypesMapping[array.GetDataType()]]
                 if field in self.DataProber['ranges']:
@@ -293,30 +451,24 @@ class DataProberDataSetBuilder(DataSetBuilder):
                 print 'No array for', field
                 print self.resamplerFilter.GetOutput()
 
-    def stop(self, compress=True):
+    def stop(self, compress=None):
+        self._setStopCompression(compress)
+
         # Push metadata
         self.dataHandler.addSection('DataProber', self.DataProber)
 
         # Write metadata
         DataSetBuilder.stop(self)
 
-        if compress:
-            for root, dirs, files in os.walk(self.dataHandler.getBasePath()):
-                print 'Compress', root
-                for name in files:
-                    if '.array' in name and '.gz' not in name:
-                        with open(os.path.join(root, name), 'rb') as f_in, gzip.open(os.path.join(root, name + '.gz'), 'wb') as f_out:
-                            shutil.copyfileobj(f_in, f_out)
-                        os.remove(os.path.join(root, name))
-
 # -----------------------------------------------------------------------------
 # Sorted Composite Dataset Builder
 # -----------------------------------------------------------------------------
 class ConvertVolumeStackToSortedStack(object):
-    def __init__(self, width, height):
+    def __init__(self, width, height, writeFile=None):
         self.width = width
         self.height = height
         self.layers = 0
+        self.writeFile = writeFile if writeFile else FileSystemStorage().write
 
     def convert(self, directory):
         imagePaths = {}
@@ -392,14 +544,9 @@ class ConvertVolumeStackToSortedStack(object):
                 opacityOrder.SetValue((imageSize * destLayerIdx) + pixelIdx, opacity.GetValue((imageSize * sourceLayerIdx) + pixelIdx))
                 intensityOrder.SetValue((imageSize * destLayerIdx) + pixelIdx, intensity.GetValue((imageSize * sourceLayerIdx) + pixelIdx))
 
-        with open(os.path.join(directory, 'alpha.uint8'), 'wb') as f:
-            f.write(buffer(opacityOrder))
-
-        with open(os.path.join(directory, 'intensity.uint8'), 'wb') as f:
-            f.write(buffer(intensityOrder))
-
-        with open(os.path.join(directory, 'order.uint8'), 'wb') as f:
-            f.write(buffer(destOrder))
+        self.writeFile(os.path.join(directory, 'alpha.uint8'), buffer(opacityOrder))
+        self.writeFile(os.path.join(directory, 'intensity.uint8'), buffer(intensityOrder))
+        self.writeFile(os.path.join(directory, 'order.uint8'), buffer(destOrder))
 
 
 class SortedCompositeDataSetBuilder(VolumeCompositeDataSetBuilder):
@@ -407,6 +554,9 @@ class SortedCompositeDataSetBuilder(VolumeCompositeDataSetBuilder):
         VolumeCompositeDataSetBuilder.__init__(self, location, 'image/png', cameraInfo, metadata, sections)
         self.dataHandler.addTypes('sorted-composite', 'rgba')
 
+        # Layers are sorted from disk once the sweep is over
+        self.scratchStorage = self.dataHandler.getScratchStorage()
+
         # Register order and color textures
         self.layerScalars = []
         self.dataHandler.registerData(name='order',     type='array', fileName='/order.uint8')
@@ -416,12 +566,28 @@ class SortedCompositeDataSetBuilder(VolumeCompositeDataSetBuilder):
     def start(self, renderWindow, renderer):
         VolumeCompositeDataSetBuilder.start(self, renderWindow, renderer)
         imageSize = self.renderWindow.GetSize()
-        self.dataConverter = ConvertVolumeStackToSortedStack(imageSize[0], imageSize[1])
+        self.dataConverter = ConvertVolumeStackToSortedStack(imageSize[0], imageSize[1], self.dataHandler.writeFile)
 
     def activateLayer(self, colorBy, scalar):
         VolumeCompositeDataSetBuilder.activateLayer(self, 'root', '%s' % scalar, colorBy)
         self.layerScalars.append(scalar)
 
+    def _writeLayerData(self, name, content):
+        path = self.dataHandler.getDataAbsoluteFilePath(name)
+        if self.dataHandler.can_write:
+            with self.dataHandler.profile('write'):
+                self.scratchStorage.write(path, content)
+
+    def _isLayerDataWritten(self, *names):
+        for name in names:
+            if not self.dataHandler.isFileWritten(self.dataHandler.getDataAbsoluteFilePath(name, False), self.scratchStorage):
+                return False
+        return True
+
+    def _markLayerDataWritten(self, *names):
+        for name in names:
+            self.dataHandler.markFileWritten(self.dataHandler.getDataAbsoluteFilePath(name, False), self.scratchStorage)
+
     def writeData(self, mapper):
         VolumeCompositeDataSetBuilder.writeData(self, mapper)
 
@@ -430,53 +596,41 @@ class SortedCompositeDataSetBuilder(VolumeCompositeDataSetBuilder):
         self.dataHandler.getDataAbsoluteFilePath('alpha')
         self.dataHandler.getDataAbsoluteFilePath('intensity')
 
-    def stop(self, clean=True, compress=True):
-        VolumeCompositeDataSetBuilder.stop(self, compress=False)
+    def stop(self, clean=True, compress=None):
+        VolumeCompositeDataSetBuilder.stop(self, compress)
 
         # Go through all directories and convert them
-        for root, dirs, files in os.walk(self.dataHandler.getBasePath()):
-            for name in dirs:
-                print 'Process', os.path.join(root, name)
-                self.dataConverter.convert(os.path.join(root, name))
-
-        # Rename index.json to info_origin.json
-        os.rename(os.path.join(self.dataHandler.getBasePath(), "index.json"), os.path.join(self.dataHandler.getBasePath(), "index_origin.json"))
-
-        # Update index.json
-        with open(os.path.join(self.dataHandler.getBasePath(), "index_origin.json"), "r") as infoFile:
-            metadata = json.load(infoFile)
-            metadata['SortedComposite'] = {
-                'dimensions': metadata['CompositePipeline']['dimensions'],
+        with self.dataHandler.profile('convert'):
+            for root, dirs, files in os.walk(self.dataHandler.getBasePath()):
+                for name in dirs:
+                    print 'Process', os.path.join(root, name)
+                    self.dataConverter.convert(os.path.join(root, name))
+
+        # Rewrite the descriptor for the sorted data
+        with self.dataHandler.profile('descriptor'):
+            compositePipeline = self.dataHandler.removeSection('CompositePipeline')
+            self.dataHandler.addSection('SortedComposite', {
+                'dimensions': compositePipeline['dimensions'],
                 'layers': self.dataConverter.layers,
                 'scalars': self.layerScalars[0:self.dataConverter.layers]
-            }
+            })
 
-            # Clean metadata
-            dataToKeep = []
-            del metadata['CompositePipeline']
-            for item in metadata['data']:
-                if item['name'] in ['order', 'alpha', 'intensity']:
-                    dataToKeep.append(item)
-            metadata['data'] = dataToKeep
-            metadata['type'] = [ "tonic-query-data-model", "sorted-composite", "alpha" ]
+            # Only keep the sorted arrays
+            for name in self.dataHandler.data.keys():
+                if name not in ['order', 'alpha', 'intensity']:
+                    self.dataHandler.removeData(name)
+            self.dataHandler.types = [ "tonic-query-data-model", "sorted-composite", "alpha" ]
 
-            # Override index.json
-            with open(os.path.join(self.dataHandler.getBasePath(), "index.json"), 'w') as newMetaFile:
-                newMetaFile.write(json.dumps(metadata))
+            self.dataHandler.writeDataDescriptor()
 
         # Clean temporary data
         if clean:
-            for root, dirs, files in os.walk(self.dataHandler.getBasePath()):
-                print 'Clean', root
-                for name in files:
-                    if '_rgb.png' in name or '_depth.uint8' in name or name == "index_origin.json":
-                        os.remove(os.path.join(root, name))
-
-        if compress:
-            for root, dirs, files in os.walk(self.dataHandler.getBasePath()):
-                print 'Compress', root
-                for name in files:
-                    if '.uint8' in name and '.gz' not in name:
-                        with open(os.path.join(root, name), 'rb') as f_in, gzip.open(os.path.join(root, name + '.gz'), 'wb') as f_out:
-                            shutil.copyfileobj(f_in, f_out)
-                        os.remove(os.path.join(root, name))
+            with self.dataHandler.profile('clean'):
+                for root, dirs, files in os.walk(self.dataHandler.getBasePath()):
+                    print 'Clean', root
+                    for name in files:
+                        if '_rgb.png' in name or '_depth.uint8' in name:
+                            os.remove(os.path.join(root, name))
+
+        # Timings include the conversion and cleanup
+        self.dataHandler.writeProfile()
@@ -0,0 +1,325 @@
+#! /usr/bin/env python
+"""
+Headless benchmarks of the CPU heavy converters and encoders.
+
+Synthetic PNG sprites, depth stacks and meshes are generated for each
+resolution and layer count, then each stage runs without any rendering.
+The throughput is reported in items (pixels, points or cells) and MB of
+produced data per second.
+
+    python scripts/benchmarks/run.py --sizes 128,256 --layers 2,4
+    python scripts/benchmarks/run.py --save scripts/benchmarks/baseline.json
+    python scripts/benchmarks/run.py --tolerance 0.2
+
+The run fails when a stage is slower than its baseline by more than the
+tolerance. The baseline checked in next to this script is used unless
+another one is given (--baseline '' skips the comparison). Throughputs
+depend on the machine: save a baseline on the machine that compares.
+"""
+
+import io, os, sys, json, time, imp, shutil, tempfile, argparse
+
+from vtk import *
+
+import tonic
+from tonic.storage import MemoryStorage
+from tonic.image import encodePNG, assembleRows, PNGStreamWriter
+from tonic.vtk.dataset_builder import ConvertVolumeStackToSortedStack
+
+# The paraview package needs pvpython, the converters only need VTK
+tonicPath = os.path.dirname(tonic.__file__)
+data_converter = imp.load_source('data_converter', os.path.join(tonicPath, 'paraview', 'data_converter.py'))
+
+spec_b_converter = imp.load_source('spec_b_converter', os.path.join(tonicPath, 'cinema', 'spec-b-converter.py'))
+
+encoding = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+defaultBaseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# -----------------------------------------------------------------------------
+# Synthetic data
+# -----------------------------------------------------------------------------
+
+def createPixels(width, height, components, seed):
+    """
+    Gradient pattern on the middle rows, empty background elsewhere.
+    """
+    rowSize = width * components
+    row = bytearray((x * (seed + 3) + seed * 17) % 255 + 1 for x in xrange(rowSize))
+    empty = bytearray(rowSize)
+    pixels = bytearray()
+    for y in xrange(height):
+        if height / 5 <= y < height - height / 5:
+            shift = (y * components * (seed + 1)) % rowSize
+            pixels += row[shift:] + row[:shift]
+        else:
+            pixels += empty
+    return pixels
+
+def writePNG(path, width, height, components, pixels):
+    array = vtkUnsignedCharArray()
+    array.SetNumberOfComponents(components)
+    array.SetVoidArray(pixels, len(pixels), 1)
+
+    image = vtkImageData()
+    image.SetDimensions(width, height, 1)
+    image.GetPointData().SetScalars(array)
+
+    writer = vtkPNGWriter()
+    writer.SetInputData(image)
+    writer.SetFileName(path)
+    writer.Write()
+
+def writeJSON(path, content):
+    with open(path, 'w') as f:
+        f.write(json.dumps(content))
+
+def createCompositeJSON(path, width, height, layers):
+    pixels = []
+    for y in xrange(height):
+        if height / 5 <= y < height - height / 5:
+            for x in xrange(width):
+                shift = (x + y) % layers
+                pixels.append(''.join(encoding[(shift + i) % layers] for i in range(1 + (x % layers))))
+        else:
+            pixels.append('@%d' % width)
+    writeJSON(path, { 'dimensions': [width, height], 'pixel-order': '+'.join(pixels) })
+
+def createVolumeStack(directory, width, height, layers):
+    for layer in range(layers):
+        writePNG(os.path.join(directory, '%sA_rgb.png' % encoding[layer]), width, height, 4, createPixels(width, height, 4, layer))
+        with open(os.path.join(directory, '%s_depth.uint8' % encoding[layer]), 'wb') as f:
+            f.write(createPixels(width, height, 1, layers + layer))
+
+def createCompositeSprite(basePath, width, height, layers):
+    """
+    Sprite with, per layer, an intensity image, 3 normal images and a scalar image.
+    """
+    scene = []
+    offsets = {}
+    imageIdx = 1
+    for layer in range(layers):
+        scene.append({ 'name': 'layer%d' % layer, 'colors': { 'scalar': { 'location': 'POINT_DATA', 'range': [0.0, 1.0] } } })
+        offsets['%d|intensity' % layer] = imageIdx
+        offsets['%d|normal|0' % layer] = imageIdx + 1
+        offsets['%d|normal|1' % layer] = imageIdx + 2
+        offsets['%d|normal|2' % layer] = imageIdx + 3
+        offsets['%d|scalar' % layer] = imageIdx + 4
+        imageIdx += 5
+
+    writeJSON(os.path.join(basePath, 'config.json'), { 'scene': scene, 'light': ['intensity', 'normal'] })
+    writeJSON(os.path.join(basePath, 'index.json'), {})
+    writeJSON(os.path.join(basePath, 'offset.json'), offsets)
+
+    directory = os.path.join(basePath, 'sprite')
+    os.makedirs(directory)
+    sprite = bytearray()
+    for idx in range(imageIdx):
+        sprite += createPixels(width, height, 3, idx)
+    writePNG(os.path.join(directory, 'rgb.png'), width, height * imageIdx, 3, sprite)
+    createCompositeJSON(os.path.join(directory, 'composite.json'), width, height, layers)
+    writeJSON(os.path.join(directory, 'camera.json'), { 'position': [0, 0, 10], 'focalPoint': [0, 0, 0], 'viewUp': [0, 1, 0] })
+    return directory
+
+def createMesh(resolution):
+    sphere = vtkSphereSource()
+    sphere.SetThetaResolution(resolution)
+    sphere.SetPhiResolution(resolution)
+    sphere.Update()
+    return sphere.GetOutput()
+
+# -----------------------------------------------------------------------------
+# Benchmarks: return (seconds, items, bytes produced)
+# -----------------------------------------------------------------------------
+
+def createMemoryStorage(basePath):
+    storage = MemoryStorage()
+    storage.setBasePath(basePath)
+    return storage
+
+def getStoredBytes(storage):
+    return sum(len(content) for content in storage.entries.values())
+
+def benchVolumeStack(workDir, width, height, layers):
+    createVolumeStack(workDir, width, height, layers)
+    storage = createMemoryStorage(workDir)
+    converter = ConvertVolumeStackToSortedStack(width, height, storage.write)
+
+    start = time.time()
+    converter.convert(workDir)
+    return (time.time() - start, width * height * layers, getStoredBytes(storage))
+
+def benchCompositeSprite(workDir, width, height, layers):
+    directory = createCompositeSprite(workDir, width, height, layers)
+    storage = createMemoryStorage(workDir)
+    converter = data_converter.ConvertCompositeSpriteToSortedStack(workDir, storage.write)
+
+    start = time.time()
+    converter.processDirectory(directory)
+    return (time.time() - start, width * height * layers, getStoredBytes(storage))
+
+def benchImageToFloat(workDir, width, height, layers):
+    srcPath = os.path.join(workDir, 'scalar.png')
+    destPath = os.path.join(workDir, 'scalar.float32')
+    writePNG(srcPath, width, height, 3, createPixels(width, height, 3, 0))
+
+    start = time.time()
+    data_converter.convertImageToFloat(srcPath, destPath, [0.0, 1.0])
+    return (time.time() - start, width * height, os.path.getsize(destPath))
+
+def benchSortedOrder(workDir, width, height, layers):
+    compositePath = os.path.join(workDir, 'composite.json')
+    createCompositeJSON(compositePath, width, height, layers)
+    composite = data_converter.CompositeJSON(layers)
+
+    start = time.time()
+    composite.load(compositePath)
+    orderArray = composite.getSortedOrderArray()
+    return (time.time() - start, width * height * layers, orderArray.GetNumberOfTuples())
+
+def benchCreateOrderFile(workDir, width, height, layers):
+    from PIL import Image
+    for layer in range(layers):
+        depth = createPixels(width, height, 1, layer)
+        Image.frombytes('L', (width, height), str(depth)).convert('F').save(os.path.join(workDir, '%d.im' % layer))
+
+    intensity = vtkUnsignedCharArray()
+    intensity.SetNumberOfTuples(width * height * layers)
+    intensity.FillComponent(0, 128)
+
+    start = time.time()
+    spec_b_converter.createOrderFile(workDir, layers, intensity, width, height)
+    elapsed = time.time() - start
+    return (elapsed, width * height * layers, 2 * width * height * layers)
+
+def benchGeometry(workDir, resolution, unused, layers):
+    mesh = createMesh(resolution)
+
+    start = time.time()
+    points = data_converter.extractPoints(mesh.GetPoints())
+    topo = data_converter.extractTriangles(mesh.GetPolys())
+    field = data_converter.extractMagnitude(mesh.GetPointData().GetNormals())
+    elapsed = time.time() - start
+
+    items = mesh.GetNumberOfPoints() + mesh.GetNumberOfCells()
+    return (elapsed, items, len(buffer(points)) + len(buffer(topo)) + len(buffer(field)))
+
+def benchEncodePNG(workDir, width, height, layers):
+    pixels = createPixels(width, height, 3, 0)
+
+    start = time.time()
+    content = encodePNG(pixels, width, height, 3)
+    return (time.time() - start, width * height, len(content))
+
+def benchPNGStream(workDir, width, height, layers):
+    # 4x4 tiles, bottom-up like the tiled captures, one band at a time
+    tileWidth, tileHeight = width / 4, height / 4
+    bands = [ [ createPixels(tileWidth, tileHeight, 3, tileY * 4 + tileX) for tileX in range(4) ] for tileY in range(4) ]
+    output = io.BytesIO()
+
+    start = time.time()
+    stream = PNGStreamWriter(output, 4 * tileWidth, 4 * tileHeight, 3)
+    for tiles in reversed(bands):
+        stream.writeRows(assembleRows(tiles, tileWidth * 3, tileHeight))
+    stream.close()
+    return (time.time() - start, 16 * tileWidth * tileHeight, len(output.getvalue()))
+
+# name, function, use layers
+benchmarks = [
+    ('volume-stack-to-sorted', benchVolumeStack, True),
+    ('composite-sprite-to-sorted', benchCompositeSprite, True),
+    ('image-to-float', benchImageToFloat, False),
+    ('sorted-order-array', benchSortedOrder, True),
+    ('create-order-file', benchCreateOrderFile, True),
+    ('geometry-extraction', benchGeometry, False),
+    ('encode-png', benchEncodePNG, False),
+    ('png-stream', benchPNGStream, False)
+]
+
+# -----------------------------------------------------------------------------
+# Runner
+# -----------------------------------------------------------------------------
+
+def runBenchmarks(sizes, layerCounts, repeat, selection=None):
+    results = {}
+    rootDir = tempfile.mkdtemp(prefix='tonic-benchmarks-')
+    try:
+        for name, function, useLayers in benchmarks:
+            if selection and name not in selection:
+                continue
+
+            for size in sizes:
+                for layers in (layerCounts if useLayers else [1]):
+                    key = '%s %dx%d' % (name, size, size) + ('x%d' % layers if useLayers else '')
+                    best = None
+                    for run in range(repeat):
+                        workDir = os.path.join(rootDir, '%s_%d_%d_%d' % (name, size, layers, run))
+                        os.makedirs(workDir)
+                        measure = function(workDir, size, size, layers)
+                        shutil.rmtree(workDir)
+                        if best is None or measure[0] < best[0]:
+                            best = measure
+
+                    seconds, items, nbBytes = best
+                    results[key] = {
+                        'seconds': seconds,
+                        'itemsPerSecond': items / seconds if seconds else 0.0,
+                        'bytesPerSecond': nbBytes / seconds if seconds else 0.0
+                    }
+                    print '%-42s %10.4fs %12.3f Mitems/s %10.2f MB/s' % (key, seconds, results[key]['itemsPerSecond'] / 1e6, results[key]['bytesPerSecond'] / 1048576.0)
+                    sys.stdout.flush()
+    finally:
+        shutil.rmtree(rootDir, True)
+
+    return results
+
+def compareToBaseline(results, baseline, tolerance, selection=None):
+    """
+    Return the keys whose throughput dropped by more than tolerance, or
+    whose benchmark was measured in the baseline but no longer exists.
+    Sizes and layer counts that were not requested are skipped.
+    """
+    names = [ benchmark[0] for benchmark in benchmarks ]
+    regressions = []
+    for key in sorted(baseline):
+        name = key.split(' ')[0]
+        if key not in results and name not in names and (not selection or name in selection):
+            regressions.append(key)
+            print '%-42s %17s  MISSING' % (key, '')
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        ratio = results[key]['itemsPerSecond'] / baseline[key]['itemsPerSecond']
+        status = 'ok'
+        if ratio < 1.0 - tolerance:
+            status = 'REGRESSION'
+            regressions.append(key)
+        print '%-42s %6.2fx baseline  %s' % (key, ratio, status)
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless benchmarks of the Tonic converters and encoders')
+    parser.add_argument('--sizes', default='128,256,512', help='Comma separated image sizes (mesh resolutions for the geometry)')
+    parser.add_argument('--layers', default='2,4,8', help='Comma separated layer counts')
+    parser.add_argument('--repeat', type=int, default=3, help='Keep the best time out of N runs')
+    parser.add_argument('--only', default=None, help='Comma separated benchmark names')
+    parser.add_argument('--save', default=None, help='Write the results as a baseline file')
+    parser.add_argument('--baseline', default=defaultBaseline, help='Compare to a baseline file (the checked-in one by default)')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed throughput drop before failing')
+    args = parser.parse_args()
+
+    selection = args.only.split(',') if args.only else None
+    unknown = [ name for name in (selection or []) if name not in [ benchmark[0] for benchmark in benchmarks ] ]
+    if unknown:
+        parser.error('Unknown benchmark(s): %s' % ', '.join(unknown))
+
+    results = runBenchmarks([ int(v) for v in args.sizes.split(',') ], [ int(v) for v in args.layers.split(',') ], args.repeat, selection)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            f.write(json.dumps(results, indent=2, separators=(',', ': '), sort_keys=True))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if compareToBaseline(results, baseline, args.tolerance, selection):
+            sys.exit(1)
@@ -0,0 +1,92 @@
+#! /usr/bin/env python
+
+import os, shutil, tempfile
+
+import tonic
+from tonic.reader import DataReader
+from tonic.camera import SphericalCamera, CylindricalCamera, CameraTable, rotate, vectProduct
+
+# Batched cameras against the per-point computation they replace
+def sphericalBaseline(focalPoint, position, phiAxis, phiAngles, thetaAngles):
+    fp = tuple(i for i in focalPoint)
+    settings = []
+    for theta in thetaAngles:
+        for phi in phiAngles:
+            phiPos = rotate(phiAxis, -phi, fp, position)
+            thetaAxis = vectProduct(phiAxis, tuple(fp[i]-phiPos[i] for i in range(3)))
+            thetaPhiPos = rotate(thetaAxis, theta, fp, phiPos)
+            viewUp = rotate(thetaAxis, theta, (0,0,0), phiAxis)
+            settings.append({ 'thetaIdx': thetaAngles.index(theta), 'phiIdx': phiAngles.index(phi), 'focalPoint': fp, 'position': thetaPhiPos, 'viewUp': viewUp })
+    return settings
+
+def cylindricalBaseline(focalPoint, position, rotationAxis, phiAngles, translationValues):
+    settings = []
+    for translation in translationValues:
+        for phi in phiAngles:
+            phiPos = rotate(rotationAxis, phi, focalPoint, position)
+            newfocalPoint = tuple(focalPoint[i] + (translation*rotationAxis[i]) for i in range(3))
+            transPhiPoint = tuple(phiPos[i] + (translation*rotationAxis[i]) for i in range(3))
+            settings.append({ 'n_posIdx': translationValues.index(translation), 'phiIdx': phiAngles.index(phi), 'focalPoint': newfocalPoint, 'position': transPhiPoint, 'viewUp': rotationAxis })
+    return settings
+
+def assertSameVector(a, b, tolerance=1e-9):
+    assert len(a) == 3 and len(b) == 3, (a, b)
+    assert max(abs(a[i] - b[i]) for i in range(3)) < tolerance, (a, b)
+
+def compare(camera, baseline, indexNames):
+    count = 0
+    for cameraData, expected in zip(camera, baseline):
+        for name in indexNames:
+            assert cameraData[name] == expected[name]
+        for name in ['focalPoint', 'position', 'viewUp']:
+            assertSameVector(cameraData[name], expected[name])
+        count += 1
+    assert count == len(baseline) == len(camera)
+
+    # Random access matches the iteration
+    for idx in [0, len(baseline) / 2, len(baseline) - 1]:
+        assertSameVector(camera[idx]['position'], baseline[idx]['position'])
+
+    return count
+
+focalPoint = (1.0, 2.0, 3.0)
+phiAngles = range(0, 360, 30)
+thetaAngles = range(-60, 61, 30)
+
+for position, phiAxis in [ ((1.0, 12.0, 3.0), (0, 0, 1)), ((-4.0, 2.0, 7.5), (0.0, 0.6, 0.8)) ]:
+    dh = tonic.DataHandler('/tmp/camera_baseline')
+    camera = SphericalCamera(dh, focalPoint, position, phiAxis, phiAngles, thetaAngles)
+    count = compare(camera, sphericalBaseline(focalPoint, position, phiAxis, phiAngles, thetaAngles), ['thetaIdx', 'phiIdx'])
+    print 'Spherical camera: %d positions match the baseline' % count
+
+    # Other traversal orders visit the same positions once
+    for order in ['serpentine', 'hilbert']:
+        dh = tonic.DataHandler('/tmp/camera_baseline')
+        ordered = SphericalCamera(dh, focalPoint, position, phiAxis, phiAngles, thetaAngles, order)
+        visited = sorted((cameraData['thetaIdx'], cameraData['phiIdx']) for cameraData in ordered)
+        assert visited == [ (t, p) for t in range(len(thetaAngles)) for p in range(len(phiAngles)) ]
+
+translationValues = [ -1.5, 0.0, 2.0, 4.5 ]
+for position, rotationAxis in [ ((1.0, 12.0, 3.0), (0, 0, 1)), ((-4.0, 2.0, 7.5), (0.0, 0.6, 0.8)) ]:
+    dh = tonic.DataHandler('/tmp/camera_baseline')
+    camera = CylindricalCamera(dh, focalPoint, position, rotationAxis, phiAngles, translationValues)
+    count = compare(camera, cylindricalBaseline(focalPoint, position, rotationAxis, phiAngles, translationValues), ['n_posIdx', 'phiIdx'])
+    print 'Cylindrical camera: %d positions match the baseline' % count
+
+# The camera table keeps its name when the entries are compressed
+dataset_destination_path = tempfile.mkdtemp(prefix='tonic-cameras-')
+try:
+    dh = tonic.DataHandler(dataset_destination_path)
+    dh.setCompression('gzip')
+    dh.registerData(name='order', type='array', fileName='_order.uint8')
+    camera = SphericalCamera(dh, focalPoint, (1.0, 12.0, 3.0), (0, 0, 1), phiAngles, thetaAngles)
+    CameraTable(camera, dh).write()
+    dh.writeDataDescriptor()
+
+    assert os.path.exists(os.path.join(dataset_destination_path, 'cameras.float32'))
+    table = DataReader(dataset_destination_path).getCameraTable()
+    assert table.shape == (len(camera), CameraTable.stride)
+    assertSameVector(table[1][0:3], camera[1]['position'], 1e-4)
+    print 'Camera table: %d rows stored uncompressed' % len(table)
+finally:
+    shutil.rmtree(dataset_destination_path)
@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+
+import os, json, shutil, tempfile
+
+import tonic
+from tonic.reader import DataReader
+from tonic.compress import DatasetCompressor
+
+# Recompress a dataset whose descriptor lives partly in sidecar files
+def createContent(time, contour):
+    return ('%d-%d|' % (time, contour)) * 100
+
+dataset_destination_path = tempfile.mkdtemp(prefix='tonic-compress-')
+try:
+    dh = tonic.DataHandler(dataset_destination_path)
+    dh.setDescriptorLayout(maxInlineValues=2, sidecarSections=['Composite'])
+    dh.addSection('Composite', { 'name': 'Seb', 'pipeline': { 'a': 1, 'b': 2}})
+    dh.registerArgument(priority=1, name='contour', values=range(3))
+    dh.registerArgument(priority=2, name='time', values=range(4))
+    dh.registerData(name='order', type='array', fileName='_order.uint8')
+    dh.registerData(name='image', type='blob', mimeType='image/png', fileName='.png')
+    dh.enableManifest()
+
+    for time in dh.time:
+        for contour in dh.contour:
+            dh.writeData('order', createContent(time, contour))
+            dh.writeData('image', 'not compressed')
+            dh.markDataWritten('order', 'image')
+    dh.writeDataDescriptor()
+
+    indexPath = os.path.join(dataset_destination_path, 'index.json')
+    with open(indexPath, 'r') as f:
+        assert json.load(f)['arguments']['time']['values'] == { 'href': 'descriptor/arguments_time.json' }
+
+    compressor = DatasetCompressor(dataset_destination_path, { 'array': ('bz2', 9) }, 2)
+    report = compressor.run()
+    compressor.printReport(report)
+    assert report.keys() == ['order']
+    assert report['order']['files'] == 12
+
+    # Sidecar references are kept, sizes follow the new files
+    with open(indexPath, 'r') as f:
+        descriptor = json.load(f)
+    assert descriptor['arguments']['time']['values'] == { 'href': 'descriptor/arguments_time.json' }
+    assert descriptor['Composite'] == { 'href': 'descriptor/Composite.json' }
+
+    orderItem = [ item for item in descriptor['data'] if item['name'] == 'order' ][0]
+    assert orderItem['metadata']['compression']['codec'] == 'bz2'
+    assert orderItem['metadata']['output']['bytes'] == report['order']['after']
+    imageBytes = 12 * len('not compressed')
+    assert descriptor['metadata']['output']['bytes'] == report['order']['after'] + imageBytes
+
+    reader = DataReader(dataset_destination_path)
+    for time in range(4):
+        for contour in range(3):
+            assert reader.getData('order', time=time, contour=contour).tostring() == createContent(time, contour)
+
+    # The manifest follows the recompressed files
+    dh = tonic.DataHandler(dataset_destination_path)
+    dh.setCompression('bz2')
+    dh.registerArgument(priority=1, name='contour', values=range(3))
+    dh.registerArgument(priority=2, name='time', values=range(4))
+    dh.registerData(name='order', type='array', fileName='_order.uint8')
+    dh.registerData(name='image', type='blob', mimeType='image/png', fileName='.png')
+    dh.enableManifest(verify=True)
+    for time in dh.time:
+        for contour in dh.contour:
+            assert dh.isDataWritten('order', 'image')
+finally:
+    shutil.rmtree(dataset_destination_path)
+
+# Entries gzipped while writing are kept, deduplicated hard links follow
+# the recompressed files
+dataset_destination_path = tempfile.mkdtemp(prefix='tonic-compress-')
+try:
+    dh = tonic.DataHandler(dataset_destination_path)
+    dh.setCompression('gzip')
+    dh.setDeduplication(hardLinks=True)
+    dh.registerArgument(priority=1, name='time', values=range(6))
+    dh.registerData(name='order', type='array', fileName='_order.uint8')
+    for time in dh.time:
+        dh.writeData('order', createContent(time % 2, 0))
+    dh.writeDataDescriptor()
+
+    def storedFiles():
+        return sorted(name for name in os.listdir(dataset_destination_path) if name.endswith('order.uint8.gz') or name.endswith('order.uint8.bz2'))
+
+    gzipped = storedFiles()
+    inodes = [ os.stat(os.path.join(dataset_destination_path, name)).st_ino for name in gzipped ]
+    report = DatasetCompressor(dataset_destination_path, nbProcesses=1).run()
+    assert report['order']['files'] == 2 and report['order']['before'] == report['order']['after']
+    assert inodes == [ os.stat(os.path.join(dataset_destination_path, name)).st_ino for name in storedFiles() ]
+
+    DatasetCompressor(dataset_destination_path, { 'array': ('bz2', 9) }, 1).run()
+    assert len(storedFiles()) == 6 and all(name.endswith('.bz2') for name in storedFiles())
+    assert len(set(os.stat(os.path.join(dataset_destination_path, name)).st_ino for name in storedFiles())) == 2
+
+    reader = DataReader(dataset_destination_path)
+    for time in range(6):
+        assert reader.getData('order', time=time).tostring() == createContent(time % 2, 0)
+    print 'Deduplicated dataset: 2 stored entries, 6 hard links'
+finally:
+    shutil.rmtree(dataset_destination_path)
+
+# Nothing to compress is an error
+dataset_destination_path = tempfile.mkdtemp(prefix='tonic-compress-')
+try:
+    dh = tonic.DataHandler(dataset_destination_path)
+    dh.registerArgument(priority=1, name='time', values=range(4))
+    dh.registerData(name='order', type='array', fileName='_order.uint8')
+    dh.writeDataDescriptor()
+
+    try:
+        DatasetCompressor(dataset_destination_path, nbProcesses=1).run()
+        raise AssertionError('Missing entries were not reported')
+    except IOError as error:
+        print 'Empty dataset:', error
+finally:
+    shutil.rmtree(dataset_destination_path)
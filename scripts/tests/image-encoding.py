@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+
+import io, threading
+
+from PIL import Image
+
+from tonic.image import encodePNG, assembleRows, PNGStreamWriter, AsyncImageWriter
+
+# PNG written by tonic decode to the original pixels
+def createPixels(width, height, components):
+    return bytearray((x * 7 + y * 13 + c * 61) % 256 for y in range(height) for x in range(width) for c in range(components))
+
+def flipRows(pixels, width, height, components):
+    stride = width * components
+    return ''.join(str(pixels[row * stride:(row + 1) * stride]) for row in range(height - 1, -1, -1))
+
+def decode(content):
+    return Image.open(io.BytesIO(content))
+
+width, height = 37, 23
+for components, mode in [ (1, 'L'), (3, 'RGB'), (4, 'RGBA') ]:
+    # VTK pixels start with the bottom row
+    pixels = createPixels(width, height, components)
+    image = decode(encodePNG(pixels, width, height, components))
+    assert image.mode == mode and image.size == (width, height)
+    assert image.tobytes() == flipRows(pixels, width, height, components)
+
+    image = decode(encodePNG(pixels, width, height, components, flip=False))
+    assert image.tobytes() == str(pixels)
+    print 'encodePNG %-4s round-trips' % mode
+
+# Streamed image assembled from 3x2 tiles, one band of tiles at a time
+tileWidth, tileHeight, components = 8, 5, 3
+full = createPixels(3 * tileWidth, 2 * tileHeight, components)
+stride = 3 * tileWidth * components
+output = io.BytesIO()
+stream = PNGStreamWriter(output, 3 * tileWidth, 2 * tileHeight, components)
+for tileY in [1, 0]:
+    # Tiles are bottom-up like the VTK captures
+    tiles = []
+    for tileX in range(3):
+        tile = bytearray()
+        for row in range(tileY * tileHeight, (tileY + 1) * tileHeight):
+            start = row * stride + tileX * tileWidth * components
+            tile += full[start:start + tileWidth * components]
+        tiles.append(tile)
+    stream.writeRows(assembleRows(tiles, tileWidth * components, tileHeight))
+stream.close()
+assert decode(output.getvalue()).tobytes() == flipRows(full, 3 * tileWidth, 2 * tileHeight, components)
+print 'PNGStreamWriter matches the full image'
+
+# Asynchronous encoding delivers every frame, buffers are reused
+results = {}
+lock = threading.Lock()
+def store(index, content):
+    with lock:
+        results[index] = content
+
+writer = AsyncImageWriter(nbWorkers=2, nbBuffers=2)
+for index in range(10):
+    pixels = createPixels(width, height + index, 3)
+    writer.submit(pixels, width, height + index, 3, lambda content, index=index: store(index, content))
+writer.close()
+assert sorted(results) == range(10)
+for index, content in results.iteritems():
+    assert decode(content).tobytes() == flipRows(createPixels(width, height + index, 3), width, height + index, 3)
+print 'AsyncImageWriter encoded %d frames' % len(results)
@@ -0,0 +1,56 @@
+#! /usr/bin/env python
+
+import json, shutil, tempfile
+
+import tonic
+from tonic.reader import DataReader
+from tonic.storage import PackStorage
+
+# Workers write their share of the sweep into their own packs, the merged
+# descriptor reads every work item back
+def createContent(time, contour):
+    return ('%d-%d|' % (time, contour)) * (5 + time)
+
+def runWorker(basePath, nbParts, partIdx, strategy):
+    dh = tonic.DataHandler(basePath)
+    dh.setStorage(PackStorage(sliceDepth=0, writerId=partIdx))
+    dh.registerArgument(priority=1, name='contour', values=range(3))
+    dh.registerArgument(priority=2, name='time', values=range(4))
+    dh.registerData(name='order', type='array', fileName='_order.uint8')
+    dh.updateBasePattern()
+
+    for workItem in dh.getWorkItemPartition(nbParts, partIdx, strategy):
+        dh.setArguments(**dict(workItem))
+        dh.writeData('order', createContent(dh.realValues['time'][dh.current['time']], dh.realValues['contour'][dh.current['contour']]))
+
+    dh.addDataMetaData('order', 'ranges', { 'value': [ partIdx, partIdx + 1 ] })
+    fileName = 'index_%d.json' % partIdx
+    dh.writeDataDescriptor(fileName)
+    return fileName
+
+for strategy in ['block', 'round-robin']:
+    for nbParts in [2, 3]:
+        dataset_destination_path = tempfile.mkdtemp(prefix='tonic-merge-')
+        try:
+            fileNames = [ runWorker(dataset_destination_path, nbParts, partIdx, strategy) for partIdx in range(nbParts) ]
+            merged = tonic.mergeDataDescriptors(dataset_destination_path, fileNames)
+            assert len(merged['PackedStorage']['packs']) == nbParts
+            assert len(merged['PackedStorage']['entries']) == 12
+
+            reader = DataReader(dataset_destination_path)
+            for time in range(4):
+                for contour in range(3):
+                    assert reader.getData('order', time=time, contour=contour).tostring() == createContent(time, contour)
+
+            # Output statistics cover every partition
+            totalBytes = sum(len(createContent(t, c)) for t in range(4) for c in range(3))
+            with open('%s/index.json' % dataset_destination_path, 'r') as f:
+                descriptor = json.load(f)
+            order = descriptor['data'][0]
+            assert order['metadata']['output']['files'] == 12
+            assert order['metadata']['output']['bytes'] == totalBytes
+            assert order['metadata']['ranges']['value'] == [ 0, nbParts ]
+            assert descriptor['metadata']['output']['bytes'] == totalBytes
+            print '%-12s %d workers merged, 12 entries read back' % (strategy, nbParts)
+        finally:
+            shutil.rmtree(dataset_destination_path)
@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+
+import os, shutil, tempfile
+
+import tonic
+from tonic.storage import gzipCompress
+
+# Sampled entries are stored like the sweep would store them
+def createContent(time, contour):
+    return ('%d-%d|' % (time, contour)) * 200
+
+def createHandler(path):
+    dh = tonic.DataHandler(path)
+    dh.registerArgument(priority=1, name='contour', values=range(3))
+    dh.registerArgument(priority=2, name='time', values=range(4))
+    dh.registerData(name='order', type='array', fileName='_order.uint8')
+    dh.registerData(name='image', type='blob', mimeType='image/png', fileName='.png')
+    return dh
+
+def writeSample(dh):
+    def sample(workItem):
+        arguments = dict(workItem)
+        dh.writeData('order', createContent(arguments['time'], arguments['contour']))
+        dh.writeData('image', createContent(arguments['time'], arguments['contour']))
+    return sample
+
+dataset_destination_path = tempfile.mkdtemp(prefix='tonic-plan-')
+try:
+    dh = createHandler(dataset_destination_path)
+    report = dh.planSweep(writeSample(dh), nbSamples=12, seed=0)
+    totalBytes = 2 * sum(len(createContent(t, c)) for t in range(4) for c in range(3))
+    assert report['workItems'] == 12 and report['totalFiles'] == 24
+    assert report['compression'] is None
+    assert report['bytes'] == report['compressedBytes'] == totalBytes
+
+    # Only the entries matching the extensions are compressed, at the level
+    # given to setCompression()
+    dh.setCompression('gzip', level=1, extensions=('.uint8',))
+    report = dh.planSweep(writeSample(dh), nbSamples=12, seed=0)
+    assert report['compression'] == 'gzip' and report['bytes'] == totalBytes
+    orderBytes = sum(len(gzipCompress(createContent(t, c), 1)) for t in range(4) for c in range(3))
+    assert report['compressedBytes'] == orderBytes + totalBytes / 2
+
+    # Nothing reaches the disk or the output statistics
+    assert os.listdir(dataset_destination_path) == []
+    assert dh.getOutputStatistics() == {}
+    print 'Plan: %d bytes, %d stored with %s' % (report['bytes'], report['compressedBytes'], report['compression'])
+finally:
+    shutil.rmtree(dataset_destination_path)
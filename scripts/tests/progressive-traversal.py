@@ -0,0 +1,47 @@
+#! /usr/bin/env python
+
+import copy, shutil, tempfile
+
+import tonic
+from tonic.camera import MultiViewCamera
+
+# Nested progressive loops publish each argument once per completed level,
+# argument values are listed as stored in index.json
+dataset_destination_path = tempfile.mkdtemp(prefix='tonic-progressive-')
+try:
+    dh = tonic.DataHandler(dataset_destination_path)
+    dh.registerArgument(priority=1, name='contour', values=range(3))
+    dh.registerArgument(priority=2, name='time', values=range(8))
+    dh.registerData(name='order', type='array', fileName='_order.uint8')
+    dh.setProgressiveTraversal(4, 'time', 'contour')
+
+    snapshots = []
+    writeDataDescriptor = dh.writeDataDescriptor
+    def recordDescriptor(*args, **kwargs):
+        snapshots.append(copy.deepcopy(dh.metadata.get('available')))
+        writeDataDescriptor(*args, **kwargs)
+    dh.writeDataDescriptor = recordDescriptor
+
+    visited = []
+    for time in dh.time:
+        for contour in dh.contour:
+            dh.writeData('order', '%d-%d' % (time, contour))
+            visited.append((time, contour))
+    assert sorted(visited) == [ (t, c) for t in range(8) for c in range(3) ]
+    assert visited[:3] == [ (0, 0), (0, 2), (0, 1) ]
+
+    assert snapshots == [
+        { 'time': [], 'contour': [ '0' ] },
+        { 'time': [], 'contour': [ '0', '2' ] },
+        { 'time': [] },
+        { 'time': [ '0', '4' ] },
+        { 'time': [ '0', '2', '4', '6' ] },
+        None ]
+    print 'Nested traversal: %d descriptor updates for %d entries' % (len(snapshots), len(visited))
+
+    # Nothing to walk without view points
+    camera = MultiViewCamera(dh)
+    assert list(camera) == []
+    print 'Empty multi view camera yields nothing'
+finally:
+    shutil.rmtree(dataset_destination_path)
@@ -0,0 +1,79 @@
+#! /usr/bin/env python
+
+import os, shutil, tempfile
+
+import tonic
+from tonic.reader import DataReader
+from tonic.storage import PackStorage, ArchiveStorage
+
+# Interrupt a sweep, then resume it: only the missing entries are written
+class Interrupted(Exception):
+    pass
+
+def createContent(time, contour):
+    return ('%d-%d|' % (time, contour)) * 50
+
+def runSweep(basePath, mode, stopAfter=None):
+    dh = tonic.DataHandler(basePath)
+    if mode == 'pack':
+        dh.setStorage(PackStorage())
+    elif mode == 'archive':
+        dh.setStorage(ArchiveStorage())
+    elif mode == 'compressed':
+        dh.setCompression('gzip')
+    dh.enableManifest(verify=True)
+    dh.registerArgument(priority=1, name='contour', values=range(3))
+    dh.registerArgument(priority=2, name='time', values=range(4))
+    dh.registerData(name='order', type='array', fileName='_order.uint8')
+
+    written = []
+    try:
+        for time in dh.time:
+            for contour in dh.contour:
+                if dh.isDataWritten('order'):
+                    continue
+                if stopAfter is not None and len(written) == stopAfter:
+                    raise Interrupted()
+                dh.writeData('order', createContent(time, contour))
+                dh.markDataWritten('order')
+                written.append((time, contour))
+    except Interrupted:
+        # Stop as on a crash once the pending writes are done
+        dh.flush()
+        return written
+
+    dh.writeDataDescriptor()
+    return written
+
+for mode in ['files', 'pack', 'archive', 'compressed']:
+    dataset_destination_path = tempfile.mkdtemp(prefix='tonic-resume-')
+    try:
+        first = runSweep(dataset_destination_path, mode, 5)
+        second = runSweep(dataset_destination_path, mode)
+        assert len(first) == 5
+        assert sorted(first + second) == [ (t, c) for t in range(4) for c in range(3) ]
+
+        # Nothing left to do
+        assert runSweep(dataset_destination_path, mode) == []
+
+        reader = DataReader(dataset_destination_path)
+        for time in range(4):
+            for contour in range(3):
+                assert reader.getData('order', time=time, contour=contour).tostring() == createContent(time, contour)
+
+        with open(os.path.join(dataset_destination_path, 'manifest.txt'), 'r') as manifest:
+            nbLines = len(manifest.readlines())
+        print '%-12s first run %d, resumed %d, manifest %d entries' % (mode, len(first), len(second), nbLines)
+    finally:
+        shutil.rmtree(dataset_destination_path)
+
+# A corrupted file is written again
+dataset_destination_path = tempfile.mkdtemp(prefix='tonic-resume-')
+try:
+    runSweep(dataset_destination_path, 'files')
+    with open(os.path.join(dataset_destination_path, '2', '1_order.uint8'), 'wb') as f:
+        f.write('x' * len(createContent(2, 1)))
+    assert runSweep(dataset_destination_path, 'files') == [ (2, 1) ]
+    print 'corrupted entry written again'
+finally:
+    shutil.rmtree(dataset_destination_path)
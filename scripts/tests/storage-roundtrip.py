@@ -0,0 +1,79 @@
+#! /usr/bin/env python
+
+import os, shutil, tempfile
+
+import tonic
+from tonic.reader import DataReader
+from tonic.storage import MemoryStorage, PackStorage, ArchiveStorage
+
+# Write the same sweep with every storage backend and read it back
+def createContent(name, time, contour):
+    return ('%s-%d-%d|' % (name, time, contour)) * (10 + time * contour)
+
+def configure(dh, mode):
+    if mode == 'pack':
+        dh.setStorage(PackStorage())
+    elif mode == 'archive':
+        dh.setStorage(ArchiveStorage())
+    elif mode == 'memory':
+        dh.setStorage(MemoryStorage())
+    elif mode == 'compressed':
+        dh.setCompression('gzip')
+    elif mode == 'bz2':
+        dh.setCompression('bz2')
+    elif mode == 'deduplicated':
+        dh.setDeduplication()
+    elif mode == 'compressed-pack':
+        dh.setCompression('gzip')
+        dh.setStorage(PackStorage())
+
+for mode in ['files', 'pack', 'archive', 'memory', 'compressed', 'bz2', 'deduplicated', 'compressed-pack']:
+    dataset_destination_path = tempfile.mkdtemp(prefix='tonic-storage-')
+    try:
+        dh = tonic.DataHandler(dataset_destination_path)
+        configure(dh, mode)
+        dh.registerArgument(priority=1, name='contour', values=range(3))
+        dh.registerArgument(priority=2, name='time', values=range(4))
+        dh.registerData(name='order', type='array', fileName='_order.uint8')
+        dh.registerData(name='image', type='blob', mimeType='image/png', fileName='.png')
+
+        # One directory per time step, only for one file per entry storages
+        assert dh.createDirectories() == (4 if dh.storage.needDirectories() else 0)
+
+        for time in dh.time:
+            for contour in dh.contour:
+                dh.writeData('order', createContent('order', time, contour))
+                # Same image for every contour
+                dh.writeData('image', createContent('image', time, 0))
+        dh.writeDataDescriptor()
+
+        nbEntries = 0
+        if mode == 'memory':
+            for time in range(4):
+                for contour in range(3):
+                    assert dh.storage.getEntry('%d/%d_order.uint8' % (time, contour)) == createContent('order', time, contour)
+                    nbEntries += 1
+        else:
+            reader = DataReader(dataset_destination_path)
+            for time in range(4):
+                for contour in range(3):
+                    assert reader.getData('order', time=time, contour=contour).tostring() == createContent('order', time, contour)
+                    assert str(reader.getData('image', time=time, contour=contour)) == createContent('image', time, 0)
+                    nbEntries += 1
+
+        if mode == 'deduplicated':
+            assert len(reader.references) == 8
+
+            # Files written by path stay fetchable, as links to one copy
+            for name in ['tile_0.png', 'tile_1.png']:
+                dh.writeFile(os.path.join(dataset_destination_path, name), createContent('tile', 0, 0))
+            dh.flush()
+            tiles = [ os.path.join(dataset_destination_path, name) for name in ['tile_0.png', 'tile_1.png'] ]
+            assert [ open(path, 'rb').read() for path in tiles ] == [ createContent('tile', 0, 0) ] * 2
+            assert os.stat(tiles[0]).st_ino == os.stat(tiles[1]).st_ino
+
+        statistics = dh.getOutputStatistics()
+        assert statistics['order']['rawBytes'] == sum(len(createContent('order', t, c)) for t in range(4) for c in range(3))
+        print '%-16s %d entries read back, order stored in %d bytes' % (mode, nbEntries, statistics['order']['bytes'])
+    finally:
+        shutil.rmtree(dataset_destination_path)
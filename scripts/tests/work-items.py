@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+
+import tonic
+from tonic import partitionWorkItems
+
+# Every work item belongs to exactly one partition, whatever the strategy
+dh = tonic.DataHandler('/tmp/work_items')
+dh.registerArgument(priority=1, name='contour', values=range(5))
+dh.registerArgument(priority=2, name='time', values=range(0, 10))
+dh.registerArgument(priority=2, name='field', values=['a', 'b', 'c'])
+
+workItems = dh.getWorkItems()
+assert len(workItems) == dh.getNumberOfWorkItems() == 150
+assert len(set(workItems)) == len(workItems)
+for index, workItem in enumerate(workItems):
+    assert dh.getWorkItem(index) == workItem
+print 'Work items: %d, random access matches the list' % len(workItems)
+
+def cost(workItem):
+    return 1 + dict(workItem)['contour'] * dict(workItem)['contour']
+
+for strategy in ['block', 'round-robin', 'cost']:
+    for nbParts in [1, 2, 7, 150, 200]:
+        parts = [ partitionWorkItems(workItems, nbParts, partIdx, strategy, cost) for partIdx in range(nbParts) ]
+        assigned = [ workItem for part in parts for workItem in part ]
+        assert sorted(assigned) == sorted(workItems), (strategy, nbParts)
+
+        # Each partition keeps the original order
+        for part in parts:
+            assert part == sorted(part, key=workItems.index)
+
+        sizes = [ len(part) for part in parts ]
+        if strategy != 'cost':
+            assert max(sizes) - min(sizes) <= 1, (strategy, nbParts, sizes)
+        else:
+            loads = [ sum(cost(workItem) for workItem in part) for part in parts ]
+            assert max(loads) - min(loads) <= max(cost(workItem) for workItem in workItems)
+
+        assert parts == [ dh.getWorkItemPartition(nbParts, partIdx, strategy, cost) for partIdx in range(nbParts) ]
+    print '%-12s covers every work item once' % strategy
+
+for invalid in [ (2, 2, 'block', None), (2, -1, 'block', None), (2, 0, 'cost', None), (2, 0, 'unknown', None) ]:
+    try:
+        partitionWorkItems(workItems, *invalid)
+        raise AssertionError('Accepted %s' % str(invalid))
+    except ValueError:
+        pass
+print 'Invalid partitions rejected'